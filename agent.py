@@ -1,18 +1,21 @@
 import os
-import uuid
+import json
+import queue
+import asyncio
 import base64
-import requests
-from io import BytesIO
-from datetime import datetime, timedelta
+import threading
+import contextvars
 from dotenv import load_dotenv
-from PIL import Image, ImageDraw, ImageFont
-from langchain_openai import ChatOpenAI
-from langchain_tavily import TavilySearch
 
-from langchain.tools import tool
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-from langchain.memory import ConversationBufferWindowMemory
+from memory_store import create_memory_store
+from response_cache import response_cache, context_key, normalize_prompt
+from image_cache import image_cache
+from metrics import span
+from blob_store import blob_store, image_ref
+from context_builder import strip_reference, HISTORY_MAX_MESSAGES
+from retrieval import estimate_tokens
+from jobs import image_jobs, job_ref, IMAGE_MODE
+from rate_limit import limiter
 
 
 load_dotenv()
@@ -20,36 +23,64 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 CLOUDFLARE_API_TOKEN = os.getenv("CLOUDFLARE_API_TOKEN")
 CLOUDFLARE_ACCOUNT_ID = os.getenv("CLOUDFLARE_ACCOUNT_ID")
- 
+# Overridable so benchmarks can point the agent at local stand-ins (benchmarks/fake_services.py).
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+TAVILY_API_BASE_URL = os.getenv("TAVILY_API_BASE_URL", "https://api.tavily.com")
+CLOUDFLARE_API_BASE_URL = os.getenv("CLOUDFLARE_API_BASE_URL", "https://api.cloudflare.com/client/v4")
+# "background" builds the agent in a thread at startup, "eager" before the app serves anything;
+# by default it is built by the first request that needs it.
+AGENT_WARM_UP = os.getenv("AGENT_WARM_UP", "off")
 
-llm = ChatOpenAI(
-    model="openai/gpt-oss-120b",
-    temperature=0.7,
-    api_key=GROQ_API_KEY,
-    base_url="https://api.groq.com/openai/v1"
-)
 
+TAVILY_DESCRIPTION = "Search the web for recent, real-time, or factual information. Use only if necessary."
+IMAGE_DESCRIPTION = "Generate a banner with text."
+CLOUDFLARE_IMAGE_MODEL = "@cf/black-forest-labs/flux-1-schnell"
 
-@tool("TavilySearch", description="Search the web for recent, real-time, or factual information. Use only if necessary.")
-def tavily_search(query: str) -> str:
+
+TAVILY_MAX_RESULTS = 3
+
+
+def _tavily_request(query: str):
+    # Same request the langchain_tavily tool sends, but over the shared pooled client.
+    url = f"{TAVILY_API_BASE_URL}/search"
+    headers = {"Authorization": f"Bearer {TAVILY_API_KEY}", "Content-Type": "application/json"}
+    payload = {"query": query, "max_results": TAVILY_MAX_RESULTS}
+    return url, headers, payload
+
+
+def _tavily_result(query: str, data: dict) -> str:
+    if not data.get("results"):
+        return f"No search results found for '{query}'. Try a broader or rephrased query."
+    return json.dumps(data)
+
+
+def _tavily_search(query: str) -> str:
     try:
-        tavily = TavilySearch(api_key=TAVILY_API_KEY, max_results=3)
-        return tavily.run(query)
+        with span("tool.tavily") as current:
+            url, headers, payload = _tavily_request(query)
+            response = get_runtime().tavily_http.post(url, headers=headers, json=payload)
+            response.raise_for_status()
+            current.payload("output", len(response.content))
+            return _tavily_result(query, response.json())
     except Exception as e:
         return f" Tavily Search failed: {str(e)}"
-    
 
-@tool("GenerateImagePoster", return_direct=True, description="Generate a banner with text.")
-def generate_image_poster(input_text: str) -> str:
+
+async def _atavily_search(query: str) -> str:
     try:
-        CLOUDFLARE_API_TOKEN = os.getenv("CLOUDFLARE_API_TOKEN")
-        CLOUDFLARE_ACCOUNT_ID = os.getenv("CLOUDFLARE_ACCOUNT_ID")
+        with span("tool.tavily") as current:
+            url, headers, payload = _tavily_request(query)
+            response = await get_runtime().tavily_http.apost(url, headers=headers, json=payload)
+            response.raise_for_status()
+            current.payload("output", len(response.content))
+            return _tavily_result(query, response.json())
+    except Exception as e:
+        return f" Tavily Search failed: {str(e)}"
 
-        url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/@cf/black-forest-labs/flux-1-schnell"
-        headers = {"Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}"}
 
-        # Enhance the prompt via LLM (same as before)
-        enhancer_prompt = f"""
+def _enhancer_prompt(input_text: str) -> str:
+    # Enhance the prompt via LLM (same as before)
+    return f"""
         Rewrite the following user request as a SHORT, compact, professional image prompt
         (max 300 characters). Keep only the essential visual details
         and style keywords like "high resolution, cinematic, poster design".
@@ -57,46 +88,160 @@ def generate_image_poster(input_text: str) -> str:
 
         User request: {input_text}
         """
-        enhanced_prompt = llm.invoke(enhancer_prompt).content.strip()
 
-        payload = {"prompt": enhanced_prompt, "steps": 4}
 
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
+IMAGE_PARAMS = {"model": CLOUDFLARE_IMAGE_MODEL, "steps": 4}
+
+
+def _cloudflare_request(enhanced_prompt: str):
+    url = f"{CLOUDFLARE_API_BASE_URL}/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/{CLOUDFLARE_IMAGE_MODEL}"
+    headers = {"Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}"}
+    payload = {"prompt": enhanced_prompt, "steps": IMAGE_PARAMS["steps"]}
+    return url, headers, payload
+
 
-        data = response.json()
-        if "result" not in data or "image" not in data["result"]:
-            return f"Error generating image: {data}"
+def _image_bytes(data: dict):
+    if "result" not in data or "image" not in data["result"]:
+        return None
+    return base64.b64decode(data["result"]["image"])
 
-        image_base64 = data["result"]["image"]
-        return f"data:image/png;base64,{image_base64}"
+
+def _generate_image_poster(input_text: str) -> str:
+    runtime = get_runtime()
+    try:
+        enhanced_prompt = image_cache.get_prompt(input_text) if image_cache else None
+        if enhanced_prompt is None:
+            with span("tool.image.enhance"):
+                enhanced_prompt = runtime.llm.invoke(_enhancer_prompt(input_text)).content.strip()
+            if image_cache:
+                image_cache.put_prompt(input_text, enhanced_prompt)
+
+        image_bytes = image_cache.get_image(enhanced_prompt, IMAGE_PARAMS) if image_cache else None
+        if image_bytes is None:
+            url, headers, payload = _cloudflare_request(enhanced_prompt)
+            with span("tool.image.render") as current:
+                response = runtime.cloudflare_http.post(url, headers=headers, json=payload)
+                response.raise_for_status()
+                current.payload("output", len(response.content))
+
+            data = response.json()
+            image_bytes = _image_bytes(data)
+            if image_bytes is None:
+                return f"Error generating image: {data}"
+            if image_cache:
+                image_cache.put_image(enhanced_prompt, IMAGE_PARAMS, image_bytes)
+
+        # Only a short reference travels through the agent, memory and the messages table.
+        return image_ref(blob_store.put(image_bytes))
 
     except Exception as e:
         return f" Image generation failed: {str(e)}"
 
 
-tools = [tavily_search, generate_image_poster]
+async def _agenerate_image_poster(input_text: str) -> str:
+    runtime = get_runtime()
+    try:
+        enhanced_prompt = image_cache.get_prompt(input_text) if image_cache else None
+        if enhanced_prompt is None:
+            with span("tool.image.enhance"):
+                enhanced = await runtime.llm.ainvoke(_enhancer_prompt(input_text))
+            enhanced_prompt = enhanced.content.strip()
+            if image_cache:
+                await asyncio.to_thread(image_cache.put_prompt, input_text, enhanced_prompt)
+
+        image_bytes = await asyncio.to_thread(image_cache.get_image, enhanced_prompt, IMAGE_PARAMS) if image_cache else None
+        if image_bytes is None:
+            url, headers, payload = _cloudflare_request(enhanced_prompt)
+            with span("tool.image.render") as current:
+                response = await runtime.cloudflare_http.apost(url, headers=headers, json=payload)
+                response.raise_for_status()
+                current.payload("output", len(response.content))
+
+            data = response.json()
+            image_bytes = _image_bytes(data)
+            if image_bytes is None:
+                return f"Error generating image: {data}"
+            if image_cache:
+                await asyncio.to_thread(image_cache.put_image, enhanced_prompt, IMAGE_PARAMS, image_bytes)
+
+        return image_ref(await asyncio.to_thread(blob_store.put, image_bytes))
+
+    except Exception as e:
+        return f" Image generation failed: {str(e)}"
+
+
+# Set per request by ask*(image_mode="job"): the banner is queued as a background job and the
+# tool returns a job:// reference right away instead of waiting for Cloudflare.
+_image_mode = contextvars.ContextVar("image_mode", default=IMAGE_MODE)
+
+
+class Turn:
+    """Who a turn runs for, so the image tool charges their image budget (rate_limit.py)."""
+
+    def __init__(self, user_id, session_id):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.rejected = None   # the image tool's Decision when the budget was exhausted
+
+    def limits(self) -> dict:
+        return {"retry_after": self.rejected.retry_after_seconds} if self.rejected else {}
+
+
+# The same object is visible to tools on pool threads, so a rejection there is seen by ask*().
+_turn = contextvars.ContextVar("turn", default=None)
+
+
+def _enter_turn(image_mode, user_id, session_id):
+    turn = Turn(user_id, session_id)
+    return turn, (_image_mode.set(image_mode or IMAGE_MODE), _turn.set(turn))
+
+
+def _exit_turn(tokens):
+    _image_mode.reset(tokens[0])
+    _turn.reset(tokens[1])
+
+
+def _image_rejected(turn, decision):
+    turn.rejected = decision
+    return f" Image generation failed: {decision.message()}"
 
 
+def _queue_image_job(input_text: str) -> str:
+    # Identical requests already queued or rendering share one job.
+    key = (normalize_prompt(input_text), IMAGE_PARAMS["model"], IMAGE_PARAMS["steps"])
+    return job_ref(image_jobs.submit(key, _generate_image_poster, input_text))
 
-SESSION_MEMORY = {}
+
+def _image_tool(input_text: str) -> str:
+    turn = _turn.get()
+    if turn is not None:
+        decision = limiter.acquire("image", turn.user_id, turn.session_id)
+        if not decision.allowed:
+            return _image_rejected(turn, decision)
+    if _image_mode.get() == "job":
+        return _queue_image_job(input_text)
+    return _generate_image_poster(input_text)
+
+
+async def _aimage_tool(input_text: str) -> str:
+    turn = _turn.get()
+    if turn is not None:
+        decision = await limiter.aacquire("image", turn.user_id, turn.session_id)
+        if not decision.allowed:
+            return _image_rejected(turn, decision)
+    if _image_mode.get() == "job":
+        return _queue_image_job(input_text)
+    return await _agenerate_image_poster(input_text)
+
+
+# Per-session conversation memory; MEMORY_BACKEND=postgres shares it across workers.
+memory_store = create_memory_store()
 def get_memory(session_id: str):
-    now = datetime.utcnow()
-    expired_ids = [sid for sid, data in SESSION_MEMORY.items() if now - data["start"] > timedelta(hours=24)]
-    for sid in expired_ids:
-        del SESSION_MEMORY[sid]
-    if session_id in SESSION_MEMORY:
-        mem = SESSION_MEMORY[session_id]["memory"]
-    else:
-        mem = ConversationBufferWindowMemory(memory_key="chat_history",k=5, return_messages=True)
-        SESSION_MEMORY[session_id] = {"start": now, "memory": mem}
-    return mem
+    return memory_store.get(session_id)
 
 
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system",
-     """You are a professional copywriter AI, specialized in generating all types of content: blogs, LinkedIn posts, ads, social media captions, product descriptions, presentations, resumes, and similar text-based copy.
+SYSTEM_PROMPT = """You are a professional copywriter AI, specialized in generating all types of content: blogs, LinkedIn posts, ads, social media captions, product descriptions, presentations, resumes, and similar text-based copy.
 
 How to behave by default:
 1. Always generate content in a polished, natural, humanized format (no raw markdown symbols like **, ###, or *).
@@ -165,40 +310,342 @@ Fallback:
 
 Key Reminder: 
 Never output markdown syntax like **bold**, ### headings, or *lists*. Always return plain, polished text ready to publish.
-"""),
+"""
 
-    MessagesPlaceholder("chat_history"),
-    ("human", "{input}"),
-    ("placeholder", "{agent_scratchpad}")
-])
 
-agent = create_tool_calling_agent(llm=llm, tools=tools, prompt=prompt)
-
-def ask(user_input: str, session_id: str) -> dict:
+class AgentRuntime:
     """
-    Takes the user's input and session_id from app.py, processes the query through the agent,
-    and returns a dict { "output": ... } for JSON response.
+    The LLM, HTTP clients, tools and executor shared by every request. Building them imports
+    LangChain, the OpenAI SDK and httpx, which takes seconds, so it happens on first use
+    (get_runtime()) or in warm_up() instead of when this module is imported.
     """
-    memory = get_memory(session_id)
-    agent_executor = AgentExecutor(agent=agent, tools=tools, memory=memory)
 
+    def __init__(self):
+        from langchain_openai import ChatOpenAI
+        from langchain.tools import StructuredTool
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from langchain.agents import create_tool_calling_agent
+        from http_clients import service_client
+        from parallel_executor import ParallelAgentExecutor, TOOL_TIMEOUTS, TOOL_TIMEOUT_SECONDS
+        from context_builder import ContextBuilder
+
+        # One keep-alive client per external service, each with timeouts, retries, a circuit breaker
+        # and a concurrency limit (http_clients.py). The image timeout matches the agent's timeout
+        # for the tool, so an abandoned render doesn't hold a worker forever.
+        image_timeout = TOOL_TIMEOUTS.get("GenerateImagePoster", TOOL_TIMEOUT_SECONDS)
+        self.groq_http = service_client("groq", read_timeout=60, max_concurrency=64)
+        self.tavily_http = service_client("tavily", read_timeout=20, max_concurrency=16)
+        self.cloudflare_http = service_client("cloudflare", read_timeout=image_timeout, max_concurrency=8)
+
+        self.llm = ChatOpenAI(
+            model="openai/gpt-oss-120b",
+            temperature=0.7,
+            api_key=GROQ_API_KEY,
+            base_url=GROQ_BASE_URL,
+            stream_usage=True,
+            # Retries happen in the guarded transport, so the breaker sees every attempt.
+            max_retries=0,
+            http_client=self.groq_http.httpx_client(),
+            http_async_client=self.groq_http.httpx_async_client()
+        )
+
+        # Each tool carries a sync and an async implementation so the same agent can serve
+        # ask() from Flask threads and aask() from the ASGI app without blocking the event loop.
+        self.tavily_search = StructuredTool.from_function(
+            func=_tavily_search,
+            coroutine=_atavily_search,
+            name="TavilySearch",
+            description=TAVILY_DESCRIPTION
+        )
+        self.generate_image_poster = StructuredTool.from_function(
+            func=_image_tool,
+            coroutine=_aimage_tool,
+            name="GenerateImagePoster",
+            description=IMAGE_DESCRIPTION,
+            return_direct=True
+        )
+        self.tools = [self.tavily_search, self.generate_image_poster]
+
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", SYSTEM_PROMPT),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}"),
+            ("placeholder", "{agent_scratchpad}")
+        ])
+        self.agent = create_tool_calling_agent(llm=self.llm, tools=self.tools, prompt=self.prompt)
+
+        # The executor itself is stateless; each call passes in the session's chat_history and
+        # the caller saves the new turn to that memory.
+        self.agent_executor = ParallelAgentExecutor(agent=self.agent, tools=self.tools)
+        self.context_builder = ContextBuilder(llm=self.llm)
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime() -> AgentRuntime:
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                with span("agent.init"):
+                    _runtime = AgentRuntime()
+                print("🤖 Copywriter Agent Ready and connected with PostgreSQL sessions.")
+    return _runtime
+
+
+def is_ready() -> bool:
+    return _runtime is not None
+
+
+def warm_up(background=False):
+    """
+    Builds the agent ahead of the first request. With background=True it runs in a daemon
+    thread and returns it; requests arriving meanwhile wait for the same build.
+    """
+    if background:
+        thread = threading.Thread(target=warm_up, name="agent-warm-up", daemon=True)
+        thread.start()
+        return thread
     try:
-        response = agent_executor.invoke({"input": user_input})
-        output = response.get("output", "")
-        if not output:
-            output = "I couldn’t generate a proper response this time."
-        memory.save_context({"input": user_input}, {"output": output})
-        return {"output": output}
+        get_runtime()
     except Exception as e:
-        error_msg = f"I encountered an error: {str(e)}"
-        memory.save_context({"input": user_input}, {"output": error_msg})
-        return {"output": error_msg}
+        print(f"Agent warm-up failed: {str(e)}")
+
+
+def warm_up_from_env():
+    """Applies AGENT_WARM_UP for the web apps."""
+    if AGENT_WARM_UP == "eager":
+        warm_up()
+    elif AGENT_WARM_UP == "background":
+        warm_up(background=True)
+
+
+def _build_context(user_input: str, memory, session_id=None):
+    """Agent inputs with token-budgeted history, plus estimated tokens per part of the context."""
+    history, tokens = get_runtime().context_builder.build(memory.chat_memory.messages, session_id)
+    tokens["input"] = estimate_tokens(user_input)
+    return {"input": user_input, "chat_history": history}, tokens
+
+
+def _agent_input(user_input: str, memory, session_id=None) -> dict:
+    return _build_context(user_input, memory, session_id)[0]
+
 
+def _remember(memory, user_input: str, output: str, session_id: str = None):
+    # Reference-file text is only needed for the turn it was attached to.
+    memory.save_context({"input": strip_reference(user_input)}, {"output": output})
+    messages = memory.chat_memory.messages
+    if len(messages) > HISTORY_MAX_MESSAGES:
+        excess = len(messages) - HISTORY_MAX_MESSAGES
+        # Summarized first, so trimmed turns still reach the model through the summary.
+        get_runtime().context_builder.fold(messages, excess, session_id)
+        del messages[:excess]
 
-print("🤖 Copywriter Agent Ready and connected with PostgreSQL sessions.")
+
+def resolve_image_job(session_id: str, reference: str, output: str):
+    """Swaps a finished job's reference for its result in the session's in-process memory."""
+    for message in memory_store.get(session_id).chat_memory.messages:
+        if message.type == "ai" and message.content == reference:
+            message.content = output
+
+
+def _cache_lookup(user_input: str, memory):
+    """Returns (context, cached output). Both are None when RESPONSE_CACHE_ENABLED is off."""
+    if response_cache is None:
+        return None, None
+    context = context_key(user_input, memory.load_memory_variables({})["chat_history"])
+    return context, response_cache.get(user_input, context)
+
+
+def _cache_store(user_input: str, context, output: str):
+    if response_cache is not None and context is not None:
+        response_cache.put(user_input, context, output)
+
+
+def ask(user_input: str, session_id: str, image_mode: str = None, user_id: str = None) -> dict:
+    """
+    Takes the user's input and session_id from app.py, processes the query through the agent,
+    and returns a dict { "output": ... } for JSON response. With image_mode="job" a banner
+    request returns a job:// reference instead of waiting for the image. When the user's image
+    budget is exhausted the dict also carries "retry_after" (seconds).
+    """
+    from agent_callbacks import UsageHandler
+
+    with span("agent.ask") as current:
+        current.payload("input", len(user_input.encode("utf-8")))
+        memory = get_memory(session_id)
+        context, cached = _cache_lookup(user_input, memory)
+        if cached is not None:
+            _remember(memory, user_input, cached, session_id)
+            return {"output": cached, "cached": True}
+
+        try:
+            inputs, context_tokens = _build_context(user_input, memory, session_id)
+            usage = UsageHandler(context_tokens)
+            turn, tokens = _enter_turn(image_mode, user_id, session_id)
+            try:
+                response = get_runtime().agent_executor.invoke(inputs, config={"callbacks": [usage]})
+            finally:
+                _exit_turn(tokens)
+            output = response.get("output", "")
+            if not output:
+                output = "I couldn’t generate a proper response this time."
+            _remember(memory, user_input, output, session_id)
+            _cache_store(user_input, context, output)
+            usage.record(current, output)
+            return {"output": output, "usage": usage.as_dict(), **turn.limits()}
+        except Exception as e:
+            current.status = "error"
+            error_msg = f"I encountered an error: {str(e)}"
+            _remember(memory, user_input, error_msg, session_id)
+            return {"output": error_msg}
+
+
+async def aask(user_input: str, session_id: str, image_mode: str = None, user_id: str = None) -> dict:
+    """
+    Async counterpart of ask() for the ASGI app. LLM and tool calls go through their
+    async implementations, so one event loop can hold many in-flight requests.
+    """
+    from agent_callbacks import UsageHandler
+
+    with span("agent.aask") as current:
+        current.payload("input", len(user_input.encode("utf-8")))
+        # MEMORY_BACKEND=postgres reads the window with a blocking query.
+        memory = await asyncio.to_thread(get_memory, session_id)
+        context, cached = _cache_lookup(user_input, memory)
+        if cached is not None:
+            await asyncio.to_thread(_remember, memory, user_input, cached, session_id)
+            return {"output": cached, "cached": True}
+
+        try:
+            # Off the loop: in HISTORY_SUMMARY_MODE=llm building the context can call the model.
+            inputs, context_tokens = await asyncio.to_thread(_build_context, user_input, memory, session_id)
+            usage = UsageHandler(context_tokens)
+            turn, tokens = _enter_turn(image_mode, user_id, session_id)
+            try:
+                response = await get_runtime().agent_executor.ainvoke(inputs, config={"callbacks": [usage]})
+            finally:
+                _exit_turn(tokens)
+            output = response.get("output", "")
+            if not output:
+                output = "I couldn’t generate a proper response this time."
+            await asyncio.to_thread(_remember, memory, user_input, output, session_id)
+            _cache_store(user_input, context, output)
+            usage.record(current, output)
+            return {"output": output, "usage": usage.as_dict(), **turn.limits()}
+        except Exception as e:
+            current.status = "error"
+            error_msg = f"I encountered an error: {str(e)}"
+            await asyncio.to_thread(_remember, memory, user_input, error_msg, session_id)
+            return {"output": error_msg}
+
+
+async def aask_stream(user_input: str, session_id: str, image_mode: str = None, user_id: str = None):
+    """Async counterpart of ask_stream(); yields the same event dicts."""
+    from agent_callbacks import UsageHandler
+
+    memory = await asyncio.to_thread(get_memory, session_id)
+    context, cached = _cache_lookup(user_input, memory)
+    if cached is not None:
+        await asyncio.to_thread(_remember, memory, user_input, cached, session_id)
+        yield {"event": "token", "data": {"text": cached}}
+        yield {"event": "final", "data": {"output": cached, "cached": True}}
+        return
+
+    output = ""
+    tool_runs = set()
+    usage = UsageHandler()
+    turn = None
+
+    with span("agent.aask_stream") as current:
+        current.payload("input", len(user_input.encode("utf-8")))
+        try:
+            inputs, usage.context_tokens = await asyncio.to_thread(_build_context, user_input, memory, session_id)
+            turn, tokens = _enter_turn(image_mode, user_id, session_id)
+            try:
+                async for event in get_runtime().agent_executor.astream_events(inputs, version="v2", config={"callbacks": [usage]}):
+                    kind = event["event"]
+                    if kind == "on_chat_model_stream" and not tool_runs.intersection(event.get("parent_ids", ())):
+                        token = event["data"]["chunk"].content
+                        if token:
+                            yield {"event": "token", "data": {"text": token}}
+                    elif kind == "on_tool_start":
+                        tool_runs.add(event["run_id"])
+                        yield {"event": "tool_start", "data": {"tool": event["name"], "input": str(event["data"].get("input", ""))}}
+                    elif kind == "on_tool_end":
+                        yield {"event": "tool_end", "data": {"tool": event["name"]}}
+                    elif kind == "on_tool_error":
+                        yield {"event": "tool_error", "data": {"tool": event["name"], "error": str(event["data"].get("error", ""))}}
+                    elif kind == "on_chain_end" and not event.get("parent_ids"):
+                        # The root run is the executor; matching it by name broke when it became ParallelAgentExecutor.
+                        output = event["data"]["output"].get("output", "")
+            finally:
+                _exit_turn(tokens)
+            if not output:
+                output = "I couldn’t generate a proper response this time."
+            _cache_store(user_input, context, output)
+            usage.record(current, output)
+        except Exception as e:
+            current.status = "error"
+            output = f"I encountered an error: {str(e)}"
+
+    await asyncio.to_thread(_remember, memory, user_input, output, session_id)
+    yield {"event": "final", "data": {"output": output, "usage": usage.as_dict(), **(turn.limits() if turn else {})}}
+
+
+def ask_stream(user_input: str, session_id: str, image_mode: str = None, user_id: str = None):
+    """
+    Streaming variant of ask(). Yields event dicts ({"event": ..., "data": ...}) for LLM tokens
+    and tool calls while the agent runs, and finishes with a "final" event holding the full output.
+    """
+    from agent_callbacks import UsageHandler, StreamEventHandler
+
+    memory = get_memory(session_id)
+    context, cached = _cache_lookup(user_input, memory)
+    if cached is not None:
+        _remember(memory, user_input, cached, session_id)
+        yield {"event": "token", "data": {"text": cached}}
+        yield {"event": "final", "data": {"output": cached, "cached": True}}
+        return
+
+    events = queue.Queue()
+    done = object()
+
+    def run():
+        # Fresh thread: its context only carries what is set here.
+        turn, _ = _enter_turn(image_mode, user_id, session_id)
+        with span("agent.ask_stream") as current:
+            current.payload("input", len(user_input.encode("utf-8")))
+            usage = UsageHandler()
+            try:
+                inputs, usage.context_tokens = _build_context(user_input, memory, session_id)
+                response = get_runtime().agent_executor.invoke(
+                    inputs,
+                    config={"callbacks": [StreamEventHandler(events), usage]}
+                )
+                output = response.get("output", "")
+                if not output:
+                    output = "I couldn’t generate a proper response this time."
+                _cache_store(user_input, context, output)
+                usage.record(current, output)
+            except Exception as e:
+                current.status = "error"
+                output = f"I encountered an error: {str(e)}"
+        _remember(memory, user_input, output, session_id)
+        events.put({"event": "final", "data": {"output": output, "usage": usage.as_dict(), **turn.limits()}})
+        events.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    while True:
+        event = events.get()
+        if event is done:
+            return
+        yield event
 
 
-    
 # while True:
 #     try:
 #         user_input = input("You: ").strip()
@@ -0,0 +1,72 @@
+import queue
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class UsageHandler(BaseCallbackHandler):
+    """
+    Adds up provider-reported token usage over every LLM call made for one request, next to
+    the context builder's estimate of where the prompt tokens went.
+    """
+
+    def __init__(self, context_tokens=None):
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.context_tokens = context_tokens or {}
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.prompt_tokens += usage.get("input_tokens", 0)
+                    self.cached_prompt_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0)
+                    self.completion_tokens += usage.get("output_tokens", 0)
+                    return
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        self.prompt_tokens += token_usage.get("prompt_tokens", 0)
+        self.completion_tokens += token_usage.get("completion_tokens", 0)
+
+    def record(self, current, output=None):
+        current.tokens("prompt", self.prompt_tokens)
+        current.tokens("prompt_cached", self.cached_prompt_tokens)
+        current.tokens("completion", self.completion_tokens)
+        for part, count in self.context_tokens.items():
+            current.tokens(f"context_{part}", count)
+        if isinstance(output, str):
+            current.payload("output", len(output.encode("utf-8")))
+
+    def as_dict(self) -> dict:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "context_tokens": dict(self.context_tokens)
+        }
+
+
+class StreamEventHandler(BaseCallbackHandler):
+    """Pushes LLM tokens and tool calls onto a queue as the agent produces them."""
+
+    def __init__(self, events: queue.Queue):
+        self.events = events
+        # Tool runs ever started in this request. Tools run concurrently and may time out
+        # without an end event, so membership is tracked by run id instead of a depth counter.
+        self.tool_runs = set()
+
+    def on_llm_new_token(self, token, **kwargs):
+        # Tokens from LLM calls made inside a tool (e.g. the prompt enhancer) are not part of the reply.
+        if token and kwargs.get("parent_run_id") not in self.tool_runs:
+            self.events.put({"event": "token", "data": {"text": token}})
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.tool_runs.add(kwargs.get("run_id"))
+        name = (serialized or {}).get("name") or kwargs.get("name", "")
+        self.events.put({"event": "tool_start", "data": {"tool": name, "input": input_str}})
+
+    def on_tool_end(self, output, **kwargs):
+        self.events.put({"event": "tool_end", "data": {"tool": kwargs.get("name", "")}})
+
+    def on_tool_error(self, error, **kwargs):
+        self.events.put({"event": "tool_error", "data": {"tool": kwargs.get("name", ""), "error": str(error)}})
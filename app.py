@@ -1,189 +1,331 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import uuid
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g
+from werkzeug.exceptions import RequestEntityTooLarge
 from dotenv import load_dotenv
 import io
-import base64
-from agent import ask
-from PyPDF2 import PdfReader
-import docx
-from datetime import datetime, timedelta
-import os
+from agent import ask, ask_stream, memory_store, resolve_image_job, warm_up_from_env, is_ready
+from response_cache import response_cache
+from image_cache import image_cache
+from blob_store import blob_store, parse_image_ref
+import image_variants
+from db import get_db_connection, reset_request_connection_count, request_connection_count, pool_stats
+import ingestion
+import identity
+import history
+import persistence
+import jobs
+import rate_limit
+import retrieval
+import metrics
+from metrics import timed
 import json
+import time
 import traceback
 
 
 load_dotenv()
-DB_HOST = os.getenv("DB_HOST")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASS = os.getenv("DB_PASS")
-DB_PORT = os.getenv("DB_PORT") 
-
-def get_db_connection():
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        database=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS,
-        port=DB_PORT,
-        cursor_factory=RealDictCursor
-    )
-    return conn
-
-def validate_user(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE user_id = %s", (user_id,))
-    user = cur.fetchone()
-    if not user:
-        
-        cur.execute("INSERT INTO users (user_id) VALUES (%s)", (user_id,))
-        conn.commit()
-    cur.close()
-    conn.close()
-
-def create_session(user_id):
-    session_id = str(uuid.uuid4())
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO sessions (session_id, user_id) VALUES (%s, %s)", (session_id, user_id))
-    conn.commit()
-    cur.close()
-    conn.close()
-    return session_id 
-
-def save_message(session_id, user_text, ai_text):
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
 
-        combined_message = {
-            "ai": ai_text,
-            "user": user_text
-        }
+@timed("db.save_message")
+def save_message(session_id, user_text, ai_text, durable=persistence.PERSIST_DURABLE):
+    # Queued for the background writer; the response doesn't wait for the INSERT unless `durable`.
+    return persistence.save_message(session_id, user_text, ai_text, durable=durable)
 
-        cur.execute("""
-            INSERT INTO messages (session_id, message)
-            VALUES (%s, %s)
-        """, (session_id, json.dumps(combined_message)))
+@timed("db.attach_upload_context")
+def attach_upload_context(session_id, user_input):
+    include_file, file_content, upload_id = False, "", None
+    query_text = user_input
 
-        cur.execute("""SELECT COUNT(*) AS cnt FROM messages WHERE session_id = %s""", (session_id,))
-        count = cur.fetchone()["cnt"]
-        if count == 1:
-            cur.execute("""UPDATE sessions SET title = %s WHERE session_id = %s""", (user_text[:50], session_id))
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, filename, length(extracted_text) AS text_chars, auto_use
+            FROM uploads WHERE session_id=%s
+            ORDER BY id DESC LIMIT 1
+        """, (session_id,))
+        upload = cur.fetchone()
+
+        if upload and upload.get("text_chars"):
+            upload_id = upload["id"]
+
+            def load_text():
+                cur.execute("SELECT extracted_text FROM uploads WHERE id=%s", (upload_id,))
+                return cur.fetchone()["extracted_text"]
+
+            # Only the chunks relevant to this query are sent when the file is large; the
+            # full text is read only when it is sent as a whole.
+            file_content = retrieval.reference_for_query(upload_id, upload["text_chars"], load_text, query_text)
+            auto_use = upload.get("auto_use", False)
+
+
+            # Automatically use file for FIRST user query (auto_use=True)
+            if auto_use:
+                include_file = True
+                cur.execute(
+                    "UPDATE uploads SET auto_use=FALSE WHERE session_id=%s",
+                    (session_id,)
+                )
+                conn.commit()
+            else:
+                # For later queries: use only if user explicitly says "based on my uploaded file"
+                user_input = f"Reference file content:\n{file_content}\nUser Query:\n{user_input}"
+
+
+    if include_file and file_content:
+        user_input = f"Reference file content:\n{file_content}\nUser Query: {user_input}"
+    return user_input
+
+def image_payload(image_id):
+    return {"image_id": image_id, "image_url": f"/images/{image_id}",
+            "thumbnail_url": f"/images/{image_id}/thumbnail"}
+
+def load_image(image_id):
+    blob = blob_store.get(image_id)
+    return blob[0] if blob is not None else None
+
+def send_image(image_id, download=False, spec=None):
+    """
+    Serves a stored image with ETag and Range support; the blob id doubles as a strong ETag.
+    With a VariantSpec the resized/re-encoded copy is served instead, rendered once and cached.
+    """
+    if spec is not None:
+        path = image_variants.variant_cache.get_or_render(image_id, spec, lambda: load_image(image_id))
+        if path is None:
+            return None
+        response = send_file(path, mimetype=spec.content_type, as_attachment=download,
+                             download_name=f"generated.{spec.fmt}", conditional=True,
+                             etag=f"{image_id}-{spec.key}", max_age=31536000)
+        response.vary.add("Accept")
+        return response
+
+    path = blob_store.path(image_id)
+    if path is not None:
+        return send_file(path, mimetype="image/png", as_attachment=download,
+                         download_name="generated.png", conditional=True, etag=image_id, max_age=31536000)
+    blob = blob_store.get(image_id)
+    if blob is None:
+        return None
+    data, content_type = blob
+    return send_file(io.BytesIO(data), mimetype=content_type, as_attachment=download,
+                     download_name="generated.png", conditional=True, etag=image_id, max_age=31536000)
+
+def overlay_image(image_id, text, position):
+    """Stores a copy of the image with `text` drawn over it; returns the new blob id (None if unknown)."""
+    data = load_image(image_id)
+    if data is None:
+        return None
+    with metrics.span("image.overlay") as current:
+        overlaid = image_variants.overlay_text(data, text, position)
+        current.payload("output", len(overlaid))
+    return blob_store.put(overlaid, "image/png")
+
+def job_payload(job_id):
+    return {"job_id": job_id, "status_url": f"/jobs/{job_id}", "events_url": f"/jobs/{job_id}/events"}
+
+
+def job_status(job):
+    status = {k: job[k] for k in ("job_id", "kind", "status", "error", "timings")}
+    image_id = parse_image_ref(job["result"])
+    if image_id:
+        status.update(image_payload(image_id))
+    return status
+
+
+def follow_image_job(session_id, output, pending):
+    """
+    For a turn answered with a job:// reference: once the job finishes, the stored turn and the
+    session memory point at the image (or the failure) instead of the job. Returns the job id.
+    """
+    job_id = jobs.parse_job_ref(output)
+    if job_id is None:
+        return None
+
+    def finished(job):
+        result = job["result"] or f" Image generation failed: {job['error']}"
+        resolve_image_job(session_id, output, result)
+
+        def saved(error):
+            if error is not None:
+                # Still try the update; without a stored row it is a no-op.
+                print(f"[jobs] Turn with image job {job_id} failed to save ({error}); updating it anyway")
+            persistence.replace_output(session_id, output, result)
+
+        # Chained onto the message write rather than waiting for it on a job worker.
+        pending.add_done_callback(saved)
+
+    jobs.image_jobs.on_done(job_id, finished)
+    return job_id
+
+
+def add_usage_headers(response, usage):
+    """Token usage of the agent run behind this response, for tracking input-token cost per request."""
+    if usage:
+        response.headers["X-Prompt-Tokens"] = str(usage["prompt_tokens"])
+        response.headers["X-Cached-Prompt-Tokens"] = str(usage["cached_prompt_tokens"])
+        response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def wants_stream():
+    if "text/event-stream" in request.headers.get("Accept", ""):
+        return True
+    return bool((request.get_json(silent=True) or {}).get("stream", False))
+
+
+def stream_response(user_input, session_id, user_id, image_mode=None):
+    """Server-Sent Events version of /query: tokens and tool calls are forwarded as they happen."""
+
+    def generate():
+        # Flush headers and a first byte right away so clients see the stream open immediately.
+        yield sse_event("start", {"session_id": session_id, "user_id": user_id})
+        output = "I couldn’t generate a proper response this time."
+        usage, limits = None, {}
+        for event in ask_stream(user_input, session_id, image_mode, user_id):
+            if event["event"] == "final":
+                output = event["data"]["output"] or output
+                usage = event["data"].get("usage")
+                limits = {"retry_after": event["data"]["retry_after"]} if "retry_after" in event["data"] else {}
+                continue
+            yield sse_event(event["event"], event["data"])
+
+        job_id = None
+        try:
+            job_id = follow_image_job(session_id, output, save_message(session_id, user_input, output))
+        except Exception as e:
+            yield sse_event("error", {"message": f"Failed to save message: {str(e)}"})
+
+        image_id = parse_image_ref(output)
+        if job_id:
+            yield sse_event("final", {"type": "job", **job_payload(job_id), "session_id": session_id, "usage": usage})
+        elif image_id:
+            yield sse_event("final", {"type": "image", **image_payload(image_id), "session_id": session_id, "usage": usage})
+        else:
+            yield sse_event("final", {"type": "text", "message": output, "session_id": session_id, "usage": usage, **limits})
 
-        conn.commit()
-        cur.close()
-        conn.close()
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.headers["user_id"] = user_id
+    response.headers["session_id"] = session_id
+    return response
 
-    except Exception as e:
-        import traceback
-        print("[save_message] Exception occurred:")
-        traceback.print_exc()
-        raise e
 
 app = Flask(__name__)
+# Oversized uploads are refused from the Content-Length header, before the body is read.
+app.config["MAX_CONTENT_LENGTH"] = ingestion.UPLOAD_MAX_REQUEST_BYTES
+# The agent (LangChain, model clients) is built on first use unless AGENT_WARM_UP asks otherwise;
+# asgi_app imports this module, so the setting applies to both apps.
+warm_up_from_env()
+
+
+def _numeric_stats(stats_fn):
+    """Gauge source for register_gauges(): one sample per numeric field of a stats() dict."""
+    def source():
+        return [({"stat": key}, value) for key, value in stats_fn().items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    return source
+
+
+metrics.register_gauges("copywriter_db_pool", "Connection pool statistics.", _numeric_stats(pool_stats))
+metrics.register_gauges("copywriter_memory_store", "Conversation memory store statistics.", _numeric_stats(memory_store.stats))
+if response_cache is not None:
+    metrics.register_gauges("copywriter_response_cache", "Response cache statistics.", _numeric_stats(response_cache.stats))
+if image_cache is not None:
+    metrics.register_gauges("copywriter_image_cache", "Banner image cache statistics.", _numeric_stats(image_cache.stats))
+
+
+@app.before_request
+def start_connection_count():
+    reset_request_connection_count()
+
+
+@app.after_request
+def report_connection_count(response):
+    # Number of pooled connections this request borrowed; should stay at a handful per /query.
+    response.headers["X-DB-Connections"] = str(request_connection_count())
+    add_usage_headers(response, g.get("usage"))
+    if g.get("admission") is not None:
+        response.headers.update(g.admission.headers())
+    identity.apply(response, g.get("identity"))
+    return response
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    # For readiness probes: 503 until the agent is built (see AGENT_WARM_UP).
+    if not is_ready():
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True})
+
+@app.route("/pool_stats", methods=["GET"])
+def get_pool_stats():
+    return jsonify(pool_stats())
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype=metrics.PROMETHEUS_CONTENT_TYPE)
+
+@app.route("/cache_stats", methods=["GET"])
+def get_cache_stats():
+    if response_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **response_cache.stats()})
 
 @app.route("/query", methods=["POST"])
 def query():
     try:
-        # Step 1: Ensure user_id exists
-        if not os.path.exists("user_id.txt"):
-            user_id = str(uuid.uuid4())
-            with open("user_id.txt", "w") as f:
-                f.write(user_id)
-        else:
-            with open("user_id.txt", "r") as f:
-                user_id = f.read().strip() 
-
-        
-        session_file = "session_id.txt"
-        if not os.path.exists(session_file):
-            session_id = create_session(user_id)
-            with open(session_file, "w") as f:
-                f.write(f"{session_id}|{datetime.utcnow().isoformat()}")
-        else:
-            with open(session_file, "r") as f:
-                data = f.read().strip().split("|")
-                session_id, timestamp = data[0], data[1]
-                last_time = datetime.fromisoformat(timestamp)
-                if datetime.utcnow() - last_time > timedelta(hours=24):
-                    session_id = create_session(user_id)
-                    with open(session_file, "w") as f:
-                        f.write(f"{session_id}|{datetime.utcnow().isoformat()}")
-
-        
         user_input = request.json.get("input", "").strip()
         if not user_input:
             return jsonify({"type": "error", "message": "Input cannot be empty"}), 400
 
-        validate_user(user_id)
-
-        
-        include_file, file_content = False, ""
+        g.identity = identity.from_request(request)
+        user_id, session_id = g.identity.user_id, g.identity.session_id
 
-        with get_db_connection() as conn, conn.cursor() as cur:
-            cur.execute("""
-                SELECT filename, extracted_text, auto_use
-                FROM uploads WHERE session_id=%s
-                ORDER BY id DESC LIMIT 1
-            """, (session_id,))
-            upload = cur.fetchone()
+        # Text-turn budget per user and session; may wait briefly, else 429 with Retry-After.
+        g.admission = rate_limit.limiter.acquire("text", user_id, session_id)
+        if not g.admission.allowed:
+            return jsonify({**g.admission.payload(), "user_id": user_id, "session_id": session_id}), 429
 
-            if upload and upload.get("extracted_text"):
-                file_content = upload["extracted_text"]
-                auto_use = upload.get("auto_use", False)
+        user_input = attach_upload_context(session_id, user_input)
+        # {"image_mode": "job"} queues banners and answers with a job id instead of the image.
+        image_mode = request.json.get("image_mode", jobs.IMAGE_MODE)
 
+        if wants_stream():
+            return stream_response(user_input, session_id, user_id, image_mode)
 
-                # Automatically use file for FIRST user query (auto_use=True)
-                if auto_use:
-                    include_file = True
-                    cur.execute(
-                        "UPDATE uploads SET auto_use=FALSE WHERE session_id=%s",
-                        (session_id,)
-                    )
-                    conn.commit()
-                else:
-                    # For later queries: use only if user explicitly says "based on my uploaded file"
-                    if upload and upload.get("extracted_text"):
-                        file_content = upload["extracted_text"]
-                        user_input = f"Reference file content:\n{file_content}\nUser Query:\n{user_input}"
-
-
-        if include_file and file_content:
-            user_input = f"Reference file content:\n{file_content}\nUser Query: {user_input}"
-
-
-        print(f" [query] Calling ask() with session_id={session_id} and input={user_input}")
-        
-
-        result = ask(user_input, session_id)
+        result = ask(user_input, session_id, image_mode, user_id)
 
         if not result or not isinstance(result, dict):
             result = {"output": "I couldn’t generate a proper response this time."}
 
         output = result.get("output", "I couldn’t generate a proper response this time.")
-        print(f" [query] ask() returned: {result}")
-
-
-        
-        save_message(session_id, user_input, output)
-
-        
-        if isinstance(output, str) and output.startswith("data:image/png;base64,"):
-            image_data = output.split(",")[1]
-            image_bytes = base64.b64decode(image_data)
-            download = request.json.get("download", False)
-            response = send_file(
-                io.BytesIO(image_bytes),
-                mimetype="image/png",
-                as_attachment=download,
-                download_name="generated.png"
-            )
+        g.usage = result.get("usage")
+
+        pending = save_message(session_id, user_input, output,
+                               durable=request.json.get("durable", persistence.PERSIST_DURABLE))
+
+        if result.get("retry_after"):
+            # The agent asked for a banner but this user's image budget is used up.
+            return jsonify({"type": "error", "message": output, "retry_after": result["retry_after"],
+                            "user_id": user_id, "session_id": session_id}), 429, {"Retry-After": str(result["retry_after"])}
+
+        job_id = follow_image_job(session_id, output, pending)
+        if job_id:
+            return jsonify({"type": "job", **job_payload(job_id), "user_id": user_id, "session_id": session_id}), 202
+
+        image_id = parse_image_ref(output)
+        if image_id:
+            # {"image_format": "url"} returns a link to /images/<id> instead of the bytes.
+            if request.json.get("image_format") == "url":
+                return jsonify({"type": "image", **image_payload(image_id), "user_id": user_id, "session_id": session_id})
+            # Raw bytes stay full-size PNG unless the client explicitly accepts WebP.
+            spec = image_variants.parse_spec({}, request.headers.get("Accept"))
+            response = send_image(image_id, download=request.json.get("download", False), spec=spec)
+            if response is None:
+                return jsonify({"type": "error", "message": "Generated image could not be found"}), 500
             response.headers["user_id"] = user_id
             response.headers["session_id"] = session_id
+            response.headers["image_id"] = image_id
             return response
 
         
@@ -200,26 +342,98 @@ def query():
 
 
     
+@app.route("/images/<image_id>", methods=["GET"])
+def get_image(image_id, size=None):
+    # ?w=512, ?size=thumb, ?format=webp|jpeg|png and ?q=75 select a cached variant; an Accept
+    # header listing image/webp picks WebP when no format is given.
+    try:
+        spec = image_variants.parse_spec(request.args, request.headers.get("Accept"), size=size)
+    except image_variants.VariantError as e:
+        return jsonify({"type": "error", "message": str(e)}), 400
+    response = send_image(image_id, download=request.args.get("download") == "1", spec=spec)
+    if response is None:
+        return jsonify({"error": "Image not found"}), 404
+    return response
+
+
+@app.route("/images/<image_id>/thumbnail", methods=["GET"])
+def get_thumbnail(image_id):
+    return get_image(image_id, size="thumb")
+
+
+@app.route("/images/<image_id>/overlay", methods=["POST"])
+def add_overlay(image_id):
+    # Re-renders banner copy locally on an existing image; no new image model call.
+    try:
+        data = request.get_json(silent=True) or {}
+        new_id = overlay_image(image_id, data.get("text", ""), data.get("position", "bottom"))
+        if new_id is None:
+            return jsonify({"error": "Image not found"}), 404
+        return jsonify({"type": "image", **image_payload(new_id), "source_image_id": image_id}), 201
+    except image_variants.VariantError as e:
+        return jsonify({"type": "error", "message": str(e)}), 400
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"type": "error", "message": f"Server error: {type(e).__name__}: {str(e)}"}), 500
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = jobs.image_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job (it may have expired or belong to another worker)"}), 404
+    return jsonify(job_status(job))
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Streams a `status` event whenever the job changes, ending once it is done or failed."""
+    job = jobs.image_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job (it may have expired or belong to another worker)"}), 404
+
+    def generate():
+        current = job
+        yield sse_event("status", job_status(current))
+        while current["status"] not in jobs.TERMINAL:
+            changed = jobs.image_jobs.wait_change(job_id, current["version"], timeout=15)
+            if changed is None:
+                return
+            if changed["version"] == current["version"]:
+                yield ": keep-alive\n\n"
+                continue
+            current = changed
+            yield sse_event("status", job_status(current))
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/upload/<int:upload_id>/status", methods=["GET"])
+def upload_status(upload_id):
+    job = ingestion.get_job(upload_id)
+    if job is None:
+        return jsonify({"error": "Unknown upload (it may have been processed by another worker)"}), 404
+    return jsonify(job)
+
+
+@app.route("/ingestion_stats", methods=["GET"])
+def get_ingestion_stats():
+    return jsonify(ingestion.stage_stats())
+
+
 @app.route("/new_session", methods=["POST"])
 def new_session():
         
     try:
-        if not os.path.exists("user_id.txt"):
-            user_id = str(uuid.uuid4())
-            with open("user_id.txt", "w") as f:
-                f.write(user_id)
-        else:
-            with open("user_id.txt", "r") as f:
-                user_id = f.read().strip()
-
-        session_id = create_session(user_id)
-        with open("session_id.txt", "w") as f:
-            f.write(f"{session_id}|{datetime.utcnow().isoformat()}")
+        g.identity = identity.from_request(request, new_session=True)
 
         return jsonify({
             "message": "New session created successfully.",
-            "session_id": session_id,
-            "user_id": user_id
+            "session_id": g.identity.session_id,
+            "user_id": g.identity.user_id
         })
     except Exception as e:
         return jsonify({"error": f"Failed to create new session: {str(e)}"}), 500
@@ -228,26 +442,40 @@ def new_session():
 def list_sessions():
     try:
 
-        if not os.path.exists("user_id.txt"):
+        user_id = identity.from_request(request, create=False).user_id
+        if not user_id:
             return jsonify({"error": "User not initialized"}), 400
 
-        with open("user_id.txt", "r") as f:
-            user_id = f.read().strip()
+        if request.args.get("limit") is None and request.args.get("cursor") is None:
+            # Clients written before pagination get the bare list they expect.
+            return jsonify(history.list_all_sessions(user_id, request.args.get("fields")))
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT session_id, start_time, end_time,
-                COALESCE(title, 'New Chat') AS title,
-                is_active
-            FROM sessions
-            WHERE user_id = %s
-            ORDER BY start_time DESC
-        """, (user_id,))
-        sessions = cur.fetchall()
-        cur.close(); conn.close()
-        return jsonify(sessions)
-    
+        # ?limit=20&cursor=<next_cursor>&fields=session_id,title
+        return jsonify(history.list_sessions(
+            user_id, request.args.get("limit"), request.args.get("cursor"), request.args.get("fields")
+        ))
+
+    except history.PageError as e:
+        return jsonify({"type": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"type": "error", "message": f"Server error: {str(e)}"}), 500
+
+
+@app.route("/sessions/<session_id>/messages", methods=["GET"])
+def list_session_messages(session_id):
+    try:
+        user_id = identity.from_request(request, create=False).user_id
+        if not identity.owns_session(user_id, session_id):
+            return jsonify({"error": "Session not found"}), 404
+
+        # ?limit=20&cursor=<next_cursor>&fields=id,user&order=desc|asc
+        return jsonify(history.list_messages(
+            session_id, request.args.get("limit"), request.args.get("cursor"),
+            request.args.get("fields"), request.args.get("order", "desc")
+        ))
+
+    except history.PageError as e:
+        return jsonify({"type": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"type": "error", "message": f"Server error: {str(e)}"}), 500
  
@@ -263,51 +491,46 @@ def upload_file():
         if not file.filename:
             return jsonify({"error": "Empty filename"}), 400
 
-        filename = file.filename
-        file_bytes = file.read()
-
-        # ✅ Extract readable text here itself (no file_tools.py needed)
-        filename_lower = filename.lower()
-        extracted_text = ""
-
-        if filename_lower.endswith(".pdf"):
-            reader = PdfReader(io.BytesIO(file_bytes))
-            for page in reader.pages:
-                extracted_text += page.extract_text() or ""
-
-        elif filename_lower.endswith(".docx"):
-            document = docx.Document(io.BytesIO(file_bytes))
-            extracted_text = "\n".join([p.text for p in document.paragraphs])
-
-        elif filename_lower.endswith(".txt"):
-            extracted_text = file_bytes.decode("utf-8", errors="ignore")
-
-        else:
-            extracted_text = "Unsupported file format."
-
-        # ✅ Store to DB
-        if not os.path.exists("session_id.txt"):
+        session_id = identity.from_request(request, create=False).session_id
+        if not session_id:
             return jsonify({"error": "No active session found"}), 400
 
-        with open("session_id.txt", "r") as f:
-            session_id = f.read().strip().split("|")[0]
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("UPDATE uploads SET auto_use=FALSE WHERE session_id=%s", (session_id,))
-        cur.execute("""
-            INSERT INTO uploads (session_id, filename, file_data, content_type, extracted_text, auto_use)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (session_id, filename, file_bytes, file.content_type, extracted_text, True))
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Spool to disk in blocks instead of holding the upload in memory; extraction and
+        # the database writes happen on the ingestion workers.
+        filename = file.filename
+        spool_path = ingestion.new_spool_path(filename)
+        started = time.perf_counter()
+        file.save(spool_path)
+        upload_id = ingestion.submit_upload(
+            session_id, filename, file.content_type, spool_path,
+            spool_ms=(time.perf_counter() - started) * 1000
+        )
+
+        if request.form.get("wait") == "1":
+            job = ingestion.wait_for(upload_id)
+            if job is None:
+                return jsonify({"type": "error", "message": "Upload status is no longer available.",
+                                "upload_id": upload_id}), 500
+            if job["status"] == "failed":
+                return jsonify({"type": "error", "message": f"Processing failed: {job['error']}", "upload": job}), 500
+            return jsonify({
+                "message": f"{filename} uploaded and processed successfully.",
+                "session_id": session_id,
+                "upload_id": upload_id
+            })
 
         return jsonify({
-            "message": f"{filename} uploaded and processed successfully.",
-            "session_id": session_id
-        })
-
+            "message": f"{filename} uploaded; processing in the background.",
+            "session_id": session_id,
+            "upload_id": upload_id,
+            "status_url": f"/upload/{upload_id}/status"
+        }), 202
+
+    except RequestEntityTooLarge:
+        # The body is over MAX_CONTENT_LENGTH, so it was refused before being read.
+        return jsonify({"type": "error", "message": str(ingestion.UploadTooLarge())}), 413
+    except ingestion.UploadTooLarge as e:
+        return jsonify({"type": "error", "message": str(e)}), 413
     except Exception as e:
         traceback.print_exc()
         return jsonify({
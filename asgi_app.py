@@ -0,0 +1,385 @@
+import io
+import time
+import asyncio
+import traceback
+
+from quart import Quart, request, jsonify, send_file, Response, g
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from agent import aask, aask_stream, is_ready
+from blob_store import blob_store, parse_image_ref
+import ingestion
+import metrics
+import identity
+import history
+import persistence
+import jobs
+import rate_limit
+import image_variants
+from app import (
+    save_message, attach_upload_context, follow_image_job, load_image, overlay_image,
+    sse_event, image_payload, add_usage_headers, job_payload, job_status
+)
+
+
+# ASGI entry point exposing the same contract as app.py. The agent runs on the event loop
+# via aask(); Postgres and file helpers are still blocking, so they are pushed to threads.
+# Run with: uvicorn asgi_app:app --workers 1
+app = Quart(__name__)
+app.config["MAX_CONTENT_LENGTH"] = ingestion.UPLOAD_MAX_REQUEST_BYTES
+JOB_POLL_SECONDS = 0.25
+
+
+@app.after_request
+async def report_usage(response):
+    add_usage_headers(response, g.get("usage"))
+    if g.get("admission") is not None:
+        response.headers.update(g.admission.headers())
+    identity.apply(response, g.get("identity"))
+    return response
+
+
+async def wants_stream():
+    if "text/event-stream" in request.headers.get("Accept", ""):
+        return True
+    data = await request.get_json(silent=True) or {}
+    return bool(data.get("stream", False))
+
+
+def stream_response(user_input, session_id, user_id, image_mode=None):
+
+    async def generate():
+        yield sse_event("start", {"session_id": session_id, "user_id": user_id})
+        output = "I couldn’t generate a proper response this time."
+        usage, limits = None, {}
+        async for event in aask_stream(user_input, session_id, image_mode, user_id):
+            if event["event"] == "final":
+                output = event["data"]["output"] or output
+                usage = event["data"].get("usage")
+                limits = {"retry_after": event["data"]["retry_after"]} if "retry_after" in event["data"] else {}
+                continue
+            yield sse_event(event["event"], event["data"])
+
+        job_id = None
+        try:
+            pending = await asyncio.to_thread(save_message, session_id, user_input, output)
+            job_id = follow_image_job(session_id, output, pending)
+        except Exception as e:
+            yield sse_event("error", {"message": f"Failed to save message: {str(e)}"})
+
+        image_id = parse_image_ref(output)
+        if job_id:
+            yield sse_event("final", {"type": "job", **job_payload(job_id), "session_id": session_id, "usage": usage})
+        elif image_id:
+            yield sse_event("final", {"type": "image", **image_payload(image_id), "session_id": session_id, "usage": usage})
+        else:
+            yield sse_event("final", {"type": "text", "message": output, "session_id": session_id, "usage": usage, **limits})
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.headers["user_id"] = user_id
+    response.headers["session_id"] = session_id
+    response.timeout = None
+    return response
+
+
+async def send_image(image_id, download=False, spec=None):
+    """Serves a stored image with ETag and Range support; the blob id doubles as a strong ETag."""
+    if spec is not None:
+        path = await asyncio.to_thread(image_variants.variant_cache.get_or_render, image_id, spec,
+                                       lambda: load_image(image_id))
+        if path is None:
+            return None
+        response = await send_file(path, mimetype=spec.content_type, as_attachment=download,
+                                   attachment_filename=f"generated.{spec.fmt}", add_etags=False,
+                                   cache_timeout=31536000)
+        response.set_etag(f"{image_id}-{spec.key}")
+        response.vary.add("Accept")
+        await response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+        return response
+
+    path = blob_store.path(image_id)
+    if path is not None:
+        body, content_type = path, "image/png"
+    else:
+        blob = await asyncio.to_thread(blob_store.get, image_id)
+        if blob is None:
+            return None
+        data, content_type = blob
+        body = io.BytesIO(data)
+
+    response = await send_file(body, mimetype=content_type, as_attachment=download,
+                               attachment_filename="generated.png", add_etags=False, cache_timeout=31536000)
+    response.set_etag(image_id)
+    await response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+    return response
+
+
+@app.route("/ready", methods=["GET"])
+async def ready():
+    if not is_ready():
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True})
+
+
+@app.route("/metrics", methods=["GET"])
+async def get_metrics():
+    return Response(metrics.render(), mimetype=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route("/images/<image_id>", methods=["GET"])
+async def get_image(image_id, size=None):
+    try:
+        spec = image_variants.parse_spec(request.args, request.headers.get("Accept"), size=size)
+    except image_variants.VariantError as e:
+        return jsonify({"type": "error", "message": str(e)}), 400
+    response = await send_image(image_id, download=request.args.get("download") == "1", spec=spec)
+    if response is None:
+        return jsonify({"error": "Image not found"}), 404
+    return response
+
+
+@app.route("/images/<image_id>/thumbnail", methods=["GET"])
+async def get_thumbnail(image_id):
+    return await get_image(image_id, size="thumb")
+
+
+@app.route("/images/<image_id>/overlay", methods=["POST"])
+async def add_overlay(image_id):
+    try:
+        data = await request.get_json(silent=True) or {}
+        new_id = await asyncio.to_thread(overlay_image, image_id, data.get("text", ""), data.get("position", "bottom"))
+        if new_id is None:
+            return jsonify({"error": "Image not found"}), 404
+        return jsonify({"type": "image", **image_payload(new_id), "source_image_id": image_id}), 201
+    except image_variants.VariantError as e:
+        return jsonify({"type": "error", "message": str(e)}), 400
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"type": "error", "message": f"Server error: {type(e).__name__}: {str(e)}"}), 500
+
+
+@app.route("/query", methods=["POST"])
+async def query():
+    try:
+        data = await request.get_json()
+        user_input = data.get("input", "").strip()
+        if not user_input:
+            return jsonify({"type": "error", "message": "Input cannot be empty"}), 400
+
+        g.identity = await asyncio.to_thread(identity.from_request, request)
+        user_id, session_id = g.identity.user_id, g.identity.session_id
+
+        g.admission = await rate_limit.limiter.aacquire("text", user_id, session_id)
+        if not g.admission.allowed:
+            return jsonify({**g.admission.payload(), "user_id": user_id, "session_id": session_id}), 429
+
+        user_input = await asyncio.to_thread(attach_upload_context, session_id, user_input)
+        image_mode = data.get("image_mode", jobs.IMAGE_MODE)
+
+        if await wants_stream():
+            return stream_response(user_input, session_id, user_id, image_mode)
+
+        result = await aask(user_input, session_id, image_mode, user_id)
+        if not result or not isinstance(result, dict):
+            result = {"output": "I couldn’t generate a proper response this time."}
+        output = result.get("output", "I couldn’t generate a proper response this time.")
+        g.usage = result.get("usage")
+
+        # In a thread either way: a full queue makes even a non-durable save wait.
+        durable = data.get("durable", persistence.PERSIST_DURABLE)
+        pending = await asyncio.to_thread(save_message, session_id, user_input, output, durable)
+
+        if result.get("retry_after"):
+            return jsonify({"type": "error", "message": output, "retry_after": result["retry_after"],
+                            "user_id": user_id, "session_id": session_id}), 429, {"Retry-After": str(result["retry_after"])}
+
+        job_id = follow_image_job(session_id, output, pending)
+        if job_id:
+            return jsonify({"type": "job", **job_payload(job_id), "user_id": user_id, "session_id": session_id}), 202
+
+        image_id = parse_image_ref(output)
+        if image_id:
+            if data.get("image_format") == "url":
+                return jsonify({"type": "image", **image_payload(image_id), "user_id": user_id, "session_id": session_id})
+            spec = image_variants.parse_spec({}, request.headers.get("Accept"))
+            response = await send_image(image_id, download=data.get("download", False), spec=spec)
+            if response is None:
+                return jsonify({"type": "error", "message": "Generated image could not be found"}), 500
+            response.headers["user_id"] = user_id
+            response.headers["session_id"] = session_id
+            response.headers["image_id"] = image_id
+            return response
+
+        return jsonify({
+            "type": "text",
+            "message": output,
+            "user_id": user_id,
+            "session_id": session_id
+        })
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"type": "error", "message": f"Server error: {type(e).__name__}: {str(e)}"}), 500
+
+
+@app.route("/new_session", methods=["POST"])
+async def new_session():
+    try:
+        g.identity = await asyncio.to_thread(identity.from_request, request, True, True)
+        return jsonify({
+            "message": "New session created successfully.",
+            "session_id": g.identity.session_id,
+            "user_id": g.identity.user_id
+        })
+    except Exception as e:
+        return jsonify({"error": f"Failed to create new session: {str(e)}"}), 500
+
+
+@app.route("/sessions", methods=["GET"])
+async def list_sessions():
+    try:
+        user_id = (await asyncio.to_thread(identity.from_request, request, False)).user_id
+        if not user_id:
+            return jsonify({"error": "User not initialized"}), 400
+
+        if request.args.get("limit") is None and request.args.get("cursor") is None:
+            return jsonify(await asyncio.to_thread(history.list_all_sessions, user_id, request.args.get("fields")))
+
+        return jsonify(await asyncio.to_thread(
+            history.list_sessions, user_id, request.args.get("limit"), request.args.get("cursor"),
+            request.args.get("fields")
+        ))
+
+    except history.PageError as e:
+        return jsonify({"type": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"type": "error", "message": f"Server error: {str(e)}"}), 500
+
+
+@app.route("/sessions/<session_id>/messages", methods=["GET"])
+async def list_session_messages(session_id):
+    try:
+        user_id = (await asyncio.to_thread(identity.from_request, request, False)).user_id
+        if not await asyncio.to_thread(identity.owns_session, user_id, session_id):
+            return jsonify({"error": "Session not found"}), 404
+
+        return jsonify(await asyncio.to_thread(
+            history.list_messages, session_id, request.args.get("limit"), request.args.get("cursor"),
+            request.args.get("fields"), request.args.get("order", "desc")
+        ))
+
+    except history.PageError as e:
+        return jsonify({"type": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"type": "error", "message": f"Server error: {str(e)}"}), 500
+
+
+@app.route("/upload", methods=["POST"])
+async def upload_file():
+    try:
+        files = await request.files
+        if "file" not in files:
+            return jsonify({"error": "No file uploaded"}), 400
+
+        file = files["file"]
+        if not file.filename:
+            return jsonify({"error": "Empty filename"}), 400
+
+        session_id = (await asyncio.to_thread(identity.from_request, request, False)).session_id
+        if not session_id:
+            return jsonify({"error": "No active session found"}), 400
+
+        filename = file.filename
+        spool_path = ingestion.new_spool_path(filename)
+        started = time.perf_counter()
+        await file.save(spool_path)
+        upload_id = await asyncio.to_thread(
+            ingestion.submit_upload, session_id, filename, file.content_type, spool_path,
+            (time.perf_counter() - started) * 1000
+        )
+
+        form = await request.form
+        if form.get("wait") == "1":
+            job = await asyncio.to_thread(ingestion.wait_for, upload_id)
+            if job is None:
+                return jsonify({"type": "error", "message": "Upload status is no longer available.",
+                                "upload_id": upload_id}), 500
+            if job["status"] == "failed":
+                return jsonify({"type": "error", "message": f"Processing failed: {job['error']}", "upload": job}), 500
+            return jsonify({
+                "message": f"{filename} uploaded and processed successfully.",
+                "session_id": session_id,
+                "upload_id": upload_id
+            })
+
+        return jsonify({
+            "message": f"{filename} uploaded; processing in the background.",
+            "session_id": session_id,
+            "upload_id": upload_id,
+            "status_url": f"/upload/{upload_id}/status"
+        }), 202
+
+    except RequestEntityTooLarge:
+        # The body is over MAX_CONTENT_LENGTH, so it was refused before being read.
+        return jsonify({"type": "error", "message": str(ingestion.UploadTooLarge())}), 413
+    except ingestion.UploadTooLarge as e:
+        return jsonify({"type": "error", "message": str(e)}), 413
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({
+            "type": "error",
+            "message": f"Server error: {type(e).__name__}: {str(e)}"
+        }), 500
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+async def get_job(job_id):
+    job = jobs.image_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job (it may have expired or belong to another worker)"}), 404
+    return jsonify(job_status(job))
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+async def job_events(job_id):
+    job = jobs.image_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job (it may have expired or belong to another worker)"}), 404
+
+    async def generate():
+        # Polled on the loop rather than parking a thread per subscriber in wait_change().
+        current, idle = job, 0.0
+        yield sse_event("status", job_status(current))
+        while current["status"] not in jobs.TERMINAL:
+            await asyncio.sleep(JOB_POLL_SECONDS)
+            changed = jobs.image_jobs.get(job_id)
+            if changed is None:
+                return
+            if changed["version"] == current["version"]:
+                idle += JOB_POLL_SECONDS
+                if idle >= 15:
+                    idle = 0.0
+                    yield ": keep-alive\n\n"
+                continue
+            current, idle = changed, 0.0
+            yield sse_event("status", job_status(current))
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.timeout = None
+    return response
+
+
+@app.route("/upload/<int:upload_id>/status", methods=["GET"])
+async def upload_status(upload_id):
+    job = ingestion.get_job(upload_id)
+    if job is None:
+        return jsonify({"error": "Unknown upload (it may have been processed by another worker)"}), 404
+    return jsonify(job)
+
+
+if __name__ == "__main__":
+    app.run()
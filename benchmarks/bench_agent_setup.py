@@ -0,0 +1,57 @@
+"""
+Micro-benchmark for the per-request setup done by ask().
+
+Before: every call built AgentExecutor(agent, tools, memory) and every Tavily call built a
+new TavilySearch client. After: both are built once and each call only prepares its input
+from the session memory. No network calls are made.
+
+Usage: python benchmarks/bench_agent_setup.py [iterations]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("GROQ_API_KEY", "bench")
+os.environ.setdefault("TAVILY_API_KEY", "bench")
+
+import agent  # noqa: E402
+from langchain.agents import AgentExecutor  # noqa: E402
+from langchain_tavily import TavilySearch  # noqa: E402
+
+
+def per_request_setup(memory):
+    runtime = agent.get_runtime()
+    AgentExecutor(agent=runtime.agent, tools=runtime.tools, memory=memory)
+    TavilySearch(tavily_api_key=agent.TAVILY_API_KEY, max_results=3)
+    memory.load_memory_variables({})
+
+
+def shared_setup(memory):
+    agent.get_runtime().tavily_http.session
+    agent._agent_input("LinkedIn post about AI in marketing", memory)
+
+
+def measure(label, fn, memory, iterations):
+    fn(memory)  # warm up
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(memory)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_call_us = elapsed / iterations * 1e6
+    print(f"{label:<22} {per_call_us:10.1f} us/request   peak traced {peak / 1024:8.1f} KiB")
+    return per_call_us
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    memory = agent.get_memory("bench-session")
+    memory.save_context({"input": "hi"}, {"output": "Hello! How can I help with your copy today?"})
+
+    before = measure("per-request (before)", per_request_setup, memory, iterations)
+    after = measure("shared (after)", shared_setup, memory, iterations)
+    print(f"setup overhead reduced {before / after:.1f}x")
@@ -0,0 +1,79 @@
+"""
+Startup cost: time and resident memory to import each entry point, and what building the agent
+adds on top.
+
+Every measurement runs in a fresh interpreter (cold module state, warm OS file cache) and the
+median over --rounds is reported. "warm-up" is agent.warm_up() right after the import, i.e. the
+work the first request pays unless AGENT_WARM_UP moves it to startup. The last column lists
+heavy dependencies that were already loaded by the import alone.
+
+No network or database connections are made: keys are dummies and MEMORY_BACKEND=memory.
+
+Usage: python benchmarks/bench_import.py [--rounds 5] [--modules agent,app,asgi_app]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+HEAVY = ["langchain", "langchain_openai", "openai", "langsmith", "httpx", "PIL", "PyPDF2", "docx"]
+
+PROBE = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter() - started
+rss = rss_mb()
+loaded = [name for name in {heavy!r} if name in sys.modules]
+
+import agent
+started = time.perf_counter()
+agent.get_runtime()
+warm = time.perf_counter() - started
+print(json.dumps({{"import_ms": imported * 1000, "rss_mb": rss, "warm_ms": warm * 1000,
+                  "warm_rss_mb": rss_mb(), "loaded": loaded}}))
+"""
+
+
+def probe(module):
+    env = dict(os.environ)
+    for key in ("GROQ_API_KEY", "TAVILY_API_KEY", "CLOUDFLARE_API_TOKEN", "CLOUDFLARE_ACCOUNT_ID"):
+        env.setdefault(key, "bench")
+    env.update(MEMORY_BACKEND="memory", AGENT_WARM_UP="off")
+    code = PROBE.format(root=ROOT, module=module, heavy=HEAVY)
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--modules", default="agent,app,asgi_app")
+    args = parser.parse_args()
+
+    print(f"{'module':<10} {'import ms':>10} {'RSS MB':>8} {'warm-up ms':>11} {'RSS after MB':>13}  heavy deps loaded by import")
+    for module in args.modules.split(","):
+        runs = [probe(module) for _ in range(args.rounds)]
+
+        def median(key):
+            return statistics.median(run[key] for run in runs)
+
+        print(f"{module:<10} {median('import_ms'):>10.0f} {median('rss_mb'):>8.1f} {median('warm_ms'):>11.0f} "
+              f"{median('warm_rss_mb'):>13.1f}  {', '.join(runs[-1]['loaded']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Session and message listing on a synthetic database with a million messages.
+
+Creates a throwaway database on the Postgres server from .env (like load_test.py), applies
+001_schema.sql, and seeds 1,000 users / 50,000 sessions / 1,000,000 messages. One power user
+owns 2,000 sessions of 40 turns each. It times the old unbounded /sessions query and a "fetch the
+whole session" read against the paginated history.py queries, first without and then with
+the indexes from 002_listing_indexes.sql. Also reports the JSON payload size of each response.
+
+Usage: python benchmarks/bench_listing.py [--messages 1000000] [--rounds 20] [--keep-db]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import psycopg2  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+
+from load_test import db_params, create_database, drop_database, MIGRATIONS  # noqa: E402
+
+USERS = 1000
+POWER_USER = "00000000-0000-0000-0000-000000000001"
+POWER_SESSIONS = 2000
+POWER_TURNS = 40
+
+SEED = """
+INSERT INTO users (user_id)
+SELECT ('00000000-0000-0000-0000-' || lpad(to_hex(u), 12, '0'))::text FROM generate_series(1, %(users)s) u;
+
+INSERT INTO sessions (session_id, user_id, start_time, title)
+SELECT md5('s' || s), %(power_user)s, NOW() - (s || ' minutes')::interval, 'Power session ' || s
+FROM generate_series(1, %(power_sessions)s) s;
+
+INSERT INTO sessions (session_id, user_id, start_time, title)
+SELECT md5('o' || s), '00000000-0000-0000-0000-' || lpad(to_hex(2 + s %% (%(users)s - 1)), 12, '0'),
+       NOW() - (s || ' minutes')::interval, 'Session ' || s
+FROM generate_series(1, %(other_sessions)s) s;
+
+INSERT INTO messages (session_id, message, created_at)
+SELECT md5('s' || (i / %(power_turns)s + 1)),
+       jsonb_build_object('user', 'Write a LinkedIn post about launch ' || i || repeat(' brand voice notes', 10),
+                          'ai', repeat('Crafting compelling copy for your audience. ', 12)),
+       NOW() - ((%(power_messages)s - i) || ' seconds')::interval
+FROM generate_series(0, %(power_messages)s - 1) i;
+
+INSERT INTO messages (session_id, message, created_at)
+SELECT md5('o' || (i %% %(other_sessions)s + 1)),
+       jsonb_build_object('user', 'Write an ad for product ' || i || repeat(' brand voice notes', 10),
+                          'ai', repeat('Crafting compelling copy for your audience. ', 12)),
+       NOW() - ((%(other_messages)s - i) || ' seconds')::interval
+FROM generate_series(0, %(other_messages)s - 1) i;
+"""
+
+# The listing queries as they were before pagination.
+OLD_SESSIONS = """
+    SELECT session_id, start_time, end_time, COALESCE(title, 'New Chat') AS title, is_active
+    FROM sessions WHERE user_id = %s ORDER BY start_time DESC
+"""
+OLD_MESSAGES = "SELECT id, created_at, message FROM messages WHERE session_id = %s ORDER BY id"
+
+
+def timed_median(func, rounds):
+    timings, result = [], None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, result
+
+
+def payload_kb(result):
+    return len(json.dumps(result, default=str).encode("utf-8")) / 1024
+
+
+def run_cases(history, rounds):
+    from db import get_db_connection
+
+    def old_query(sql, arg):
+        def run():
+            with get_db_connection() as conn, conn.cursor() as cur:
+                cur.execute(sql, (arg,))
+                return cur.fetchall()
+        return run
+
+    session_id = history.list_sessions(POWER_USER, limit=1)["sessions"][0]["session_id"]
+    deep = history.list_sessions(POWER_USER, limit=100, fields="session_id")
+    for _ in range(9):
+        deep = history.list_sessions(POWER_USER, limit=100, cursor=deep["next_cursor"], fields="session_id")
+    cases = [
+        ("sessions: all (old)", old_query(OLD_SESSIONS, POWER_USER)),
+        ("sessions: page 1", lambda: history.list_sessions(POWER_USER)),
+        ("sessions: page 1, titles", lambda: history.list_sessions(POWER_USER, fields="session_id,title")),
+        ("sessions: page 11", lambda: history.list_sessions(POWER_USER, cursor=deep["next_cursor"])),
+        ("messages: whole session (old)", old_query(OLD_MESSAGES, session_id)),
+        ("messages: newest page", lambda: history.list_messages(session_id)),
+        ("messages: newest page, user only", lambda: history.list_messages(session_id, fields="id,user")),
+    ]
+    results = {}
+    for label, func in cases:
+        ms, result = timed_median(func, rounds)
+        results[label] = (ms, payload_kb(result))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--keep-db", action="store_true")
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(ROOT, ".env"))
+    database = f"copywriter_listing_{os.getpid()}"
+    create_database(database)
+    os.environ["DB_NAME"] = database
+    try:
+        conn = psycopg2.connect(**db_params(database))
+        power_messages = POWER_SESSIONS * POWER_TURNS
+        other_sessions = 50_000 - POWER_SESSIONS
+        with conn, conn.cursor() as cur:
+            with open(MIGRATIONS[0], "r") as f:
+                cur.execute(f.read())
+            print(f"seeding {args.messages:,} messages...", flush=True)
+            started = time.perf_counter()
+            cur.execute(SEED, {"users": USERS, "power_user": POWER_USER, "power_sessions": POWER_SESSIONS,
+                               "power_turns": POWER_TURNS, "power_messages": power_messages,
+                               "other_sessions": other_sessions,
+                               "other_messages": max(0, args.messages - power_messages)})
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE")
+        print(f"seeded in {time.perf_counter() - started:.1f}s", flush=True)
+
+        import history
+        before = run_cases(history, args.rounds)
+        with conn.cursor() as cur:
+            for path in MIGRATIONS[1:]:
+                with open(path, "r") as f:
+                    cur.execute(f.read())
+            cur.execute("ANALYZE")
+        after = run_cases(history, args.rounds)
+        conn.close()
+
+        print(f"\n{'query':<34} {'no index ms':>12} {'indexed ms':>11} {'payload KB':>11}")
+        for label, (ms, kb) in before.items():
+            print(f"{label:<34} {ms:>12.2f} {after[label][0]:>11.2f} {kb:>11.1f}")
+    finally:
+        from db import get_pool
+        get_pool().closeall()
+        if not args.keep_db:
+            drop_database(database)
+
+
+if __name__ == "__main__":
+    main()
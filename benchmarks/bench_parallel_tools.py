@@ -0,0 +1,63 @@
+"""
+Latency of a turn that calls TavilySearch and GenerateImagePoster in the same model step.
+
+Runs the agent against the local fakes (fake_services.py) with the stock AgentExecutor
+(tools one after another) and with ParallelAgentExecutor (tools at the same time), for both
+the sync and the async path. With 800 ms per tool the sync turn drops from roughly the sum of
+both tools to roughly the slower one; the stock async executor already gathers tool calls,
+so there the change only adds per-tool timeouts.
+
+Usage: python benchmarks/bench_parallel_tools.py [rounds]
+"""
+import os
+import sys
+import time
+import asyncio
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_services import FakeServices  # noqa: E402
+
+services = FakeServices(llm_latency_ms=50, token_ms=0, reply_tokens=40, search_latency_ms=800,
+                        image_latency_ms=800, image_kb=64).start()
+os.environ.update(services.env())
+os.environ["MEMORY_BACKEND"] = "memory"
+os.environ["IMAGE_CACHE_ENABLED"] = "false"
+os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+
+import agent  # noqa: E402
+from langchain.agents import AgentExecutor  # noqa: E402
+
+PROMPT = "Write an ad on the latest coffee trends and design a poster for it"
+
+
+def run(executor, rounds, use_async):
+    memory = agent.get_memory("bench")
+    timings = []
+    for i in range(rounds):
+        inputs = agent._agent_input(f"{PROMPT} (round {i})", memory)
+        started = time.perf_counter()
+        if use_async:
+            asyncio.run(executor.ainvoke(inputs))
+        else:
+            executor.invoke(inputs)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    runtime = agent.get_runtime()
+    sequential = AgentExecutor(agent=runtime.agent, tools=runtime.tools)
+    parallel = runtime.agent_executor
+    print(f"{'path':<8} {'sequential s':>14} {'parallel s':>12}")
+    for label, use_async in (("sync", False), ("async", True)):
+        before = run(sequential, rounds, use_async)
+        after = run(parallel, rounds, use_async)
+        print(f"{label:<8} {before:>14.2f} {after:>12.2f}")
+    services.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Prompt size and latency of retrieval over an uploaded file vs. pasting the full text.
+
+Builds a synthetic ~50-page brand guide, indexes it the way ingestion does, and for a set
+of copywriting queries compares the reference block sent to the LLM: the full
+extracted_text (previous behaviour) vs. the top-k chunks under the token budget.
+Token counts use tiktoken when it is installed, otherwise the ~4 chars/token estimate.
+
+Usage: python benchmarks/bench_retrieval.py [pages]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import retrieval  # noqa: E402
+
+TOPICS = {
+    "voice": "Our brand voice is warm, confident and plain-spoken. We avoid jargon and speak to customers as partners.",
+    "colors": "Brand colors: the primary palette is ocean teal and sand beige. Accent coral is reserved for calls to action on banners.",
+    "social": "On LinkedIn we share customer stories and product milestones, using at most three hashtags per post.",
+    "products": "The Aurora running shoe line focuses on recycled materials, lightweight cushioning and all-day comfort.",
+    "legal": "Claims about sustainability must cite the annual impact report and avoid absolute statements.",
+    "events": "Seasonal campaigns run for Diwali, summer sale and back to school. Diwali greetings use warm, festive wording.",
+}
+# (query, a phrase the retrieved excerpts should contain)
+QUERIES = [
+    ("Write a LinkedIn post about our Aurora running shoes", "Aurora"),
+    ("Create a Diwali greeting caption in our brand voice", "Diwali"),
+    ("Draft a banner headline using our brand colors", "ocean teal"),
+    ("Product description highlighting sustainability claims", "sustainability"),
+]
+FILLER = ("This section expands on guidelines for copywriters, designers and regional marketing teams, "
+          "with examples of do and don't phrasing, review workflows and approval checklists. ")
+
+
+def count_tokens():
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("o200k_base")
+        return lambda text: len(encoding.encode(text)), "tiktoken o200k_base"
+    except Exception:
+        return retrieval.estimate_tokens, "~4 chars/token estimate"
+
+
+def brand_guide(pages):
+    rng = random.Random(7)
+    out = []
+    for page in range(pages):
+        topic = rng.choice(list(TOPICS))
+        out.append(f"Page {page + 1}: {topic.title()}\n{TOPICS[topic]}\n" + FILLER * 18 + "\n")
+    return out
+
+
+if __name__ == "__main__":
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    tokens, tokenizer = count_tokens()
+    pieces = brand_guide(pages)
+    full_text = "".join(pieces)
+
+    started = time.perf_counter()
+    chunker = retrieval.StreamingChunker()
+    for piece in pieces:
+        chunker.feed(piece)
+    index = retrieval.VectorIndex.build(chunker.finish())
+    build_ms = (time.perf_counter() - started) * 1000
+
+    full_tokens = tokens(full_text)
+    print(f"document: {pages} pages, {len(full_text):,} chars, {full_tokens:,} tokens ({tokenizer})")
+    print(f"index: {len(index.chunks)} chunks built in {build_ms:.1f} ms")
+    print(f"{'query':<58} {'full':>8} {'retrieved':>10} {'saved':>7} {'search ms':>10} {'relevant':>9}")
+
+    latencies, retrieved_tokens = [], []
+    for query, expected in QUERIES:
+        started = time.perf_counter()
+        for _ in range(20):
+            excerpts = index.search(query)
+        search_ms = (time.perf_counter() - started) * 1000 / 20
+        reference = "\n...\n".join(excerpts)
+        n = tokens(reference)
+        latencies.append(search_ms)
+        retrieved_tokens.append(n)
+        relevant = f"{sum(expected in e for e in excerpts)}/{len(excerpts)}"
+        print(f"{query:<58} {full_tokens:>8,} {n:>10,} {1 - n / full_tokens:>6.0%} {search_ms:>10.2f} {relevant:>9}")
+
+    print(f"mean prompt reference tokens: {full_tokens:,} -> {statistics.mean(retrieved_tokens):,.0f}; "
+          f"mean retrieval latency {statistics.mean(latencies):.2f} ms")
@@ -0,0 +1,288 @@
+"""
+Local stand-ins for the external services used by agent.py, for offline load tests.
+
+  POST /openai/v1/chat/completions      OpenAI-compatible chat (Groq); tool calls and SSE streaming
+  POST /search                          Tavily search
+  POST /client/v4/accounts/<id>/ai/run/<model>   Cloudflare Workers AI image model
+
+The chat fake plays a fixed script: prompts mentioning a banner/poster/image call the image
+tool, prompts asking for news/trends/search call the search tool (both at once, as parallel
+tool calls, when a prompt asks for both), and everything else (and any turn after a tool
+result) gets a text reply of `reply_tokens` tokens. Latency and payload size
+are configurable, so runs are repeatable and never touch the real APIs.
+
+Usage: python benchmarks/fake_services.py [--port 8765] [--llm-latency-ms 300] ...
+Prints the environment variables that point the app at it.
+"""
+import re
+import sys
+import json
+import time
+import zlib
+import base64
+import struct
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+IMAGE_WORDS = re.compile(r"\b(banner|poster|image|picture|visual)s?\b", re.IGNORECASE)
+SEARCH_WORDS = re.compile(r"\b(latest|news|trend|trends|trending|search|today|current)\b", re.IGNORECASE)
+FILLER_WORDS = ("Crafting", "compelling", "copy", "that", "speaks", "to", "your", "audience", "with",
+                "clarity", "and", "energy", "across", "every", "channel", "you", "use.")
+
+
+DEFAULTS = {
+    "llm_latency_ms": 300,      # time to first token
+    "token_ms": 5,              # delay between streamed tokens
+    "reply_tokens": 120,
+    "search_latency_ms": 400,
+    "search_kb": 4,
+    "image_latency_ms": 1500,
+    "image_kb": 600,
+}
+
+
+def _png(size_bytes: int, seed: str) -> bytes:
+    """A valid 1x1 PNG padded with a private chunk to roughly `size_bytes`."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+    pixel = chunk(b"IDAT", zlib.compress(b"\x00\xff\x80\x00"))
+    filler = (seed.encode("utf-8") * (size_bytes // max(len(seed), 1) + 1))[:max(size_bytes - 70, 0)]
+    return header + chunk(b"prVt", filler) + pixel + chunk(b"IEND", b"")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that time out or cancel a tool call just hang up; that's expected here.
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class FakeServices:
+    """Owns the HTTP server thread and per-endpoint call counters."""
+
+    def __init__(self, port=0, **options):
+        self.options = {**DEFAULTS, **{k: v for k, v in options.items() if v is not None}}
+        self.counters = {"chat": 0, "search": 0, "image": 0}
+        self._lock = threading.Lock()
+        handler = type("Handler", (_Handler,), {"services": self})
+        self.server = _Server(("127.0.0.1", port), handler)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def env(self) -> dict:
+        return {
+            "GROQ_API_KEY": "fake",
+            "GROQ_BASE_URL": f"{self.base_url}/openai/v1",
+            "TAVILY_API_KEY": "fake",
+            "TAVILY_API_BASE_URL": self.base_url,
+            "CLOUDFLARE_API_TOKEN": "fake",
+            "CLOUDFLARE_ACCOUNT_ID": "fake",
+            "CLOUDFLARE_API_BASE_URL": f"{self.base_url}/client/v4",
+        }
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    services = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        body = self._read_json()
+        if path.endswith("/chat/completions"):
+            self.services.count("chat")
+            return self._chat(body)
+        if path == "/search":
+            self.services.count("search")
+            return self._search(body)
+        if "/ai/run/" in path:
+            self.services.count("image")
+            return self._image(body)
+        self._send_json({"error": f"unknown path {path}"}, status=404)
+
+    # Chat completions
+
+    def _plan(self, body):
+        """Returns ("tools", [(name, args), ...]) or ("text", reply) for this turn."""
+        opts = self.services.options
+        messages = body.get("messages") or []
+        tools = {t["function"]["name"]: t["function"] for t in body.get("tools") or []}
+        last = messages[-1] if messages else {}
+        text = last.get("content") or ""
+        if isinstance(text, list):
+            text = " ".join(part.get("text", "") for part in text if isinstance(part, dict))
+
+        if tools and last.get("role") == "user":
+            calls = []
+            for pattern, hint in ((SEARCH_WORDS, "search"), (IMAGE_WORDS, "image")):
+                if not pattern.search(text):
+                    continue
+                for name, spec in tools.items():
+                    if hint in name.lower() or (hint == "image" and "poster" in name.lower()):
+                        params = spec.get("parameters") or {}
+                        arg = (params.get("required") or list(params.get("properties") or {}) or ["input"])[0]
+                        calls.append((name, {arg: text[-500:]}))
+                        break
+            if calls:
+                return "tools", calls
+
+        if not tools:
+            # Direct LLM call, e.g. the banner prompt enhancer.
+            reply = f"Poster: {text.strip()[-120:]}, bold headline, high resolution, cinematic lighting"
+        else:
+            words = [FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(opts["reply_tokens"])]
+            reply = " ".join(words)
+        return "text", reply
+
+    def _usage(self, body, completion_text):
+        prompt_chars = sum(len(json.dumps(m)) for m in body.get("messages") or [])
+        prompt_tokens = max(1, prompt_chars // 4)
+        completion_tokens = max(1, len(completion_text) // 4)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _chat(self, body):
+        opts = self.services.options
+        kind, value = self._plan(body)
+        time.sleep(opts["llm_latency_ms"] / 1000)
+        created = int(time.time())
+        model = body.get("model", "fake")
+        call_id = f"call_{created}_{threading.get_ident()}"
+
+        if kind == "tools":
+            tool_calls = [{"id": f"{call_id}_{i}", "type": "function",
+                           "function": {"name": name, "arguments": json.dumps(args)}}
+                          for i, (name, args) in enumerate(value)]
+            message = {"role": "assistant", "content": None, "tool_calls": tool_calls}
+            finish_reason = "tool_calls"
+            usage = self._usage(body, json.dumps(tool_calls))
+        else:
+            message = {"role": "assistant", "content": value}
+            finish_reason = "stop"
+            usage = self._usage(body, value)
+
+        if not body.get("stream"):
+            return self._send_json({
+                "id": call_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": usage
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def emit(delta, finish=None, usage_payload=None):
+            chunk = {"id": call_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [] if usage_payload else [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            if usage_payload:
+                chunk["usage"] = usage_payload
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        if kind == "tools":
+            emit({"role": "assistant", "content": None,
+                  "tool_calls": [{"index": i, **call} for i, call in enumerate(tool_calls)]})
+        else:
+            emit({"role": "assistant", "content": ""})
+            for i, word in enumerate(value.split(" ")):
+                emit({"content": word if i == 0 else f" {word}"})
+                if opts["token_ms"]:
+                    time.sleep(opts["token_ms"] / 1000)
+        emit({}, finish=finish_reason)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            emit(None, usage_payload=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    # Tavily
+
+    def _search(self, body):
+        opts = self.services.options
+        time.sleep(opts["search_latency_ms"] / 1000)
+        query = body.get("query", "")
+        max_results = int(body.get("max_results") or 3)
+        per_result = max(64, opts["search_kb"] * 1024 // max_results)
+        sentence = f"Findings about {query[:80]} from an industry report. "
+        results = [{
+            "title": f"Result {i + 1} for {query[:60]}",
+            "url": f"https://example.com/{i + 1}",
+            "content": (sentence * (per_result // len(sentence) + 1))[:per_result],
+            "score": round(0.9 - i * 0.1, 2),
+            "raw_content": None
+        } for i in range(max_results)]
+        self._send_json({"query": query, "follow_up_questions": None, "answer": None, "images": [],
+                         "results": results, "response_time": opts["search_latency_ms"] / 1000})
+
+    # Cloudflare Workers AI
+
+    def _image(self, body):
+        opts = self.services.options
+        time.sleep(opts["image_latency_ms"] / 1000)
+        image = _png(opts["image_kb"] * 1024, body.get("prompt", "banner"))
+        self._send_json({"result": {"image": base64.b64encode(image).decode("ascii")},
+                         "success": True, "errors": [], "messages": []})
+
+
+def add_arguments(parser):
+    """Latency/payload flags shared with load_test.py."""
+    for name, default in DEFAULTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=int, default=default)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = vars(parser.parse_args())
+    services = FakeServices(port=args.pop("port"), **args)
+    for key, value in services.env().items():
+        print(f"export {key}={value}")
+    print(f"# fake services listening on {services.base_url} (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        services.server.serve_forever()
+    except KeyboardInterrupt:
+        services.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""
+Offline load test for /query, /upload and /sessions.
+
+Starts the fake Groq/Tavily/Cloudflare services (fake_services.py), creates a throwaway
+database on the Postgres server from .env (DB_HOST/DB_USER/DB_PASS/DB_PORT), applies
+migrations/, boots the app in a subprocess pointed at both, and drives it with concurrent
+clients. Reports p50/p95/p99 latency, requests/second and the server's peak RSS, and writes
+a JSON result tagged with the git commit so runs can be compared across commits.
+
+Usage:
+  python benchmarks/load_test.py [--server flask|asgi] [--concurrency 16] [--requests 200]
+                                 [--scenarios query,upload,sessions] [--compare results/<old>.json]
+
+Any Postgres works, e.g. a disposable container:
+  docker run --rm -d -p 5433:5432 -e POSTGRES_PASSWORD=bench postgres:16
+  DB_HOST=127.0.0.1 DB_PORT=5433 DB_USER=postgres DB_PASS=bench python benchmarks/load_test.py
+Use --database <name> to run against an existing local test DB instead of a throwaway one.
+"""
+import os
+import sys
+import json
+import time
+import glob
+import math
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import psycopg2
+from dotenv import load_dotenv
+
+from fake_services import FakeServices, add_arguments
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+MIGRATIONS = sorted(glob.glob(os.path.join(ROOT, "migrations", "*.sql")))
+
+# Rotated through by the query scenario: plain copy, a search turn, a banner turn, and a
+# turn that needs both tools.
+QUERY_PROMPTS = {
+    "text": "Write a LinkedIn post about AI in marketing for a B2B audience",
+    "search": "Summarize the latest news on retail media networks for a newsletter intro",
+    "image": "Create a banner for our summer coffee sale with the headline Cool Brew Days",
+    "combo": "Write an ad on the latest coffee trends and design a poster for it",
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile.
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        "requests": len(values) + errors,
+        "errors": errors,
+        "rps": round(len(values) / elapsed, 2) if elapsed else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "max_ms": ms(values[-1]) if values else None,
+        "elapsed_s": round(elapsed, 3),
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=ROOT, text=True).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Database
+
+def db_params(database):
+    return {"host": os.getenv("DB_HOST"), "port": os.getenv("DB_PORT"), "user": os.getenv("DB_USER"),
+            "password": os.getenv("DB_PASS"), "dbname": database}
+
+
+def create_database(name):
+    conn = psycopg2.connect(**db_params(os.getenv("BENCH_ADMIN_DB", "postgres")))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'CREATE DATABASE "{name}"')
+    conn.close()
+
+
+def drop_database(name):
+    conn = psycopg2.connect(**db_params(os.getenv("BENCH_ADMIN_DB", "postgres")))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    conn.close()
+
+
+def apply_migrations(name):
+    conn = psycopg2.connect(**db_params(name))
+    with conn, conn.cursor() as cur:
+        for path in MIGRATIONS:
+            with open(path, "r") as f:
+                cur.execute(f.read())
+    conn.close()
+
+
+# Server under test
+
+def _log_tail(path, lines=20):
+    with open(path, "r", errors="replace") as f:
+        return "".join(f.readlines()[-lines:])
+
+
+def start_server(kind, port, env, workdir):
+    if kind == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1",
+                   "--port", str(port), "--workers", "1", "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-c",
+                   f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True, debug=False)"]
+    log = open(os.path.join(workdir, "server.log"), "w")
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited early:\n{_log_tail(log.name)}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"server did not start within 60s:\n{_log_tail(log.name)}")
+
+
+def peak_rss_mb(pid):
+    """Peak resident set size of the server process (Linux /proc); None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+# Scenarios
+
+_local = threading.local()
+
+
+def http(base_url):
+    # One simulated user per client thread; the identity cookies from /new_session ride along.
+    if not hasattr(_local, "session"):
+        session = requests.Session()
+        session.post(f"{base_url}/new_session", timeout=60).raise_for_status()
+        _local.session = session
+    return _local.session
+
+
+def make_query(base_url, mix):
+    kinds = [kind for kind, weight in mix for _ in range(weight)]
+    counter = iter(range(10 ** 9))
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            i = next(counter)
+        kind = kinds[i % len(kinds)]
+        # A unique suffix keeps the response/image caches from answering repeated prompts.
+        prompt = f"{QUERY_PROMPTS[kind]} (variant {i})"
+        response = http(base_url).post(f"{base_url}/query", json={"input": prompt, "image_format": "url"}, timeout=300)
+        response.raise_for_status()
+    return call
+
+
+def make_upload(base_url, upload_kb):
+    paragraph = ("Brand voice: warm, direct and optimistic. Always lead with the customer benefit. "
+                 "Use short sentences and avoid jargon in headlines. ")
+    document = (paragraph * (upload_kb * 1024 // len(paragraph) + 1))[:upload_kb * 1024].encode("utf-8")
+
+    def call():
+        files = {"file": ("brand_guide.txt", document, "text/plain")}
+        response = http(base_url).post(f"{base_url}/upload", files=files, data={"wait": "1"}, timeout=300)
+        response.raise_for_status()
+    return call
+
+
+def make_sessions(base_url):
+    def call():
+        response = http(base_url).get(f"{base_url}/sessions?limit=20", timeout=60)
+        response.raise_for_status()
+    return call
+
+
+def run_scenario(call, total, concurrency, warmup):
+    for _ in range(warmup):
+        call()
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            call()
+        except Exception:
+            with lock:
+                errors[0] += 1
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(","):
+        kind, _, weight = part.partition(":")
+        if kind not in QUERY_PROMPTS:
+            raise argparse.ArgumentTypeError(f"unknown query kind {kind!r}; use {', '.join(QUERY_PROMPTS)}")
+        mix.append((kind, int(weight or 1)))
+    return mix
+
+
+def print_report(result, baseline=None):
+    print(f"\ncommit {result['commit'][:12]}{' (dirty)' if result['dirty'] else ''}  server={result['server']}  "
+          f"concurrency={result['concurrency']}  peak_rss={result['peak_rss_mb']} MB")
+    header = f"{'scenario':<10} {'reqs':>6} {'err':>5} {'rps':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, stats in result["scenarios"].items():
+        print(f"{name:<10} {stats['requests']:>6} {stats['errors']:>5} {stats['rps'] or 0:>8} "
+              f"{stats['p50_ms'] or 0:>10} {stats['p95_ms'] or 0:>10} {stats['p99_ms'] or 0:>10}")
+        old = (baseline or {}).get("scenarios", {}).get(name)
+        if old:
+            deltas = []
+            for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+                if old.get(key) and stats.get(key) is not None:
+                    deltas.append(f"{key} {100 * (stats[key] - old[key]) / old[key]:+.1f}%")
+            print(f"{'':<10} vs {baseline['commit'][:12]}: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--scenarios", default="query,upload,sessions")
+    parser.add_argument("--query-mix", type=parse_mix, default=parse_mix("text:6,search:2,image:2"))
+    parser.add_argument("--upload-kb", type=int, default=256)
+    parser.add_argument("--database", help="existing database to use instead of a throwaway one")
+    parser.add_argument("--keep-db", action="store_true")
+    parser.add_argument("--out", help=f"result file (default: {os.path.relpath(RESULTS_DIR, ROOT)}/<commit>-<server>.json)")
+    parser.add_argument("--compare", help="earlier result file to diff against")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(ROOT, ".env"))
+    fake_options = {name: getattr(args, name) for name in ("llm_latency_ms", "token_ms", "reply_tokens",
+                                                            "search_latency_ms", "search_kb",
+                                                            "image_latency_ms", "image_kb")}
+    services = FakeServices(**fake_options).start()
+
+    database = args.database or f"copywriter_bench_{os.getpid()}"
+    if not args.database:
+        create_database(database)
+    workdir = tempfile.mkdtemp(prefix="copywriter_bench_")
+    process = None
+    try:
+        apply_migrations(database)
+        env = {**os.environ, **services.env(), "DB_NAME": database, "PYTHONPATH": os.path.abspath(ROOT),
+               "RESPONSE_CACHE_ENABLED": "false", "METRICS_SAMPLE_RATE": os.getenv("METRICS_SAMPLE_RATE", "1.0"),
+               # The load generator is one client hammering its own sessions; measure capacity, not throttling.
+               "RATE_LIMIT_ENABLED": os.getenv("RATE_LIMIT_ENABLED", "false")}
+        process, base_url = start_server(args.server, free_port(), env, workdir)
+
+        builders = {
+            "query": lambda: make_query(base_url, args.query_mix),
+            "upload": lambda: make_upload(base_url, args.upload_kb),
+            "sessions": lambda: make_sessions(base_url),
+        }
+        scenarios = {}
+        for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+            print(f"running {name}: {args.requests} requests, concurrency {args.concurrency}...", flush=True)
+            scenarios[name] = run_scenario(builders[name](), args.requests, args.concurrency, args.warmup)
+
+        commit, dirty = git_commit()
+        result = {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "server": args.server,
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "query_mix": dict(args.query_mix),
+            "upload_kb": args.upload_kb,
+            "fake_services": fake_options,
+            "fake_service_calls": dict(services.counters),
+            "peak_rss_mb": peak_rss_mb(process.pid),
+            "python": platform.python_version(),
+            "scenarios": scenarios,
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        services.stop()
+        if not args.database and not args.keep_db:
+            drop_database(database)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{commit[:12]}-{args.server}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"\nwrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import os
+import hashlib
+import threading
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+BLOB_BACKEND = os.getenv("BLOB_BACKEND", "filesystem")
+BLOB_DIR = os.getenv("BLOB_DIR", "image_store")
+
+# Agent outputs and stored messages reference images as image://<blob_id>
+# instead of carrying the bytes as a base64 data URL.
+IMAGE_REF_PREFIX = "image://"
+
+
+def image_ref(blob_id: str) -> str:
+    return f"{IMAGE_REF_PREFIX}{blob_id}"
+
+
+def parse_image_ref(output):
+    """Returns the blob id if `output` is an image reference, else None."""
+    if isinstance(output, str) and output.startswith(IMAGE_REF_PREFIX):
+        blob_id = output[len(IMAGE_REF_PREFIX):].strip()
+        if is_valid_blob_id(blob_id):
+            return blob_id
+    return None
+
+
+def is_valid_blob_id(blob_id: str) -> bool:
+    return len(blob_id) == 64 and all(c in "0123456789abcdef" for c in blob_id)
+
+
+def blob_id_for(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    """Write-once, content-addressed storage for binary artifacts. The id is the SHA-256 of the bytes."""
+
+    def put(self, data: bytes, content_type: str = "image/png") -> str:
+        raise NotImplementedError
+
+    def get(self, blob_id: str):
+        """Returns (bytes, content_type), or None if the blob does not exist."""
+        raise NotImplementedError
+
+    def path(self, blob_id: str):
+        """Local file path for the blob when the backend has one (lets Flask use sendfile)."""
+        return None
+
+
+class FilesystemBlobStore(BlobStore):
+
+    def __init__(self, directory=BLOB_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, blob_id: str) -> str:
+        return os.path.join(self.directory, blob_id[:2], f"{blob_id}.png")
+
+    def put(self, data: bytes, content_type: str = "image/png") -> str:
+        blob_id = blob_id_for(data)
+        path = self._path(blob_id)
+        if os.path.exists(path):
+            return blob_id
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return blob_id
+
+    def get(self, blob_id: str):
+        path = self.path(blob_id)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read(), "image/png"
+
+    def path(self, blob_id: str):
+        if not is_valid_blob_id(blob_id):
+            return None
+        path = self._path(blob_id)
+        return os.path.abspath(path) if os.path.exists(path) else None
+
+
+class PostgresBlobStore(BlobStore):
+    """Stores blobs once in the image_blobs table (bytea); messages only keep the id."""
+
+    def put(self, data: bytes, content_type: str = "image/png") -> str:
+        from db import get_db_connection
+
+        blob_id = blob_id_for(data)
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO image_blobs (blob_id, content_type, data)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (blob_id) DO NOTHING
+            """, (blob_id, content_type, data))
+            conn.commit()
+        return blob_id
+
+    def get(self, blob_id: str):
+        from db import get_db_connection
+
+        if not is_valid_blob_id(blob_id):
+            return None
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT content_type, data FROM image_blobs WHERE blob_id = %s", (blob_id,))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return bytes(row["data"]), row["content_type"]
+
+
+def create_blob_store(backend=BLOB_BACKEND) -> BlobStore:
+    if backend == "postgres":
+        return PostgresBlobStore()
+    if backend == "filesystem":
+        return FilesystemBlobStore()
+    raise ValueError(f"Unknown BLOB_BACKEND: {backend}")
+
+
+blob_store = create_blob_store()
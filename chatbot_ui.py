@@ -1,7 +1,22 @@
+import uuid
+
 import streamlit as st
-from agent import ask   
+from agent import ask, warm_up
+from blob_store import blob_store, parse_image_ref
+
+
+@st.cache_resource
+def start_agent():
+    # Once per Streamlit process: the page renders while the agent is built in the background.
+    return warm_up(background=True)
+
 
 st.set_page_config(page_title="Copywriter AI", page_icon="✍️", layout="wide")
+start_agent()
+
+# ask() keeps conversation memory per session; each browser tab gets its own.
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
 
 st.title("✍️ Copywriter AI Agent")
 st.write("Generate ads, blogs, LinkedIn posts, resumes, captions, posters & more.")
@@ -12,8 +27,13 @@ user_input = st.text_area("Enter your request:", height=150, placeholder="e.g.,
 if st.button("Generate"):
     if user_input.strip():
         with st.spinner("Generating..."):
-            output = ask(user_input)
+            output = ask(user_input, st.session_state.session_id)["output"]
         st.success("Here’s your result:")
-        st.write(output)
+        image_id = parse_image_ref(output)
+        blob = blob_store.get(image_id) if image_id else None
+        if blob is not None:
+            st.image(blob[0])
+        else:
+            st.write(output)
     else:
-        st.warning("Please type something before hitting Generate.")
\ No newline at end of file
+        st.warning("Please type something before hitting Generate.")
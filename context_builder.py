@@ -0,0 +1,179 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from response_cache import split_reference
+from retrieval import estimate_tokens
+
+
+load_dotenv()
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "300"))
+# Messages kept per session in process memory; older ones only live on in the summary.
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "40"))
+# "extractive" (no extra LLM call), "llm" (the model rewrites the summary) or "off".
+HISTORY_SUMMARY_MODE = os.getenv("HISTORY_SUMMARY_MODE", "extractive")
+SUMMARY_CACHE_SESSIONS = 10000
+# The newest messages folded into a summary; finding them again tells where the summary ends.
+ANCHOR_MESSAGES = 4
+
+REFERENCE_PLACEHOLDER = "[reference file attached]"
+SUMMARY_PREFIX = "Summary of earlier conversation in this session:\n"
+
+
+def strip_reference(text: str) -> str:
+    """Drops a pasted "Reference file content" block from an earlier user turn, keeping the query."""
+    reference, query = split_reference(text)
+    if not reference:
+        return text
+    return f"{REFERENCE_PLACEHOLDER}\n{query.strip()}"
+
+
+def clean_history(messages) -> list:
+    cleaned = []
+    for message in messages:
+        if message.type == "human" and isinstance(message.content, str):
+            content = strip_reference(message.content)
+            if content is not message.content:
+                message = message.model_copy(update={"content": content})
+        cleaned.append(message)
+    return cleaned
+
+
+def _clip(text: str, chars: int) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= chars else text[:chars].rstrip() + "…"
+
+
+def _digest(messages) -> str:
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(message.type.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(str(message.content).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _anchor(messages):
+    tail = messages[-ANCHOR_MESSAGES:]
+    return len(tail), _digest(tail)
+
+
+def _find_anchor(messages, anchor) -> int:
+    """Index just past the newest run of messages matching `anchor`; 0 if it isn't there."""
+    if anchor is None:
+        return 0
+    size, digest = anchor
+    for end in range(len(messages), size - 1, -1):
+        if _digest(messages[end - size:end]) == digest:
+            return end
+    return 0
+
+
+def extractive_summary(previous: str, messages) -> str:
+    """One short line per dropped exchange, newest last; oldest lines go first once over budget."""
+    lines = previous.splitlines() if previous else []
+    for message in messages:
+        if message.type == "human":
+            lines.append(f"User asked: {_clip(message.content, 160)}")
+        else:
+            lines.append(f"You replied: {_clip(message.content, 120)}")
+    while lines and estimate_tokens("\n".join(lines)) > SUMMARY_TOKEN_BUDGET:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def llm_summary(llm, previous: str, messages) -> str:
+    transcript = "\n".join(f"{'User' if m.type == 'human' else 'Assistant'}: {_clip(m.content, 600)}"
+                           for m in messages)
+    request = (f"Update the running summary of a copywriting chat with the new turns below. "
+               f"Keep the user's requests, brand details and preferences; stay under "
+               f"{SUMMARY_TOKEN_BUDGET * 3 // 4} words.\n\nCurrent summary:\n{previous or '(none)'}"
+               f"\n\nNew turns:\n{transcript}")
+    return llm.invoke(request).content.strip()
+
+
+class ContextBuilder:
+    """
+    Builds the chat_history sent with each turn: the newest whole exchanges that fit in
+    `history_budget` tokens, with reference-file blocks stripped from earlier user turns, and
+    a summary of everything older in a single message placed after the system prompt. The
+    system prompt itself is never touched, so the request prefix stays byte-identical and
+    provider-side prompt caching can hit.
+
+    Summaries are updated incrementally. Per session it remembers the last messages folded in
+    (the anchor) and only summarizes what comes after them, so the summary keeps growing while
+    the head of the history is trimmed (HISTORY_MAX_MESSAGES) or the window slides
+    (MEMORY_BACKEND=postgres). If the anchor is no longer in the history, everything older has
+    already been summarized or has left the window, and all dropped messages are new.
+    """
+
+    def __init__(self, history_budget=HISTORY_TOKEN_BUDGET, mode=HISTORY_SUMMARY_MODE, llm=None):
+        self.history_budget = history_budget
+        self.mode = mode
+        self.llm = llm
+        self._summaries = OrderedDict()   # session_id -> (anchor, summary)
+        self._lock = threading.Lock()
+
+    def _split(self, messages):
+        """Index of the first kept message: newest exchanges that fit in the budget."""
+        used, start = 0, len(messages)
+        # Walk back an exchange (human + AI) at a time so a turn is never cut in half.
+        i = len(messages)
+        while i > 0:
+            j = i - 1
+            while j > 0 and messages[j].type != "human":
+                j -= 1
+            cost = sum(estimate_tokens(str(m.content)) for m in messages[j:i])
+            if used + cost > self.history_budget:
+                break
+            used += cost
+            start = i = j
+        return start
+
+    def _summarize(self, session_id, messages, count):
+        """The session's summary, extended with whatever of messages[:count] it doesn't cover yet."""
+        if self.mode == "off":
+            return ""
+        with self._lock:
+            anchor, summary = self._summaries.get(session_id, (None, "")) if session_id else (None, "")
+        new = messages[_find_anchor(messages, anchor):count]
+        if not new:
+            return summary
+        if self.mode == "llm" and self.llm is not None:
+            summary = llm_summary(self.llm, summary, new)
+        else:
+            summary = extractive_summary(summary, new)
+        if session_id:
+            with self._lock:
+                self._summaries[session_id] = (_anchor(messages[:count]), summary)
+                self._summaries.move_to_end(session_id)
+                while len(self._summaries) > SUMMARY_CACHE_SESSIONS:
+                    self._summaries.popitem(last=False)
+        return summary
+
+    def fold(self, messages, count, session_id):
+        """Folds the first `count` messages into the summary before they are trimmed from memory."""
+        if session_id and count > 0:
+            self._summarize(session_id, clean_history(messages), count)
+
+    def build(self, messages, session_id=None):
+        """Returns (chat_history messages, token estimates by part)."""
+        messages = clean_history(messages)
+        start = self._split(messages)
+        kept, dropped = messages[start:], messages[:start]
+        summary = self._summarize(session_id, messages, start)
+        history = kept
+        if summary:
+            # Imported here so importing this module (and agent.py) doesn't load LangChain.
+            from langchain_core.messages import SystemMessage
+            history = [SystemMessage(content=SUMMARY_PREFIX + summary)] + kept
+        tokens = {
+            "history": sum(estimate_tokens(str(m.content)) for m in kept),
+            "summary": estimate_tokens(summary),
+            "dropped": sum(estimate_tokens(str(m.content)) for m in dropped),
+        }
+        return history, tokens
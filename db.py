@@ -0,0 +1,189 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+
+load_dotenv()
+DB_HOST = os.getenv("DB_HOST")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+DB_PORT = os.getenv("DB_PORT")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# ThreadedConnectionPool raises as soon as it is empty; callers wait up to this long for a slot instead.
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_request_stats = threading.local()
+_totals = {"checkouts": 0, "reconnects": 0, "failed_health_checks": 0,
+           "waits": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0, "timeouts": 0}
+# One slot per connection the pool may hand out; held from checkout until putconn.
+_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_totals_lock = threading.Lock()
+
+
+def _create_pool():
+    return pool.ThreadedConnectionPool(
+        DB_POOL_MIN,
+        DB_POOL_MAX,
+        host=DB_HOST,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASS,
+        port=DB_PORT,
+        cursor_factory=RealDictCursor
+    )
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _create_pool()
+    return _pool
+
+
+def reset_pool():
+    """Drop every pooled connection and build a fresh pool (used after the server went away)."""
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, None
+    if old is not None:
+        try:
+            old.closeall()
+        except Exception:
+            pass
+    with _totals_lock:
+        _totals["reconnects"] += 1
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout():
+    db_pool = get_pool()
+    conn = db_pool.getconn()
+    if _is_healthy(conn):
+        return db_pool, conn
+
+    # Stale connection (server restart, idle timeout...): throw it away and try a new one.
+    with _totals_lock:
+        _totals["failed_health_checks"] += 1
+    db_pool.putconn(conn, close=True)
+    try:
+        conn = db_pool.getconn()
+        if _is_healthy(conn):
+            return db_pool, conn
+        db_pool.putconn(conn, close=True)
+    except psycopg2.Error:
+        pass
+
+    reset_pool()
+    db_pool = get_pool()
+    return db_pool, db_pool.getconn()
+
+
+def _acquire_slot():
+    if _slots.acquire(blocking=False):
+        return
+    started = time.perf_counter()
+    acquired = _slots.acquire(timeout=DB_POOL_TIMEOUT)
+    waited_ms = (time.perf_counter() - started) * 1000
+    with _totals_lock:
+        _totals["waits"] += 1
+        _totals["wait_ms_total"] += waited_ms
+        _totals["wait_ms_max"] = max(_totals["wait_ms_max"], waited_ms)
+        if not acquired:
+            _totals["timeouts"] += 1
+    if not acquired:
+        raise pool.PoolError(f"no database connection free after {DB_POOL_TIMEOUT:g}s (DB_POOL_MAX={DB_POOL_MAX})")
+
+
+@contextmanager
+def get_db_connection():
+    """
+    Borrow a connection from the shared pool, waiting up to DB_POOL_TIMEOUT when all of them
+    are checked out. Commits are left to the caller; anything uncommitted is rolled back
+    before the connection goes back to the pool.
+    """
+    _acquire_slot()
+    try:
+        db_pool, conn = _checkout()
+    except BaseException:
+        _slots.release()
+        raise
+    _request_stats.count = getattr(_request_stats, "count", 0) + 1
+    with _totals_lock:
+        _totals["checkouts"] += 1
+
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        try:
+            db_pool.putconn(conn, close=broken or bool(conn.closed))
+        except pool.PoolError:
+            # The pool was reset while this connection was checked out.
+            conn.close()
+        finally:
+            _slots.release()
+
+
+def reset_request_connection_count():
+    _request_stats.count = 0
+
+
+def request_connection_count():
+    return getattr(_request_stats, "count", 0)
+
+
+def pool_stats():
+    with _totals_lock:
+        stats = dict(_totals)
+    db_pool = _pool
+    stats["min_size"] = DB_POOL_MIN
+    stats["max_size"] = DB_POOL_MAX
+    stats["wait_ms_total"] = round(stats["wait_ms_total"], 2)
+    stats["wait_ms_max"] = round(stats["wait_ms_max"], 2)
+    if db_pool is not None:
+        stats["in_use"] = len(db_pool._used)
+        stats["idle"] = len(db_pool._pool)
+    else:
+        stats["in_use"] = 0
+        stats["idle"] = 0
+    return stats
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, None
+    if old is not None:
+        old.closeall()
@@ -0,0 +1,48 @@
+import re
+import zlib
+
+import numpy as np
+
+
+EMBEDDING_DIM = 512
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _features(text: str, char_ngrams: bool):
+    words = tokenize(text)
+    for word in words:
+        yield word, 1.0
+        if not char_ngrams:
+            continue
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            yield "c:" + padded[i:i + 3], 0.5
+    for first, second in zip(words, words[1:]):
+        yield f"b:{first} {second}", 1.0
+
+
+def embed(text: str, dim: int = EMBEDDING_DIM, char_ngrams: bool = True) -> np.ndarray:
+    """
+    Local hashed bag-of-features embedding (words, word bigrams and, for short texts,
+    character trigrams). No model download or network call; close paraphrases land
+    close in cosine space. Long passages should use a larger `dim` without char n-grams.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in _features(text, char_ngrams):
+        h = zlib.crc32(feature.encode("utf-8"))
+        sign = 1.0 if h & 0x80000000 else -1.0
+        vector[h % dim] += sign * weight
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+def embed_many(texts, dim: int = EMBEDDING_DIM, char_ngrams: bool = True) -> np.ndarray:
+    if not texts:
+        return np.zeros((0, dim), dtype=np.float32)
+    return np.stack([embed(text, dim, char_ngrams) for text in texts])
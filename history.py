@@ -0,0 +1,179 @@
+import os
+import json
+import uuid
+import base64
+import binascii
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from db import get_db_connection
+from metrics import timed
+
+
+load_dotenv()
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "20"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "100"))
+
+# Projections: field name -> SELECT expression. Listing only what the client asks for keeps
+# message bodies (which can carry whole reference files) out of title-only listings.
+SESSION_FIELDS = {
+    "session_id": "session_id",
+    "title": "COALESCE(title, 'New Chat') AS title",
+    "start_time": "start_time",
+    "end_time": "end_time",
+    "is_active": "is_active",
+}
+MESSAGE_FIELDS = {
+    "id": "id",
+    "created_at": "created_at",
+    "user": "message->>'user' AS \"user\"",
+    "ai": "message->>'ai' AS ai",
+}
+
+
+class PageError(ValueError):
+    """Invalid limit, cursor or fields; reported to the client as a 400."""
+
+
+def page_size(value) -> int:
+    if value in (None, ""):
+        return PAGE_SIZE_DEFAULT
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise PageError("limit must be an integer")
+    if size < 1:
+        raise PageError("limit must be at least 1")
+    return min(size, PAGE_SIZE_MAX)
+
+
+def parse_fields(value, allowed, keys):
+    """Requested fields (comma-separated, default all) plus the keyset columns the page needs."""
+    if not value:
+        requested = list(allowed)
+    else:
+        requested = [name.strip() for name in value.split(",") if name.strip()]
+        unknown = [name for name in requested if name not in allowed]
+        if unknown:
+            raise PageError(f"unknown fields: {', '.join(unknown)}; allowed: {', '.join(allowed)}")
+    selected = requested + [key for key in keys if key not in requested]
+    return requested, ", ".join(allowed[name] for name in selected)
+
+
+def encode_cursor(values) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value)
+
+
+def _uuid(value):
+    uuid.UUID(value)
+    return value
+
+
+def _row_id(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("not an integer id")
+    return value
+
+
+def decode_cursor(cursor, parsers):
+    """
+    Decodes a cursor made by encode_cursor(), one parser per key. Anything that doesn't parse
+    is a PageError, so a tampered cursor is a 400 rather than a database error.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise PageError("invalid cursor")
+    if not isinstance(values, list) or len(values) != len(parsers):
+        raise PageError("invalid cursor")
+    try:
+        return [parse(value) for parse, value in zip(parsers, values)]
+    except (TypeError, ValueError, AttributeError):
+        raise PageError("invalid cursor")
+
+
+def _page(rows, limit, requested, keys):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][key] for key in keys])
+    items = [{name: row[name] for name in requested} for row in rows]
+    return items, next_cursor
+
+
+@timed("db.list_all_sessions")
+def list_all_sessions(user_id, fields=None) -> list:
+    """
+    Every session of the user, newest first, as the bare list GET /sessions returned before it
+    was paginated. Served when a request has neither `limit` nor `cursor`.
+    """
+    requested, columns = parse_fields(fields, SESSION_FIELDS, ())
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT {columns} FROM sessions
+            WHERE user_id = %s
+            ORDER BY start_time DESC, session_id DESC
+        """, (user_id,))
+        return [dict(row) for row in cur.fetchall()]
+
+
+@timed("db.list_sessions")
+def list_sessions(user_id, limit=None, cursor=None, fields=None) -> dict:
+    """Newest sessions first, keyset-paginated on (start_time, session_id)."""
+    limit = page_size(limit)
+    keys = ("start_time", "session_id")
+    requested, columns = parse_fields(fields, SESSION_FIELDS, keys)
+    where, params = "user_id = %s", [user_id]
+    if cursor:
+        start_time, session_id = decode_cursor(cursor, (_timestamp, _uuid))
+        where += " AND (start_time, session_id) < (%s, %s)"
+        params += [start_time, session_id]
+
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT {columns} FROM sessions
+            WHERE {where}
+            ORDER BY start_time DESC, session_id DESC
+            LIMIT %s
+        """, params + [limit + 1])
+        rows = cur.fetchall()
+
+    sessions, next_cursor = _page(rows, limit, requested, keys)
+    return {"sessions": sessions, "next_cursor": next_cursor}
+
+
+@timed("db.list_messages")
+def list_messages(session_id, limit=None, cursor=None, fields=None, order="desc") -> dict:
+    """
+    One session's messages, keyset-paginated on id. "desc" (default) pages from the newest
+    turn backwards, as a chat UI scrolls up; "asc" replays the session from the start.
+    """
+    if order not in ("asc", "desc"):
+        raise PageError("order must be asc or desc")
+    limit = page_size(limit)
+    keys = ("id",)
+    requested, columns = parse_fields(fields, MESSAGE_FIELDS, keys)
+    where, params = "session_id = %s", [session_id]
+    if cursor:
+        (last_id,) = decode_cursor(cursor, (_row_id,))
+        where += " AND id < %s" if order == "desc" else " AND id > %s"
+        params.append(last_id)
+
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT {columns} FROM messages
+            WHERE {where}
+            ORDER BY id {order.upper()}
+            LIMIT %s
+        """, params + [limit + 1])
+        rows = cur.fetchall()
+
+    messages, next_cursor = _page(rows, limit, requested, keys)
+    return {"messages": messages, "next_cursor": next_cursor}
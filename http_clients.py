@@ -0,0 +1,342 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+import metrics
+
+
+load_dotenv()
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "8"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, httpx.TransportError)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class ServiceUnavailableError(Exception):
+    """Raised without calling the service: its breaker is open or its concurrency limit is full."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed attempts and rejects calls for
+    `reset_seconds`. Then a single trial call is let through (half-open): success closes
+    the breaker again, failure re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.counters = {"opened": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            self.counters["rejected"] += 1
+        raise ServiceUnavailableError(f"{self.name} circuit is open; failing fast")
+
+    def on_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.counters["opened"] += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+    def cancel_trial(self):
+        """A call ended without a verdict (cancelled, rejected locally); let another one try."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, **self.counters}
+
+
+http_attempts = metrics.register(metrics.Counter(
+    "copywriter_http_attempts_total", "Outbound HTTP attempts per service, by outcome."))
+
+
+def _backoff(attempt, retry_after=None):
+    # Full jitter: spreads retries from many workers instead of having them hit the service in lockstep.
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+class ServiceClient:
+    """
+    Shared keep-alive clients for one external service. Every call goes through the same policy:
+    connect/read timeouts, up to `max_retries` jittered retries on connection errors, timeouts,
+    429 and 5xx, a circuit breaker, and at most `max_concurrency` calls in flight.
+    """
+
+    def __init__(self, name, read_timeout, max_concurrency, max_retries=HTTP_MAX_RETRIES,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT):
+        self.name = name
+        self.read_timeout = read_timeout
+        self.connect_timeout = connect_timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker(name)
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_semaphores = weakref.WeakKeyDictionary()
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    # Concurrency limit
+
+    def _enter(self):
+        if not self._semaphore.acquire(timeout=self.read_timeout):
+            raise ServiceUnavailableError(f"{self.name}: {self.max_concurrency} calls already in flight")
+        with self._in_flight_lock:
+            self._in_flight += 1
+
+    def _exit(self):
+        with self._in_flight_lock:
+            self._in_flight -= 1
+        self._semaphore.release()
+
+    def _async_semaphore(self):
+        # asyncio primitives belong to one event loop; keep one per loop.
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._async_semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    # Retry loop shared by the requests session and the httpx transports
+
+    def _record(self, outcome):
+        http_attempts.inc(service=self.name, outcome=outcome)
+
+    def _should_retry_status(self, status_code, attempt):
+        if status_code in RETRY_STATUSES:
+            self.breaker.on_failure()
+            self._record(str(status_code))
+            return attempt < self.max_retries
+        self.breaker.on_success()
+        self._record("ok")
+        return False
+
+    def _send(self, send):
+        self._enter()
+        try:
+            return send()
+        finally:
+            self._exit()
+
+    async def _asend(self, send):
+        async with self._async_semaphore():
+            with self._in_flight_lock:
+                self._in_flight += 1
+            try:
+                return await send()
+            finally:
+                with self._in_flight_lock:
+                    self._in_flight -= 1
+
+    def _call(self, send):
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                response = self._send(send)
+            except RETRY_EXCEPTIONS:
+                self.breaker.on_failure()
+                self._record("error")
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(_backoff(attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.cancel_trial()
+                raise
+            if not self._should_retry_status(response.status_code, attempt):
+                return response
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            time.sleep(_backoff(attempt, retry_after))
+            attempt += 1
+
+    async def _acall(self, send):
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                response = await self._asend(send)
+            except RETRY_EXCEPTIONS:
+                self.breaker.on_failure()
+                self._record("error")
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(_backoff(attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                # Includes cancellation by a tool timeout.
+                self.breaker.cancel_trial()
+                raise
+            if not self._should_retry_status(response.status_code, attempt):
+                return response
+            retry_after = response.headers.get("Retry-After")
+            await response.aclose()
+            await asyncio.sleep(_backoff(attempt, retry_after))
+            attempt += 1
+
+    # requests (sync tools)
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=0)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        return self._call(lambda: self.session.request(method, url, **kwargs))
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    # httpx (async tools and the OpenAI-compatible LLM client)
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+
+    def httpx_client(self) -> httpx.Client:
+        return httpx.Client(transport=GuardedTransport(self, limits=self.limits()), timeout=self.timeout())
+
+    def httpx_async_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=GuardedAsyncTransport(self, limits=self.limits()), timeout=self.timeout())
+
+    async def arequest(self, method, url, **kwargs) -> httpx.Response:
+        # One pooled AsyncClient per event loop; its connections can't be shared across loops.
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = httpx.AsyncClient(timeout=self.timeout(), limits=self.limits())
+        return await self._acall(lambda: client.request(method, url, **kwargs))
+
+    async def apost(self, url, **kwargs) -> httpx.Response:
+        return await self.arequest("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        with self._in_flight_lock:
+            in_flight = self._in_flight
+        return {**self.breaker.stats(), "in_flight": in_flight, "max_concurrency": self.max_concurrency}
+
+
+class GuardedTransport(httpx.HTTPTransport):
+    """httpx transport that applies a ServiceClient's retries, breaker and concurrency limit."""
+
+    def __init__(self, service: ServiceClient, **kwargs):
+        super().__init__(**kwargs)
+        self.service = service
+
+    def handle_request(self, request):
+        request.read()  # buffered so the body can be re-sent on retry
+        return self.service._call(lambda: super(GuardedTransport, self).handle_request(request))
+
+
+class GuardedAsyncTransport(httpx.AsyncHTTPTransport):
+
+    def __init__(self, service: ServiceClient, **kwargs):
+        super().__init__(**kwargs)
+        self.service = service
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        return await self.service._acall(lambda: super(GuardedAsyncTransport, self).handle_async_request(request))
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def service_client(name, read_timeout, max_concurrency) -> ServiceClient:
+    """
+    Returns the shared client for `name`, creating it on first use. Defaults can be overridden
+    per service with <NAME>_READ_TIMEOUT and <NAME>_MAX_CONCURRENCY.
+    """
+    with _services_lock:
+        client = _services.get(name)
+        if client is None:
+            prefix = name.upper()
+            client = _services[name] = ServiceClient(
+                name,
+                read_timeout=float(os.getenv(f"{prefix}_READ_TIMEOUT", read_timeout)),
+                max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", max_concurrency))
+            )
+        return client
+
+
+def service_stats() -> dict:
+    with _services_lock:
+        clients = list(_services.values())
+    return {client.name: client.stats() for client in clients}
+
+
+def _breaker_samples():
+    return [({"service": name}, STATE_VALUES[stats["state"]]) for name, stats in service_stats().items()]
+
+
+def _in_flight_samples():
+    return [({"service": name}, stats["in_flight"]) for name, stats in service_stats().items()]
+
+
+metrics.register_gauges("copywriter_circuit_breaker_state",
+                        "Circuit breaker state per service (0=closed, 1=half-open, 2=open).", _breaker_samples)
+metrics.register_gauges("copywriter_http_in_flight", "Outbound HTTP calls in flight per service.", _in_flight_samples)
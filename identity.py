@@ -0,0 +1,198 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+import metrics
+from db import get_db_connection
+from metrics import timed
+
+
+load_dotenv()
+SESSION_MAX_AGE_HOURS = float(os.getenv("SESSION_MAX_AGE_HOURS", "24"))
+IDENTITY_CACHE_TTL_SECONDS = int(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "300"))
+IDENTITY_CACHE_MAX_ENTRIES = int(os.getenv("IDENTITY_CACHE_MAX_ENTRIES", "50000"))
+COOKIE_SECURE = os.getenv("COOKIE_SECURE", "false").lower() in ("1", "true", "yes")
+
+USER_HEADER, SESSION_HEADER = "X-User-Id", "X-Session-Id"
+USER_COOKIE, SESSION_COOKIE = "user_id", "session_id"
+USER_COOKIE_MAX_AGE = 365 * 24 * 3600
+
+
+class Identity:
+    """The user and session a request acts for, resolved from its headers or cookies."""
+
+    def __init__(self, user_id, session_id, new_user=False, new_session=False):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.new_user = new_user
+        self.new_session = new_session
+
+
+class IdentityCache:
+    """
+    Small LRU with a TTL in front of the users/sessions tables. Only rows known to exist are
+    cached, so a request for an unknown id always reaches the database.
+    """
+
+    def __init__(self, ttl_seconds=IDENTITY_CACHE_TTL_SECONDS, max_entries=IDENTITY_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), **self.counters}
+
+
+identity_cache = IdentityCache()
+
+
+def _parse_id(value):
+    """Client-supplied ids must be UUIDs; anything else is treated as absent."""
+    if not value:
+        return None
+    try:
+        return str(uuid.UUID(str(value).strip()))
+    except ValueError:
+        return None
+
+
+@timed("db.ensure_user")
+def ensure_user(user_id):
+    if identity_cache.get(("user", user_id)):
+        return
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (user_id) VALUES (%s) ON CONFLICT (user_id) DO NOTHING", (user_id,))
+        conn.commit()
+    identity_cache.put(("user", user_id), True)
+
+
+@timed("db.create_session")
+def create_session(user_id):
+    session_id = str(uuid.uuid4())
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO sessions (session_id, user_id) VALUES (%s, %s)
+            RETURNING start_time AT TIME ZONE current_setting('TimeZone') AS start_time
+        """, (session_id, user_id))
+        start_time = cur.fetchone()["start_time"]
+        conn.commit()
+    identity_cache.put(("session", session_id), (user_id, start_time))
+    return session_id
+
+
+@timed("db.lookup_session")
+def lookup_session(session_id):
+    """(owner user_id, start_time) of a session, or None if it doesn't exist."""
+    cached = identity_cache.get(("session", session_id))
+    if cached is not None:
+        return cached
+    with get_db_connection() as conn, conn.cursor() as cur:
+        # start_time is a server-local TIMESTAMP; read it back as an aware timestamp.
+        cur.execute("""
+            SELECT user_id, start_time AT TIME ZONE current_setting('TimeZone') AS start_time
+            FROM sessions WHERE session_id = %s
+        """, (session_id,))
+        row = cur.fetchone()
+    if row is None:
+        return None
+    info = (row["user_id"], row["start_time"])
+    identity_cache.put(("session", session_id), info)
+    return info
+
+
+def owns_session(user_id, session_id) -> bool:
+    session_id = _parse_id(session_id)
+    if user_id is None or session_id is None:
+        return False
+    info = lookup_session(session_id)
+    return info is not None and info[0] == user_id
+
+
+def _session_is_current(info, user_id):
+    owner, start_time = info
+    if owner != user_id:
+        return False
+    # Same rotation as before: a session is continued for SESSION_MAX_AGE_HOURS after it started.
+    return start_time is None or datetime.now(timezone.utc) - start_time <= timedelta(hours=SESSION_MAX_AGE_HOURS)
+
+
+def resolve(user_id=None, session_id=None, create=True) -> Identity:
+    """
+    Validates the ids a client sent. With `create`, a missing or malformed user id is replaced
+    by a new one, a well-formed id not seen before is registered as it is, and a missing,
+    foreign or expired session is replaced by a new one; without it, anything invalid comes
+    back as None.
+    """
+    user_id, session_id = _parse_id(user_id), _parse_id(session_id)
+    new_user = new_session = False
+    if user_id is None:
+        if not create:
+            return Identity(None, None)
+        user_id, new_user = str(uuid.uuid4()), True
+    if create:
+        ensure_user(user_id)
+
+    if session_id is not None:
+        info = lookup_session(session_id)
+        if info is None or not _session_is_current(info, user_id):
+            session_id = None
+    if session_id is None and create:
+        session_id, new_session = create_session(user_id), True
+    return Identity(user_id, session_id, new_user, new_session)
+
+
+def from_request(req, create=True, new_session=False) -> Identity:
+    """
+    Reads X-User-Id / X-Session-Id, falling back to the cookies set on earlier responses.
+    `new_session` ignores the session the client sent and starts a fresh one.
+    """
+    session_id = None if new_session else req.headers.get(SESSION_HEADER) or req.cookies.get(SESSION_COOKIE)
+    return resolve(req.headers.get(USER_HEADER) or req.cookies.get(USER_COOKIE), session_id, create=create)
+
+
+def apply(response, identity):
+    """Echoes the resolved ids as headers and cookies so the client can send them back."""
+    if identity is None or identity.user_id is None:
+        return response
+    response.headers[USER_HEADER] = identity.user_id
+    response.set_cookie(USER_COOKIE, identity.user_id, max_age=USER_COOKIE_MAX_AGE,
+                        httponly=True, samesite="Lax", secure=COOKIE_SECURE)
+    if identity.session_id is not None:
+        response.headers[SESSION_HEADER] = identity.session_id
+        response.set_cookie(SESSION_COOKIE, identity.session_id, max_age=int(SESSION_MAX_AGE_HOURS * 3600),
+                            httponly=True, samesite="Lax", secure=COOKIE_SECURE)
+    return response
+
+
+def _cache_samples():
+    return [({"stat": key}, value) for key, value in identity_cache.stats().items()]
+
+
+metrics.register_gauges("copywriter_identity_cache", "User/session lookup cache statistics.", _cache_samples)
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join("generated_banners", "cache"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_MB", "500")) * 1024 * 1024
+IMAGE_PROMPT_CACHE_MAX = int(os.getenv("IMAGE_PROMPT_CACHE_MAX", "5000"))
+
+INDEX_FILE = "index.json"
+
+
+def _digest(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class ImageCache:
+    """
+    Content-addressed disk cache for banner generation. Images are stored as
+    <sha256(prompt + model params)>.png next to a JSON index; prompt enhancements are
+    cached in the same index. Least recently used images are evicted past `max_bytes`.
+    """
+
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES, max_prompts=IMAGE_PROMPT_CACHE_MAX):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_prompts = max_prompts
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.counters = {"image_hits": 0, "image_misses": 0, "prompt_hits": 0, "prompt_misses": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("images", {})
+        index.setdefault("prompts", {})
+        # Drop entries whose file disappeared (manual cleanup, partial copies...).
+        for key in [k for k, e in index["images"].items() if not os.path.exists(os.path.join(self.directory, e["file"]))]:
+            del index["images"][key]
+        return index
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def total_bytes(self) -> int:
+        return sum(e["size"] for e in self._index["images"].values())
+
+    # Prompt enhancement
+
+    def get_prompt(self, input_text: str):
+        key = _digest(_normalize(input_text))
+        with self._lock:
+            entry = self._index["prompts"].get(key)
+            if entry is None:
+                self.counters["prompt_misses"] += 1
+                return None
+            entry["last_used"] = time.time()
+            self._dirty = True
+            self.counters["prompt_hits"] += 1
+            return entry["enhanced"]
+
+    def put_prompt(self, input_text: str, enhanced: str):
+        key = _digest(_normalize(input_text))
+        with self._lock:
+            prompts = self._index["prompts"]
+            prompts[key] = {"enhanced": enhanced, "last_used": time.time()}
+            if len(prompts) > self.max_prompts:
+                for old_key, _ in sorted(prompts.items(), key=lambda item: item[1]["last_used"])[:len(prompts) - self.max_prompts]:
+                    del prompts[old_key]
+            self._save_index()
+
+    # Rendered images
+
+    def image_key(self, prompt: str, params: dict) -> str:
+        return _digest({"prompt": prompt, **params})
+
+    def get_image(self, prompt: str, params: dict):
+        key = self.image_key(prompt, params)
+        with self._lock:
+            entry = self._index["images"].get(key)
+            if entry is not None:
+                try:
+                    with open(os.path.join(self.directory, entry["file"]), "rb") as f:
+                        data = f.read()
+                except OSError:
+                    del self._index["images"][key]
+                    self._dirty = True
+                    data = None
+                if data is not None:
+                    entry["last_used"] = time.time()
+                    self._dirty = True
+                    self.counters["image_hits"] += 1
+                    return data
+            self.counters["image_misses"] += 1
+            return None
+
+    def put_image(self, prompt: str, params: dict, image_bytes: bytes):
+        key = self.image_key(prompt, params)
+        filename = f"{key}.png"
+        path = os.path.join(self.directory, filename)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._index["images"][key] = {
+                "file": filename,
+                "size": len(image_bytes),
+                "prompt": prompt[:300],
+                "last_used": time.time()
+            }
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        images = self._index["images"]
+        total = self.total_bytes()
+        for key, entry in sorted(images.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except OSError:
+                pass
+            total -= entry["size"]
+            del images[key]
+            self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["images"] = len(self._index["images"])
+            stats["prompts"] = len(self._index["prompts"])
+            stats["bytes"] = self.total_bytes()
+            stats["max_bytes"] = self.max_bytes
+            return stats
+
+
+image_cache = ImageCache() if IMAGE_CACHE_ENABLED else None
+if image_cache is not None:
+    atexit.register(image_cache.flush)
@@ -0,0 +1,263 @@
+import os
+import time
+import textwrap
+import threading
+from io import BytesIO
+
+from dotenv import load_dotenv
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import metrics
+from metrics import span
+from blob_store import is_valid_blob_id
+
+
+load_dotenv()
+IMAGE_VARIANT_DIR = os.getenv("IMAGE_VARIANT_DIR", os.path.join("image_store", "variants"))
+IMAGE_VARIANT_MAX_BYTES = int(os.getenv("IMAGE_VARIANT_MAX_MB", "200")) * 1024 * 1024
+# Resized variants are snapped up to one of these widths so the cache stays small.
+IMAGE_VARIANT_WIDTHS = tuple(sorted(int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "256,512,1024").split(",")))
+THUMBNAIL_WIDTH = IMAGE_VARIANT_WIDTHS[0]
+OVERLAY_FONT_PATH = os.getenv("OVERLAY_FONT_PATH")   # a .ttf; Pillow's built-in font otherwise
+OVERLAY_MAX_CHARS = 300
+
+# format -> (Pillow format name, content type, default quality)
+FORMATS = {
+    "webp": ("WEBP", "image/webp", 80),
+    "jpeg": ("JPEG", "image/jpeg", 85),
+    "png": ("PNG", "image/png", None),
+}
+FORMAT_ALIASES = {"jpg": "jpeg"}
+SIZE_PRESETS = {"thumb": THUMBNAIL_WIDTH, "small": IMAGE_VARIANT_WIDTHS[0], "large": IMAGE_VARIANT_WIDTHS[-1]}
+OVERLAY_POSITIONS = ("top", "center", "bottom")
+
+
+class VariantError(ValueError):
+    """Invalid variant parameters; reported to the client as a 400."""
+
+
+class VariantSpec:
+    """What to derive from an original image: target width (None keeps it), format and quality."""
+
+    def __init__(self, width, fmt, quality):
+        self.width = width
+        self.fmt = fmt
+        self.quality = quality
+
+    @property
+    def key(self) -> str:
+        return f"w{self.width or 0}-q{self.quality or 0}.{self.fmt}"
+
+    @property
+    def content_type(self) -> str:
+        return FORMATS[self.fmt][1]
+
+
+def negotiate_format(accept_header):
+    """WebP when the client lists it explicitly (a bare */* doesn't count), else None."""
+    accept = parse_accept_header(accept_header or "", MIMEAccept)
+    for value, quality in accept:
+        if value == "image/webp" and quality > 0:
+            return "webp"
+    return None
+
+
+def _snap_width(value):
+    try:
+        width = int(value)
+    except (TypeError, ValueError):
+        raise VariantError("w must be an integer")
+    if width < 1:
+        raise VariantError("w must be positive")
+    for allowed in IMAGE_VARIANT_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return IMAGE_VARIANT_WIDTHS[-1]
+
+
+def parse_spec(args, accept_header=None, size=None):
+    """
+    Builds a VariantSpec from query parameters (w, size=thumb|small|large, format, q) and the
+    Accept header. Returns None when nothing asks for a variant, so the original bytes are served.
+    """
+    size = size or args.get("size")
+    if size is not None and size not in SIZE_PRESETS:
+        raise VariantError(f"size must be one of {', '.join(SIZE_PRESETS)}")
+    width = SIZE_PRESETS[size] if size else (_snap_width(args["w"]) if args.get("w") else None)
+
+    fmt = args.get("format")
+    if fmt:
+        fmt = FORMAT_ALIASES.get(fmt.lower(), fmt.lower())
+        if fmt not in FORMATS:
+            raise VariantError(f"format must be one of {', '.join(FORMATS)}")
+    else:
+        fmt = negotiate_format(accept_header)
+    if width is None and fmt in (None, "png"):
+        return None
+    fmt = fmt or "png"
+
+    quality = FORMATS[fmt][2]
+    if quality is not None and args.get("q"):
+        try:
+            quality = int(args["q"])
+        except ValueError:
+            raise VariantError("q must be an integer")
+        # Rounded to steps of 5 to bound the number of cached variants.
+        quality = max(30, min(95, 5 * round(quality / 5)))
+    return VariantSpec(width, fmt, quality)
+
+
+def render_variant(data: bytes, spec: VariantSpec) -> bytes:
+    # Pillow is imported on first use so it doesn't add to the apps' startup time.
+    from PIL import Image
+
+    image = Image.open(BytesIO(data))
+    image.load()
+    if spec.width and spec.width < image.width:
+        height = max(1, round(image.height * spec.width / image.width))
+        image = image.resize((spec.width, height), Image.LANCZOS)
+
+    pil_format = FORMATS[spec.fmt][0]
+    options = {}
+    if pil_format == "JPEG":
+        image = image.convert("RGB")
+        options = {"quality": spec.quality, "optimize": True, "progressive": True}
+    elif pil_format == "WEBP":
+        options = {"quality": spec.quality, "method": 4}
+    else:
+        options = {"optimize": True}
+    out = BytesIO()
+    image.save(out, pil_format, **options)
+    return out.getvalue()
+
+
+def _font(size):
+    from PIL import ImageFont
+
+    if OVERLAY_FONT_PATH:
+        return ImageFont.truetype(OVERLAY_FONT_PATH, size)
+    return ImageFont.load_default(size=size)
+
+
+def overlay_text(data: bytes, text: str, position: str = "bottom") -> bytes:
+    """
+    Draws banner copy on a semi-transparent band over an existing image, so the copy can be
+    changed without rendering the artwork again. Returns PNG bytes.
+    """
+    text = " ".join(text.split())
+    if not text:
+        raise VariantError("text cannot be empty")
+    if len(text) > OVERLAY_MAX_CHARS:
+        raise VariantError(f"text is limited to {OVERLAY_MAX_CHARS} characters")
+    if position not in OVERLAY_POSITIONS:
+        raise VariantError(f"position must be one of {', '.join(OVERLAY_POSITIONS)}")
+    from PIL import Image, ImageDraw
+
+    image = Image.open(BytesIO(data)).convert("RGBA")
+    width, height = image.size
+    font_size = max(12, width // 18)
+    font = _font(font_size)
+    draw = ImageDraw.Draw(image)
+    # Wrap to the image width using the average glyph width of this font.
+    char_width = max(1, draw.textlength("abcdefghijklmnopqrstuvwxyz", font=font) / 26)
+    lines = textwrap.wrap(text, width=max(8, int(width * 0.9 / char_width)))
+    line_height = int(font_size * 1.25)
+    padding = font_size // 2
+    band_height = line_height * len(lines) + 2 * padding
+    top = {"top": 0, "center": (height - band_height) // 2, "bottom": height - band_height}[position]
+
+    band = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    ImageDraw.Draw(band).rectangle([0, top, width, top + band_height], fill=(0, 0, 0, 150))
+    image = Image.alpha_composite(image, band)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        line_width = draw.textlength(line, font=font)
+        draw.text(((width - line_width) / 2, top + padding + i * line_height), line, font=font, fill=(255, 255, 255, 255))
+
+    out = BytesIO()
+    image.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+class VariantCache:
+    """
+    Derived images on disk as <dir>/<blob_id[:2]>/<blob_id>-<variant key>. Originals are
+    immutable, so a variant never goes stale; least recently used files are deleted once the
+    directory grows past `max_bytes`. The index is rebuilt from the directory on start.
+    """
+
+    def __init__(self, directory=IMAGE_VARIANT_DIR, max_bytes=IMAGE_VARIANT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._files = {}   # path -> (size, last_used)
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if not name.endswith(".tmp"):
+                    stat = os.stat(path)
+                    self._files[path] = (stat.st_size, stat.st_atime)
+
+    def _path(self, blob_id, spec):
+        return os.path.abspath(os.path.join(self.directory, blob_id[:2], f"{blob_id}-{spec.key}"))
+
+    def get_or_render(self, blob_id, spec, load_original):
+        """Path of the cached variant, rendering it from `load_original()` bytes on a miss."""
+        if not is_valid_blob_id(blob_id):
+            return None
+        path = self._path(blob_id, spec)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None and os.path.exists(path):
+                self._files[path] = (entry[0], time.time())
+                self.counters["hits"] += 1
+                return path
+            self.counters["misses"] += 1
+
+        data = load_original()
+        if data is None:
+            return None
+        with span("image.variant") as current:
+            variant = render_variant(data, spec)
+            current.payload("output", len(variant))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(variant)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._files[path] = (len(variant), time.time())
+            self._evict()
+        return path
+
+    def _evict(self):
+        total = sum(size for size, _ in self._files.values())
+        for path, (size, _) in sorted(self._files.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            del self._files[path]
+            self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"variants": len(self._files), "bytes": sum(size for size, _ in self._files.values()),
+                    **self.counters}
+
+
+variant_cache = VariantCache()
+
+
+def _stats_samples():
+    return [({"stat": key}, value) for key, value in variant_cache.stats().items()]
+
+
+metrics.register_gauges("copywriter_image_variants", "Resized/re-encoded image cache statistics.", _stats_samples)
@@ -0,0 +1,327 @@
+import os
+import time
+import uuid
+import tempfile
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+from dotenv import load_dotenv
+
+from db import get_db_connection
+import retrieval
+import metrics
+
+
+load_dotenv()
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "copywriter_uploads"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_CHUNK_CHARS = int(os.getenv("INGEST_CHUNK_CHARS", "65536"))
+INGEST_MAX_JOBS = 1000
+# The original file is stored as a single bytea value, so uploads are capped at this size.
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "20")) * 1024 * 1024
+# Request body limit for the apps (MAX_CONTENT_LENGTH): the file plus room for the multipart framing.
+UPLOAD_MAX_REQUEST_BYTES = UPLOAD_MAX_BYTES + 1024 * 1024
+
+READ_BLOCK = 64 * 1024
+UNSUPPORTED_TEXT = "Unsupported file format."
+FINISHED = ("done", "failed")
+
+
+class UploadTooLarge(ValueError):
+    """The spooled file exceeds UPLOAD_MAX_MB; reported to the client as a 413."""
+
+    def __init__(self, message=None):
+        super().__init__(message or f"File is larger than the {UPLOAD_MAX_BYTES // (1024 * 1024)} MB upload limit.")
+
+
+# Extractor registry: file extension -> generator of text pieces (a page, a paragraph, a block).
+# Extractors read from the spooled file on disk and never need the whole document in memory.
+EXTRACTORS = {}
+
+
+def register_extractor(*extensions):
+    def decorator(func):
+        for ext in extensions:
+            EXTRACTORS[ext.lower().lstrip(".")] = func
+        return func
+    return decorator
+
+
+def get_extractor(filename):
+    ext = os.path.splitext(filename.lower())[1].lstrip(".")
+    return EXTRACTORS.get(ext)
+
+
+@register_extractor("pdf")
+def extract_pdf(path):
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+@register_extractor("docx")
+def extract_docx(path):
+    import docx
+
+    document = docx.Document(path)
+    for i, paragraph in enumerate(document.paragraphs):
+        yield ("\n" if i else "") + paragraph.text
+
+
+@register_extractor("txt", "md", "csv", "tsv", "json", "log")
+def extract_plain_text(path):
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            block = f.read(READ_BLOCK)
+            if not block:
+                return
+            yield block
+
+
+class _TextCollector(HTMLParser):
+    SKIP = {"script", "style", "head"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self.skip_depth:
+            self.skip_depth -= 1
+        elif tag in ("p", "div", "br", "li", "h1", "h2", "h3", "h4", "tr"):
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+
+@register_extractor("html", "htm")
+def extract_html(path):
+    parser = _TextCollector()
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            block = f.read(READ_BLOCK)
+            if not block:
+                break
+            parser.feed(block)
+            if parser.parts:
+                yield "".join(parser.parts)
+                parser.parts = []
+    parser.close()
+    if parser.parts:
+        yield "".join(parser.parts)
+
+
+# Jobs and per-stage timing
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_stage_totals = {}
+
+
+def new_spool_path(filename):
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    ext = os.path.splitext(filename)[1].lower()
+    return os.path.join(UPLOAD_SPOOL_DIR, f"{uuid.uuid4().hex}{ext}")
+
+
+def _record_stage(job, stage, started=None, elapsed_ms=None):
+    if elapsed_ms is None:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    job["timings"][f"{stage}_ms"] = round(elapsed_ms, 2)
+    metrics.observe_stage(f"ingest.{stage}", elapsed_ms / 1000)
+    with _jobs_lock:
+        totals = _stage_totals.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        totals["count"] += 1
+        totals["total_ms"] += elapsed_ms
+        totals["max_ms"] = max(totals["max_ms"], elapsed_ms)
+
+
+def stage_stats():
+    with _jobs_lock:
+        return {stage: dict(totals) for stage, totals in _stage_totals.items()}
+
+
+def _snapshot(job):
+    status = {k: v for k, v in job.items() if k != "future"}
+    status["timings"] = dict(job["timings"])
+    return status
+
+
+def get_job(upload_id):
+    with _jobs_lock:
+        job = _jobs.get(upload_id)
+        return _snapshot(job) if job is not None else None
+
+
+def _create_upload_row(session_id, filename, content_type):
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO uploads (session_id, filename, file_data, content_type, extracted_text, auto_use)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, (session_id, filename, b"", content_type, "", False))
+        upload_id = cur.fetchone()["id"]
+        conn.commit()
+    return upload_id
+
+
+def submit_upload(session_id, filename, content_type, spool_path, spool_ms=0.0):
+    """
+    Registers an upload whose bytes are already spooled to `spool_path` and queues it for
+    background ingestion. Returns the upload id; progress is available through get_job().
+    Raises UploadTooLarge (after removing the spooled file) past UPLOAD_MAX_BYTES.
+    """
+    size = os.path.getsize(spool_path)
+    if size > UPLOAD_MAX_BYTES:
+        os.remove(spool_path)
+        raise UploadTooLarge()
+    try:
+        upload_id = _create_upload_row(session_id, filename, content_type)
+    except Exception:
+        os.remove(spool_path)
+        raise
+    job = {
+        "upload_id": upload_id,
+        "session_id": session_id,
+        "filename": filename,
+        "status": "queued",
+        "bytes": size,
+        "pieces": 0,
+        "chars": 0,
+        "error": None,
+        "timings": {}
+    }
+    _record_stage(job, "spool", elapsed_ms=spool_ms)
+    with _jobs_lock:
+        _jobs[upload_id] = job
+        job["future"] = _executor.submit(_ingest, job, spool_path)
+        _trim_jobs()
+    return upload_id
+
+
+def _trim_jobs():
+    # Oldest finished jobs go first; queued and running ones stay, someone may be waiting on them.
+    excess = len(_jobs) - INGEST_MAX_JOBS
+    if excess > 0:
+        for upload_id in [uid for uid, job in _jobs.items() if job["status"] in FINISHED][:excess]:
+            del _jobs[upload_id]
+
+
+def wait_for(upload_id, timeout=None):
+    """Blocks until the upload is processed and returns its status; None for an unknown id."""
+    with _jobs_lock:
+        job = _jobs.get(upload_id)
+    if job is None:
+        return None
+    job["future"].result(timeout=timeout)
+    # From the job itself: it may already have been trimmed from _jobs.
+    with _jobs_lock:
+        return _snapshot(job)
+
+
+# Each write borrows a pooled connection only for itself: extracting a long PDF must not hold a
+# pool slot that request handlers are waiting for.
+
+def _store_file_data(upload_id, spool_path):
+    # One bytea write from the spooled copy, off the request thread; submit_upload() caps its
+    # size at UPLOAD_MAX_BYTES, so this read is bounded.
+    with open(spool_path, "rb") as f:
+        data = f.read()
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("UPDATE uploads SET file_data = %s WHERE id = %s", (data, upload_id))
+        conn.commit()
+
+
+def _insert_chunk(upload_id, seq, content):
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO upload_chunks (upload_id, seq, content) VALUES (%s, %s, %s)",
+                    (upload_id, seq, content))
+        conn.commit()
+
+
+def _finalize(upload_id, session_id):
+    # Assemble the full text server-side and make this the session's auto-use upload.
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE uploads SET extracted_text = COALESCE(
+                (SELECT string_agg(content, '' ORDER BY seq) FROM upload_chunks WHERE upload_id = %s), '')
+            WHERE id = %s
+        """, (upload_id, upload_id))
+        cur.execute("UPDATE uploads SET auto_use=FALSE WHERE session_id=%s AND id <> %s", (session_id, upload_id))
+        cur.execute("UPDATE uploads SET auto_use=TRUE WHERE id=%s", (upload_id,))
+        conn.commit()
+
+
+def _store_text_chunks(job, pieces, chunker=None):
+    """Writes extracted text as ordered upload_chunks rows, a chunk at a time."""
+    buffer, size, seq = [], 0, 0
+    for piece in pieces:
+        if not piece:
+            continue
+        if chunker is not None:
+            chunker.feed(piece)
+        buffer.append(piece)
+        size += len(piece)
+        job["pieces"] += 1
+        job["chars"] += len(piece)
+        if size >= INGEST_CHUNK_CHARS:
+            _insert_chunk(job["upload_id"], seq, "".join(buffer))
+            buffer, size, seq = [], 0, seq + 1
+    if buffer:
+        _insert_chunk(job["upload_id"], seq, "".join(buffer))
+
+
+def _ingest(job, spool_path):
+    upload_id = job["upload_id"]
+    try:
+        job["status"] = "storing"
+        started = time.perf_counter()
+        _store_file_data(upload_id, spool_path)
+        _record_stage(job, "store_file", started)
+
+        job["status"] = "extracting"
+        started = time.perf_counter()
+        extractor = get_extractor(job["filename"])
+        chunker = retrieval.StreamingChunker() if retrieval.RETRIEVAL_ENABLED and extractor else None
+        if extractor is None:
+            _store_text_chunks(job, [UNSUPPORTED_TEXT])
+        else:
+            _store_text_chunks(job, extractor(spool_path), chunker)
+        _record_stage(job, "extract", started)
+
+        if chunker is not None:
+            job["status"] = "indexing"
+            started = time.perf_counter()
+            chunks = chunker.finish()
+            retrieval.index_store.save(upload_id, retrieval.VectorIndex.build(chunks))
+            job["retrieval_chunks"] = len(chunks)
+            _record_stage(job, "index", started)
+
+        job["status"] = "finalizing"
+        started = time.perf_counter()
+        _finalize(upload_id, job["session_id"])
+        _record_stage(job, "finalize", started)
+
+        job["status"] = "done"
+    except Exception as e:
+        traceback.print_exc()
+        job["status"] = "failed"
+        job["error"] = f"{type(e).__name__}: {str(e)}"
+    finally:
+        try:
+            os.remove(spool_path)
+        except OSError:
+            pass
@@ -0,0 +1,185 @@
+import os
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import metrics
+from blob_store import parse_image_ref
+
+
+load_dotenv()
+IMAGE_JOB_WORKERS = int(os.getenv("IMAGE_JOB_WORKERS", "4"))
+IMAGE_JOBS_MAX = int(os.getenv("IMAGE_JOBS_MAX", "1000"))
+# "sync" renders banners inside the request; "job" queues them and /query answers with a job id.
+IMAGE_MODE = os.getenv("IMAGE_MODE", "sync")
+
+JOB_REF_PREFIX = "job://"
+TERMINAL = ("done", "failed")
+
+
+def job_ref(job_id: str) -> str:
+    return f"{JOB_REF_PREFIX}{job_id}"
+
+
+def parse_job_ref(output):
+    """Returns the job id if `output` is a job reference, else None."""
+    if isinstance(output, str) and output.startswith(JOB_REF_PREFIX):
+        job_id = output[len(JOB_REF_PREFIX):].strip()
+        try:
+            return uuid.UUID(job_id).hex
+        except ValueError:
+            return None
+    return None
+
+
+class JobQueue:
+    """
+    Background jobs of one kind on a bounded worker pool. Jobs submitted with the same key
+    while an earlier one is still queued or running share that job instead of running twice.
+    Finished jobs are kept (up to `max_jobs`, oldest dropped first) so clients can poll them.
+
+    A job's result is whatever its function returns; a function can report failure by raising
+    or by returning a string that `is_failure` recognises.
+    """
+
+    def __init__(self, kind, workers, max_jobs=IMAGE_JOBS_MAX, is_failure=None):
+        self.kind = kind
+        self.max_jobs = max_jobs
+        self.is_failure = is_failure or (lambda result: False)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{kind}-job")
+        self._jobs = OrderedDict()   # job_id -> job dict
+        self._in_flight = {}         # dedup key -> job_id
+        self._callbacks = {}         # job_id -> [callable(job status)]
+        self._changed = threading.Condition()
+        self.counters = {"submitted": 0, "deduplicated": 0}
+
+    def submit(self, key, func, *args) -> str:
+        with self._changed:
+            job_id = self._in_flight.get(key)
+            if job_id is not None:
+                self.counters["deduplicated"] += 1
+                return job_id
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "kind": self.kind,
+                "status": "queued",
+                "result": None,
+                "error": None,
+                "version": 0,
+                "created_at": time.time(),
+                "timings": {}
+            }
+            self._in_flight[key] = job_id
+            self.counters["submitted"] += 1
+            self._trim()
+        self._executor.submit(self._run, job_id, key, func, args)
+        return job_id
+
+    def _trim(self):
+        while len(self._jobs) > self.max_jobs:
+            oldest = next(iter(self._jobs))
+            if self._jobs[oldest]["status"] not in TERMINAL:
+                break
+            self._jobs.popitem(last=False)
+            self._callbacks.pop(oldest, None)
+
+    def _update(self, job_id, **changes):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(changes)
+            job["version"] += 1
+            self._changed.notify_all()
+            return dict(job)
+
+    def _run(self, job_id, key, func, args):
+        job = self._update(job_id, status="running")
+        timings = {"queued_ms": round((time.time() - job["created_at"]) * 1000, 2)} if job else {}
+        started = time.perf_counter()
+        status, result, error = "done", None, None
+        try:
+            with metrics.span(f"job.{self.kind}"):
+                result = func(*args)
+            if self.is_failure(result):
+                status, error, result = "failed", str(result).strip(), None
+        except Exception as e:
+            traceback.print_exc()
+            status, error = "failed", f"{type(e).__name__}: {str(e)}"
+        timings["run_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        with self._changed:
+            # Same lock as on_done(), so a callback is either registered before this or sees the result.
+            self._in_flight.pop(key, None)
+            callbacks = self._callbacks.pop(job_id, [])
+            final = self._update(job_id, status=status, result=result, error=error, timings=timings)
+        for callback in callbacks:
+            self._call(callback, final)
+
+    @staticmethod
+    def _call(callback, job):
+        try:
+            callback(job)
+        except Exception:
+            traceback.print_exc()
+
+    def get(self, job_id):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def on_done(self, job_id, callback):
+        """
+        Calls `callback(job)` on a worker thread once the job finishes. If it already has, the
+        callback is queued on the pool rather than run here, so callers on an event loop never
+        run it themselves.
+        """
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if job["status"] not in TERMINAL:
+                self._callbacks.setdefault(job_id, []).append(callback)
+                return
+            job = dict(job)
+        self._executor.submit(self._call, callback, job)
+
+    def wait_change(self, job_id, version, timeout):
+        """Blocks until the job's version passes `version` (or `timeout`); returns the job."""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job["version"] > version or job["status"] in TERMINAL:
+                    return dict(job) if job is not None else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(job)
+                self._changed.wait(remaining)
+
+    def stats(self) -> dict:
+        with self._changed:
+            counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return {**counts, **self.counters}
+
+
+def _is_failed_image(result):
+    # The image tool reports errors as text instead of raising.
+    return parse_image_ref(result) is None
+
+
+image_jobs = JobQueue("image", IMAGE_JOB_WORKERS, is_failure=_is_failed_image)
+
+
+def _job_samples():
+    return [({"kind": image_jobs.kind, "stat": key}, value) for key, value in image_jobs.stats().items()]
+
+
+metrics.register_gauges("copywriter_jobs", "Background jobs by state, plus submitted/deduplicated totals.", _job_samples)
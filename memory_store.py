@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    from langchain.memory import ConversationBufferWindowMemory
+
+
+load_dotenv()
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "memory")
+MEMORY_WINDOW = int(os.getenv("MEMORY_WINDOW", "5"))
+MEMORY_TTL_SECONDS = int(os.getenv("MEMORY_TTL_HOURS", "24")) * 3600
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "10000"))
+
+
+def new_window_memory(k=MEMORY_WINDOW):
+    # Imported on first use: langchain.memory alone takes most of a second to import.
+    from langchain.memory import ConversationBufferWindowMemory
+    return ConversationBufferWindowMemory(memory_key="chat_history", k=k, return_messages=True)
+
+
+class MemoryStore:
+    """Where per-session conversation memory lives. get() always returns a usable memory."""
+
+    def get(self, session_id: str) -> "ConversationBufferWindowMemory":
+        raise NotImplementedError
+
+    def discard(self, session_id: str):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemoryStore(MemoryStore):
+    """
+    Process-local store. Lookups are O(1); entries expire `ttl` seconds after creation and
+    the least recently used session is evicted once `max_entries` is reached.
+    """
+
+    def __init__(self, ttl=MEMORY_TTL_SECONDS, max_entries=MEMORY_MAX_SESSIONS, k=MEMORY_WINDOW, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.k = k
+        self.clock = clock
+        self._entries = OrderedDict()   # session_id -> memory, in LRU order
+        self._created = OrderedDict()   # session_id -> creation time, oldest first
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expire(self, now):
+        # Creation times are monotonic in insertion order, so only the head can be expired.
+        while self._created:
+            session_id, created = next(iter(self._created.items()))
+            if now - created <= self.ttl:
+                break
+            self._created.popitem(last=False)
+            self._entries.pop(session_id, None)
+            self.expirations += 1
+
+    def get(self, session_id: str) -> "ConversationBufferWindowMemory":
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            mem = self._entries.get(session_id)
+            if mem is not None:
+                self._entries.move_to_end(session_id)
+                return mem
+
+            mem = new_window_memory(self.k)
+            self._entries[session_id] = mem
+            self._created[session_id] = now
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._created.pop(evicted, None)
+                self.evictions += 1
+            return mem
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+            self._created.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._entries),
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class PostgresMemoryStore(MemoryStore):
+    """
+    Rebuilds the window from the `messages` table on every call, so any worker serving a
+    session sees the same history and nothing is lost on restart. New turns are persisted
+    by app.save_message(); save_context() on the returned memory only affects this request.
+    Turns still queued in this process's write-behind queue are appended after the rows.
+    """
+
+    def __init__(self, k=MEMORY_WINDOW):
+        self.k = k
+
+    def get(self, session_id: str) -> "ConversationBufferWindowMemory":
+        from db import get_db_connection
+        from persistence import message_writer
+
+        # Taken before the SELECT: a turn committed in between shows up in the rows instead.
+        pending = message_writer.pending(session_id)
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, message FROM messages
+                WHERE session_id = %s
+                ORDER BY id DESC LIMIT %s
+            """, (session_id, self.k))
+            rows = cur.fetchall()
+
+        turns = []
+        for row in reversed(rows):
+            message = row["message"]
+            if isinstance(message, str):
+                message = json.loads(message)
+            turns.append((message.get("user", ""), message.get("ai", "")))
+        # By row id, not content: the same exchange sent twice in a row is still two turns.
+        row_ids = {row["id"] for row in rows}
+        turns += [(item.user_text, item.ai_text) for item in pending if item.row_id not in row_ids]
+
+        mem = new_window_memory(self.k)
+        for user_text, ai_text in turns[-self.k:]:
+            if isinstance(ai_text, str) and ai_text.startswith("data:image/"):
+                # Rows written before images moved to the blob store carry the whole base64 payload.
+                ai_text = "[generated image]"
+            mem.save_context({"input": user_text}, {"output": ai_text})
+        return mem
+
+    def stats(self) -> dict:
+        return {"backend": "postgres"}
+
+
+def create_memory_store(backend=MEMORY_BACKEND) -> MemoryStore:
+    if backend == "postgres":
+        return PostgresMemoryStore()
+    if backend == "memory":
+        return InMemoryStore()
+    raise ValueError(f"Unknown MEMORY_BACKEND: {backend}")
@@ -0,0 +1,180 @@
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+
+def _label_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in items]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}   # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': _format_value(float(bound))})} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+stage_calls = Counter("copywriter_stage_calls_total", "Calls per instrumented stage, by outcome.")
+stage_duration = Histogram("copywriter_stage_duration_seconds", "Wall time per instrumented stage.")
+stage_payload = Histogram("copywriter_stage_payload_bytes", "Payload sizes seen by a stage.", SIZE_BUCKETS)
+stage_tokens = Histogram("copywriter_stage_tokens", "Token counts seen by a stage.", TOKEN_BUCKETS)
+
+_registry = [stage_calls, stage_duration, stage_payload, stage_tokens]
+_gauge_sources = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def register_gauges(name, help_text, source):
+    """
+    `source()` returns a list of (labels dict, value) pairs read at scrape time, e.g. pool or
+    cache statistics that already live elsewhere.
+    """
+    _gauge_sources.append((name, help_text, source))
+
+
+class Span:
+    """Attributes recorded on a sampled span: payload sizes (bytes) and token counts."""
+
+    def __init__(self, stage, sampled):
+        self.stage = stage
+        self.sampled = sampled
+        self.status = "ok"
+
+    def payload(self, direction, size):
+        if self.sampled and size is not None:
+            stage_payload.observe(size, stage=self.stage, direction=direction)
+
+    def tokens(self, kind, count):
+        if self.sampled and count:
+            stage_tokens.observe(count, stage=self.stage, kind=kind)
+
+
+@contextmanager
+def span(stage):
+    """Times a stage. Call counts are always kept; histograms are sampled at METRICS_SAMPLE_RATE."""
+    current = Span(stage, random.random() < METRICS_SAMPLE_RATE)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        stage_calls.inc(stage=stage, status=current.status)
+        if current.sampled:
+            stage_duration.observe(time.perf_counter() - started, stage=stage)
+
+
+def timed(stage):
+    """Decorator form of span() for plain functions."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_stage(stage, seconds):
+    """Records a duration measured elsewhere (e.g. ingestion stage timings)."""
+    stage_calls.inc(stage=stage, status="ok")
+    if random.random() < METRICS_SAMPLE_RATE:
+        stage_duration.observe(seconds, stage=stage)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for name, help_text, source in _gauge_sources:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        try:
+            samples = source()
+        except Exception:
+            samples = []
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,15 @@
+-- Indexes behind the paginated /sessions and /sessions/<id>/messages listings and the
+-- per-session lookups on the hot path. Safe to re-run. On a large live database, create
+-- them by hand with CREATE INDEX CONCURRENTLY instead to avoid blocking writes.
+
+-- /sessions: WHERE user_id = ? ORDER BY start_time DESC, session_id DESC, keyset on both.
+CREATE INDEX IF NOT EXISTS sessions_user_start_idx
+    ON sessions (user_id, start_time DESC, session_id DESC);
+
+-- /sessions/<id>/messages and the Postgres memory window: WHERE session_id = ? ORDER BY id.
+CREATE INDEX IF NOT EXISTS messages_session_id_idx
+    ON messages (session_id, id);
+
+-- attach_upload_context: latest upload of a session.
+CREATE INDEX IF NOT EXISTS uploads_session_id_idx
+    ON uploads (session_id, id);
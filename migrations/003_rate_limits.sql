@@ -0,0 +1,7 @@
+-- Token buckets for RATE_LIMIT_BACKEND=postgres (rate_limit.py), shared by every worker.
+-- One row per (kind, scope, id); idle rows are pruned by the app. Safe to re-run.
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    bucket_key TEXT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at DOUBLE PRECISION NOT NULL   -- epoch seconds, database clock
+);
@@ -0,0 +1,131 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from dotenv import load_dotenv
+from pydantic import Field
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentStep
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+
+load_dotenv()
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "60"))
+# Sync path: threads per model step, i.e. per request; there is no process-wide cap.
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "16"))
+
+
+def parse_tool_timeouts(value: str) -> dict:
+    """"TavilySearch=15,GenerateImagePoster=90" -> {"TavilySearch": 15.0, "GenerateImagePoster": 90.0}"""
+    timeouts = {}
+    for item in (value or "").split(","):
+        name, _, seconds = item.partition("=")
+        if name.strip() and seconds.strip():
+            timeouts[name.strip()] = float(seconds)
+    return timeouts
+
+
+TOOL_TIMEOUTS = parse_tool_timeouts(os.getenv("TOOL_TIMEOUTS", ""))
+
+# The pool of the model step being run on this thread, set by ParallelAgentExecutor._iter_next_step.
+_step_pool = contextvars.ContextVar("tool_step_pool", default=None)
+
+
+class _PendingStep:
+    """A tool call already submitted to the step's pool; resolved by ParallelAgentExecutor._iter_next_step."""
+
+    def __init__(self, action):
+        self.action = action
+        self.future = None
+        self.started = None
+        self.running = threading.Event()
+
+    def run(self, func, *args):
+        self.started = time.monotonic()
+        self.running.set()
+        return func(*args)
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """
+    AgentExecutor that runs all tool calls from one model step at the same time, so a step that
+    asks for a search and a banner takes as long as the slower of the two. Each call gets a
+    timeout (`tool_timeouts[name]`, else `tool_timeout`), counted from when the call starts
+    running; a call that runs past it is abandoned and the agent sees a timeout message as that
+    tool's observation.
+
+    On the sync path each model step gets its own pool of up to TOOL_WORKERS threads. Slow or
+    abandoned calls in one request therefore never hold threads that another request needs.
+    """
+
+    tool_timeout: float = TOOL_TIMEOUT_SECONDS
+    tool_timeouts: dict = Field(default_factory=lambda: dict(TOOL_TIMEOUTS))
+
+    def timeout_for(self, tool_name: str) -> float:
+        return self.tool_timeouts.get(tool_name, self.tool_timeout)
+
+    def _timeout_step(self, action) -> AgentStep:
+        seconds = self.timeout_for(action.tool)
+        return AgentStep(action=action, observation=f"{action.tool} timed out after {seconds:g}s.")
+
+    # Sync: the base class performs actions one by one as its generator is consumed. Here each
+    # action is only submitted to the step's pool, and the futures are collected once all are running.
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        pool = _step_pool.get()
+        if pool is None:
+            return super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        step = _PendingStep(agent_action)
+        step.future = pool.submit(step.run, super()._perform_agent_action,
+                                  name_to_tool_map, color_mapping, agent_action, run_manager)
+        return step
+
+    def _await_step(self, step) -> AgentStep:
+        timeout = self.timeout_for(step.action.tool)
+        # Only more than TOOL_WORKERS calls in one step queue; waiting to start gets one more timeout.
+        if step.running.wait(timeout):
+            remaining = step.started + timeout - time.monotonic()
+            try:
+                return step.future.result(timeout=max(remaining, 0))
+            except FutureTimeoutError:
+                pass
+        # A thread can't be interrupted: drop the call if it hasn't started, otherwise let it
+        # finish in the background on this step's pool and ignore its result.
+        step.future.cancel()
+        return self._timeout_step(step.action)
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        # Copies contextvars into the workers so callbacks stay attached to the right run.
+        pool = ContextThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+        pending = []
+        token = _step_pool.set(pool)
+        try:
+            for item in super()._iter_next_step(name_to_tool_map, color_mapping, inputs,
+                                                intermediate_steps, run_manager):
+                if isinstance(item, _PendingStep):
+                    pending.append(item)
+                else:
+                    yield item
+        finally:
+            _step_pool.reset(token)
+        try:
+            for step in pending:
+                yield self._await_step(step)
+        finally:
+            # Threads are started on demand, so a step without tool calls costs nothing here.
+            pool.shutdown(wait=False)
+
+    # Async: the base class already gathers the calls; wrap each one in its timeout, which
+    # cancels the tool's coroutine when it fires.
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        try:
+            return await asyncio.wait_for(
+                super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager),
+                timeout=self.timeout_for(agent_action.tool)
+            )
+        except asyncio.TimeoutError:
+            return self._timeout_step(agent_action)
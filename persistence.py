@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+import traceback
+
+from dotenv import load_dotenv
+
+import metrics
+from metrics import span, timed
+
+
+load_dotenv()
+PERSIST_DURABLE = os.getenv("PERSIST_DURABLE", "false").lower() in ("1", "true", "yes")
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "200"))
+PERSIST_FLUSH_MS = int(os.getenv("PERSIST_FLUSH_MS", "50"))
+PERSIST_QUEUE_MAX = int(os.getenv("PERSIST_QUEUE_MAX", "10000"))
+# How long save_message() waits for room in a full queue before the write fails.
+PERSIST_QUEUE_TIMEOUT = float(os.getenv("PERSIST_QUEUE_TIMEOUT", "5"))
+PERSIST_SHUTDOWN_TIMEOUT = 10
+TITLE_CHARS = 50
+
+_STOP = object()
+
+
+class PendingWrite:
+    """
+    A queued message; wait() blocks until it is committed (or its write failed), and
+    add_done_callback() runs follow-up work at that point without blocking anyone.
+    """
+
+    def __init__(self, session_id, user_text, ai_text):
+        self.session_id = session_id
+        self.user_text = user_text
+        self.ai_text = ai_text
+        self.error = None
+        self.row_id = None   # messages.id, set inside the inserting transaction
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def finish(self, error=None):
+        self.error = error
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(error)
+            except Exception:
+                traceback.print_exc()
+
+    def add_done_callback(self, callback):
+        """Calls `callback(error)` once the write settles: from the writer, or here if it already has."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self.error)
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError("Message was not persisted in time")
+        if self.error is not None:
+            raise self.error
+
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages. A single background thread drains the queue into
+    multi-row INSERTs of up to `batch_size` rows, waiting at most `flush_ms` for a batch to
+    fill. Session titles are set in the same transaction with `WHERE title IS NULL`, so the
+    first message still names the session without counting the session's messages.
+
+    Until a message is committed, pending() still returns it, so a memory backend reading the
+    messages table can see the turn that was just answered.
+    """
+
+    def __init__(self, batch_size=PERSIST_BATCH_SIZE, flush_ms=PERSIST_FLUSH_MS, max_queue=PERSIST_QUEUE_MAX,
+                 put_timeout=PERSIST_QUEUE_TIMEOUT):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}   # session_id -> [PendingWrite], in submission order
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.counters = {"written": 0, "batches": 0, "failed": 0, "inline": 0, "queue_full": 0}
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, session_id, user_text, ai_text) -> PendingWrite:
+        """
+        Queues a turn. When the queue is full this blocks (up to `put_timeout`) rather than
+        writing the turn ahead of older ones for the same session; on timeout it raises.
+        """
+        item = PendingWrite(session_id, user_text, ai_text)
+        with self._lock:
+            self._pending.setdefault(session_id, []).append(item)
+        if self._closed:
+            self._write_inline(item)
+            return item
+        self._start()
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            self.counters["queue_full"] += 1
+            error = TimeoutError("Message queue is full")
+            self._settle(item, error)
+            raise error
+        return item
+
+    def pending(self, session_id) -> list:
+        """PendingWrites queued for a session but not committed yet, oldest first."""
+        with self._lock:
+            return list(self._pending.get(session_id, ()))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write_inline(self, item):
+        self.counters["inline"] += 1
+        self._write([item])
+
+    def _write(self, batch):
+        try:
+            self._insert(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                self._fail(batch[0], e)
+                return
+            # One bad row (e.g. a deleted session) must not drop the rest of the batch.
+            traceback.print_exc()
+            for item in batch:
+                try:
+                    self._insert([item])
+                except Exception as e:
+                    self._fail(item, e)
+
+    def _insert(self, batch):
+        from db import get_db_connection
+        from psycopg2.extras import execute_values
+
+        rows = [(item.session_id, json.dumps({"ai": item.ai_text, "user": item.user_text})) for item in batch]
+        titles = {}
+        for item in batch:
+            titles.setdefault(item.session_id, item.user_text[:TITLE_CHARS])
+
+        with span("db.write_messages"):
+            with get_db_connection() as conn, conn.cursor() as cur:
+                ids = execute_values(cur, "INSERT INTO messages (session_id, message) VALUES %s RETURNING id",
+                                     rows, page_size=self.batch_size, fetch=True)
+                # Before the commit: whoever can read a row can also tell which write it came from.
+                for item, row in zip(batch, ids):
+                    item.row_id = row["id"]
+                execute_values(cur, """
+                    UPDATE sessions SET title = v.title
+                    FROM (VALUES %s) AS v (session_id, title)
+                    WHERE sessions.session_id = v.session_id AND sessions.title IS NULL
+                """, list(titles.items()), page_size=self.batch_size)
+                conn.commit()
+
+        self.counters["batches"] += 1
+        self.counters["written"] += len(batch)
+        for item in batch:
+            self._settle(item)
+
+    def _fail(self, item, error):
+        print(f"[persistence] Failed to save message for session {item.session_id}:")
+        traceback.print_exc()
+        self.counters["failed"] += 1
+        self._settle(item, error)
+
+    def _settle(self, item, error=None):
+        with self._lock:
+            items = self._pending.get(item.session_id)
+            if items is not None:
+                try:
+                    items.remove(item)
+                except ValueError:
+                    pass
+                if not items:
+                    del self._pending[item.session_id]
+        item.finish(error)
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far is committed or failed."""
+        if self._thread is None:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("Message queue did not drain in time")
+            time.sleep(0.01)
+
+    def close(self, timeout=PERSIST_SHUTDOWN_TIMEOUT):
+        """Flushes the queue and stops the writer; later submits are written inline."""
+        self._closed = True
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(len(items) for items in self._pending.values())
+        return {"queue_depth": self.depth(), "pending": pending, **self.counters}
+
+
+message_writer = MessageWriter()
+atexit.register(message_writer.close)
+
+
+def save_message(session_id, user_text, ai_text, durable=PERSIST_DURABLE):
+    """Queues one chat turn; with `durable` it returns only once the row is committed."""
+    item = message_writer.submit(session_id, user_text, ai_text)
+    if durable:
+        item.wait()
+    return item
+
+
+@timed("db.replace_output")
+def replace_output(session_id, old_output, new_output):
+    """Rewrites the assistant side of a stored turn, e.g. a job:// reference once the job is done."""
+    from db import get_db_connection
+
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE messages SET message = jsonb_set(message, '{ai}', to_jsonb(%s::text))
+            WHERE session_id = %s AND message->>'ai' = %s
+        """, (new_output, session_id, old_output))
+        conn.commit()
+
+
+def _stats_samples():
+    return [({"stat": key}, value) for key, value in message_writer.stats().items()]
+
+
+metrics.register_gauges("copywriter_message_writer", "Write-behind message queue (queue_depth, pending, ...).",
+                        _stats_samples)
@@ -0,0 +1,343 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+import metrics
+
+
+load_dotenv()
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# "memory" keeps buckets per process; "postgres" shares them between workers (migrations/003).
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# "<scope>=<per minute>:<burst>" per scope; a scope left out is not limited.
+RATE_LIMIT_TEXT = os.getenv("RATE_LIMIT_TEXT", "user=30:10,session=20:5")
+RATE_LIMIT_IMAGE = os.getenv("RATE_LIMIT_IMAGE", "user=6:3,session=4:2")
+# A request that needs a token soon waits up to this long instead of being rejected...
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "2"))
+# ...unless this many requests are already waiting in this process.
+RATE_LIMIT_QUEUE_MAX = int(os.getenv("RATE_LIMIT_QUEUE_MAX", "64"))
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+# Buckets untouched for this long have refilled and are dropped.
+RATE_LIMIT_IDLE_SECONDS = 3600
+PRUNE_EVERY = 1000
+
+
+def parse_limits(value: str) -> dict:
+    """"user=30:10,session=20:5" -> {"user": (0.5, 10.0), "session": (0.333..., 5.0)} as (tokens/s, burst)."""
+    limits = {}
+    for item in (value or "").split(","):
+        scope, _, spec = item.partition("=")
+        per_minute, _, burst = spec.partition(":")
+        if scope.strip() and per_minute.strip():
+            per_minute = float(per_minute)
+            limits[scope.strip()] = (per_minute / 60, float(burst) if burst.strip() else max(1.0, per_minute))
+    return limits
+
+
+LIMITS = {"text": parse_limits(RATE_LIMIT_TEXT), "image": parse_limits(RATE_LIMIT_IMAGE)}
+
+
+class Decision:
+    """Outcome of reserve(): either admitted after `wait` seconds, or rejected until `retry_after`."""
+
+    def __init__(self, kind, allowed, wait=0.0, retry_after=0.0, scope=None, remaining=None):
+        self.kind = kind
+        self.allowed = allowed
+        self.wait = wait
+        self.retry_after = retry_after
+        self.scope = scope
+        self.remaining = remaining
+
+    @property
+    def retry_after_seconds(self) -> int:
+        return max(1, math.ceil(self.retry_after))
+
+    def message(self) -> str:
+        if self.scope == "queue":
+            return f"Too many requests are waiting; try again in {self.retry_after_seconds}s."
+        return f"Rate limit reached for {self.kind} requests per {self.scope}; try again in {self.retry_after_seconds}s."
+
+    def payload(self) -> dict:
+        return {"type": "error", "message": self.message(), "retry_after": self.retry_after_seconds}
+
+    def headers(self) -> dict:
+        if not self.allowed:
+            return {"Retry-After": str(self.retry_after_seconds)}
+        if self.remaining is not None:
+            return {"X-RateLimit-Remaining": str(self.remaining)}
+        return {}
+
+
+def _take(tokens, updated, now, rate, burst):
+    """Refills a bucket to `now` and takes one token; returns (tokens left, seconds until it is positive)."""
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    left = tokens - 1
+    return left, (-left / rate if left < 0 else 0.0)
+
+
+def _settle(buckets, states, now, max_wait):
+    """
+    Shared by the backends. `states` maps bucket key -> (tokens, updated_at) for the buckets
+    [(key, scope, rate, burst)] of one request; a missing bucket is full. Returns (new states,
+    or None if rejected, wait, rejecting scope, remaining, retry_after). A request may borrow
+    a token that refills within `max_wait` (the bucket goes negative), so queued requests are
+    spaced out at the refill rate instead of all waking up together.
+    """
+    wait, retry_after, remaining, scope, taken = 0.0, 0.0, None, None, {}
+    for key, bucket_scope, rate, burst in buckets:
+        tokens, updated = states.get(key, (burst, now))
+        left, needed = _take(tokens, updated, now, rate, burst)
+        taken[key] = (left, now)
+        if needed > max_wait:
+            if needed > retry_after:
+                retry_after, scope = needed, bucket_scope
+        elif needed > wait:
+            wait = needed
+        remaining = int(max(0, left)) if remaining is None else min(remaining, int(max(0, left)))
+    if retry_after > 0:
+        return None, 0.0, scope, 0, retry_after
+    return taken, wait, None, remaining, 0.0
+
+
+class RateLimitBackend:
+    """Where bucket state lives. reserve() must check and update all buckets of one request atomically."""
+
+    shared = False
+
+    def reserve(self, buckets, max_wait):
+        """Returns (allowed, wait, rejecting scope, remaining, retry_after)."""
+        raise NotImplementedError
+
+    def refund(self, buckets):
+        raise NotImplementedError
+
+    def prune(self):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemoryBackend(RateLimitBackend):
+    """Buckets in this process, least recently used dropped past `max_buckets`."""
+
+    def __init__(self, max_buckets=RATE_LIMIT_MAX_BUCKETS, clock=time.monotonic):
+        self.max_buckets = max_buckets
+        self.clock = clock
+        self._buckets = OrderedDict()   # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def reserve(self, buckets, max_wait):
+        with self._lock:
+            now = self.clock()
+            states = {key: self._buckets[key] for key, *_ in buckets if key in self._buckets}
+            taken, wait, scope, remaining, retry_after = _settle(buckets, states, now, max_wait)
+            if taken is None:
+                return False, 0.0, scope, 0, retry_after
+            for key, state in taken.items():
+                self._buckets[key] = state
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+            return True, wait, None, remaining, 0.0
+
+    def refund(self, buckets):
+        with self._lock:
+            for key, _, _, burst in buckets:
+                if key in self._buckets:
+                    tokens, updated = self._buckets[key]
+                    self._buckets[key] = (min(burst, tokens + 1), updated)
+
+    def prune(self):
+        with self._lock:
+            cutoff = self.clock() - RATE_LIMIT_IDLE_SECONDS
+            for key in [key for key, (_, updated) in self._buckets.items() if updated < cutoff]:
+                del self._buckets[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = self.clock()
+            limited = sum(1 for tokens, updated in self._buckets.values() if tokens < 1 and now - updated < 60)
+            return {"buckets": len(self._buckets), "buckets_empty": limited}
+
+
+class PostgresBackend(RateLimitBackend):
+    """
+    Buckets in the rate_limit_buckets table, so every worker draws from the same budget. Rows
+    are locked in key order for the duration of one reserve(); times come from the database
+    clock so workers with skewed clocks agree.
+    """
+
+    shared = True
+
+    def reserve(self, buckets, max_wait):
+        from db import get_db_connection
+
+        keys = sorted(key for key, *_ in buckets)
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT extract(epoch FROM clock_timestamp())::float8 AS now")
+            now = cur.fetchone()["now"]
+            # New buckets start full. Inserting them first gives FOR UPDATE a row to lock, so two
+            # first requests for the same key can't both start from a full bucket.
+            for key, _, _, burst in sorted(buckets):
+                cur.execute("""
+                    INSERT INTO rate_limit_buckets (bucket_key, tokens, updated_at) VALUES (%s, %s, %s)
+                    ON CONFLICT (bucket_key) DO NOTHING
+                """, (key, burst, now))
+            cur.execute("""
+                SELECT bucket_key, tokens, updated_at FROM rate_limit_buckets
+                WHERE bucket_key = ANY(%s) ORDER BY bucket_key FOR UPDATE
+            """, (keys,))
+            states = {row["bucket_key"]: (row["tokens"], row["updated_at"]) for row in cur.fetchall()}
+            taken, wait, scope, remaining, retry_after = _settle(buckets, states, now, max_wait)
+            if taken is None:
+                conn.rollback()
+                return False, 0.0, scope, 0, retry_after
+            for key in keys:
+                tokens, updated = taken[key]
+                cur.execute("UPDATE rate_limit_buckets SET tokens = %s, updated_at = %s WHERE bucket_key = %s",
+                            (tokens, updated, key))
+            conn.commit()
+        return True, wait, None, remaining, 0.0
+
+    def refund(self, buckets):
+        from db import get_db_connection
+
+        with get_db_connection() as conn, conn.cursor() as cur:
+            for key, _, _, burst in sorted(buckets):
+                cur.execute("UPDATE rate_limit_buckets SET tokens = LEAST(%s, tokens + 1) WHERE bucket_key = %s",
+                            (burst, key))
+            conn.commit()
+
+    def prune(self):
+        from db import get_db_connection
+
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM rate_limit_buckets
+                WHERE updated_at < extract(epoch FROM clock_timestamp()) - %s
+            """, (RATE_LIMIT_IDLE_SECONDS,))
+            conn.commit()
+
+    def stats(self) -> dict:
+        return {"backend": "postgres"}
+
+
+def create_backend(backend=RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    if backend == "postgres":
+        return PostgresBackend()
+    if backend == "memory":
+        return InMemoryBackend()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+
+
+class RateLimiter:
+    """
+    Admission control for agent turns: a token bucket per user and per session, with separate
+    budgets for text turns and image renders. A request that would get a token within
+    `max_wait` seconds waits for it (at most `queue_max` at a time); anything else is
+    rejected with a Retry-After so one client can't drain the shared model quotas.
+    """
+
+    def __init__(self, backend, limits=LIMITS, max_wait=RATE_LIMIT_MAX_WAIT_SECONDS,
+                 queue_max=RATE_LIMIT_QUEUE_MAX, enabled=RATE_LIMIT_ENABLED):
+        self.backend = backend
+        self.limits = limits
+        self.max_wait = max_wait
+        self.queue_max = queue_max
+        self.enabled = enabled
+        self.waiting = 0
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.counters = {kind: {"admitted": 0, "delayed": 0, "rejected": 0, "shed": 0} for kind in limits}
+
+    def _buckets(self, kind, user_id, session_id):
+        ids = {"user": user_id, "session": session_id}
+        return [(f"{kind}:{scope}:{ids[scope]}", scope, rate, burst)
+                for scope, (rate, burst) in self.limits[kind].items() if ids.get(scope)]
+
+    def _count(self, kind, stat):
+        with self._lock:
+            self.counters[kind][stat] += 1
+
+    def reserve(self, kind, user_id, session_id) -> Decision:
+        """Takes a token (or a place in the wait queue) without sleeping; see acquire()."""
+        buckets = self._buckets(kind, user_id, session_id) if self.enabled else []
+        if not buckets:
+            return Decision(kind, True)
+
+        allowed, wait, scope, remaining, retry_after = self.backend.reserve(buckets, self.max_wait)
+        if not allowed:
+            self._count(kind, "rejected")
+            return Decision(kind, False, retry_after=retry_after, scope=scope)
+        if wait > 0:
+            with self._lock:
+                queue_full = self.waiting >= self.queue_max
+                if not queue_full:
+                    self.waiting += 1
+            if queue_full:
+                self.backend.refund(buckets)
+                self._count(kind, "shed")
+                return Decision(kind, False, retry_after=wait, scope="queue")
+            self._count(kind, "delayed")
+
+        self._count(kind, "admitted")
+        with self._lock:
+            self._calls += 1
+            prune = self._calls % PRUNE_EVERY == 0
+        if prune:
+            self.backend.prune()
+        return Decision(kind, True, wait=wait, remaining=remaining)
+
+    def _done_waiting(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self, kind, user_id, session_id) -> Decision:
+        decision = self.reserve(kind, user_id, session_id)
+        if decision.allowed and decision.wait > 0:
+            try:
+                time.sleep(decision.wait)
+            finally:
+                self._done_waiting()
+        return decision
+
+    async def aacquire(self, kind, user_id, session_id) -> Decision:
+        if self.backend.shared:
+            decision = await asyncio.to_thread(self.reserve, kind, user_id, session_id)
+        else:
+            decision = self.reserve(kind, user_id, session_id)
+        if decision.allowed and decision.wait > 0:
+            try:
+                await asyncio.sleep(decision.wait)
+            finally:
+                self._done_waiting()
+        return decision
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = {kind: dict(values) for kind, values in self.counters.items()}
+            waiting = self.waiting
+        return {"enabled": self.enabled, "waiting": waiting, **counters, **self.backend.stats()}
+
+
+limiter = RateLimiter(create_backend())
+
+
+def _samples():
+    stats = limiter.stats()
+    samples = [({"kind": kind, "stat": stat}, value)
+               for kind in limiter.limits for stat, value in stats[kind].items()]
+    samples.append(({"kind": "all", "stat": "waiting"}, stats["waiting"]))
+    for stat in ("buckets", "buckets_empty"):
+        if stat in stats:
+            samples.append(({"kind": "all", "stat": stat}, stats[stat]))
+    return samples
+
+
+metrics.register_gauges("copywriter_rate_limit", "Admission control: admitted/delayed/rejected/shed turns, waiting requests and live buckets.", _samples)
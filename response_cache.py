@@ -0,0 +1,174 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+from embeddings import embed
+
+
+load_dotenv()
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+
+REFERENCE_MARKER = "Reference file content:"
+
+# Questions about the conversation itself can never be answered from another session's reply.
+HISTORY_PATTERNS = re.compile(
+    r"\b(previous|earlier|last|first|before)\b.*\b(question|message|ask|asked|request|said|query)\b"
+    r"|\bwhat did i\b|\bwhat was my\b|\bchat history\b",
+    re.IGNORECASE
+)
+UNCACHEABLE_OUTPUT_PREFIXES = (
+    "data:image/", "image://", "job://", "I encountered an error", "I couldn’t generate", " Image generation failed", " Tavily Search failed"
+)
+# Filler and instruction words that don't change what copy is being asked for.
+FILLER_WORDS = frozenset("""
+a an the and or of in on for to about with at by from into my our your me us i we you it this that
+please can could would will kindly just write create make generate give draft compose need want some
+""".split())
+
+
+def normalize_prompt(text: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def prompt_vector(normalized: str):
+    return embed(" ".join(word for word in normalized.split() if word not in FILLER_WORDS))
+
+
+def split_reference(user_input: str):
+    """Separates an attached "Reference file content" block from the actual user query."""
+    if not user_input.startswith(REFERENCE_MARKER):
+        return "", user_input
+    head, sep, query = user_input.rpartition("User Query:")
+    if not sep:
+        return user_input, ""
+    return head[len(REFERENCE_MARKER):], query
+
+
+def context_key(user_input: str, history_messages=()) -> str:
+    """
+    The part of a session that can change the answer to the same prompt: the attached
+    reference file and the most recent exchange in the conversation window.
+    """
+    reference, _ = split_reference(user_input)
+    digest = hashlib.sha256(reference.encode("utf-8"))
+    for message in list(history_messages)[-2:]:
+        digest.update(b"\x00")
+        digest.update(str(getattr(message, "content", message)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def is_cacheable_prompt(user_input: str) -> bool:
+    _, query = split_reference(user_input)
+    return not HISTORY_PATTERNS.search(query)
+
+
+def is_cacheable_output(output) -> bool:
+    return isinstance(output, str) and bool(output) and not output.startswith(UNCACHEABLE_OUTPUT_PREFIXES)
+
+
+class ResponseCache:
+    """
+    Two-tier response cache: exact match on (normalized prompt, context), then cosine
+    similarity over local embeddings of prompts that share the same context.
+    Entries expire after `ttl` seconds and the least recently used is evicted past `max_entries`.
+    """
+
+    def __init__(self, ttl=RESPONSE_CACHE_TTL_SECONDS, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 similarity=RESPONSE_CACHE_SIMILARITY, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.clock = clock
+        self._entries = OrderedDict()   # (context, normalized prompt) -> entry, in LRU order
+        self._by_context = {}           # context -> set of keys, for the similarity tier
+        self._lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "skipped": 0, "evictions": 0}
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._by_context.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_context[key[0]]
+
+    def _similar(self, context, vector, now):
+        keys = [k for k in self._by_context.get(context, ()) if self._entries[k]["expires"] > now]
+        if not keys:
+            return None
+        matrix = np.stack([self._entries[k]["vector"] for k in keys])
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+        return keys[best]
+
+    def get(self, user_input: str, context: str):
+        if not is_cacheable_prompt(user_input):
+            with self._lock:
+                self.counters["skipped"] += 1
+            return None
+
+        _, query = split_reference(user_input)
+        normalized = normalize_prompt(query)
+        key = (context, normalized)
+        with self._lock:
+            now = self.clock()
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires"] <= now:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters["exact_hits"] += 1
+                return entry["output"]
+
+            similar_key = self._similar(context, prompt_vector(normalized), now)
+            if similar_key is not None:
+                self._entries.move_to_end(similar_key)
+                self.counters["similar_hits"] += 1
+                return self._entries[similar_key]["output"]
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, user_input: str, context: str, output):
+        if not is_cacheable_prompt(user_input) or not is_cacheable_output(output):
+            return
+
+        _, query = split_reference(user_input)
+        normalized = normalize_prompt(query)
+        key = (context, normalized)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = {
+                "output": output,
+                "vector": prompt_vector(normalized),
+                "expires": self.clock() + self.ttl
+            }
+            self._by_context.setdefault(context, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["size"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+        lookups = stats["exact_hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["similar_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
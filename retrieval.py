@@ -0,0 +1,196 @@
+import os
+import json
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+from embeddings import embed, embed_many
+
+
+load_dotenv()
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() in ("1", "true", "yes")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "vector_index")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "1500"))
+RETRIEVAL_CHUNK_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "200"))
+RETRIEVAL_OVERLAP_TOKENS = int(os.getenv("RETRIEVAL_OVERLAP_TOKENS", "40"))
+LOADED_INDEX_CACHE = 32
+# Passages are long, so they get a wider, word-level embedding than cached prompts.
+INDEX_DIM = 4096
+MMR_LAMBDA = 0.7
+
+_WORD_RE = re.compile(r"\S+")
+
+
+def estimate_tokens(text: str) -> int:
+    return estimate_tokens_for_length(len(text)) if text else 0
+
+
+def estimate_tokens_for_length(chars: int) -> int:
+    # ~4 characters per token for English prose; good enough for budgeting.
+    return max(1, chars // 4) if chars else 0
+
+
+class StreamingChunker:
+    """
+    Turns a stream of text pieces into overlapping word-window chunks of roughly
+    `chunk_tokens` tokens, without ever joining the whole document.
+    """
+
+    def __init__(self, chunk_tokens=RETRIEVAL_CHUNK_TOKENS, overlap_tokens=RETRIEVAL_OVERLAP_TOKENS):
+        # Tokens are estimated from words at ~0.75 words per token.
+        self.chunk_words = max(20, int(chunk_tokens * 0.75))
+        self.overlap_words = min(int(overlap_tokens * 0.75), self.chunk_words // 2)
+        self.words = []
+        self.tail = ""
+        self.chunks = []
+
+    def feed(self, piece: str):
+        text = self.tail + piece
+        # Keep a trailing partial word for the next piece.
+        if text and not text[-1].isspace():
+            cut = max(text.rfind(" "), text.rfind("\n"))
+            text, self.tail = (text[:cut], text[cut:]) if cut >= 0 else ("", text)
+        else:
+            self.tail = ""
+        self.words.extend(_WORD_RE.findall(text))
+        while len(self.words) >= self.chunk_words:
+            self.chunks.append(" ".join(self.words[:self.chunk_words]))
+            self.words = self.words[self.chunk_words - self.overlap_words:]
+
+    def finish(self) -> list:
+        self.words.extend(_WORD_RE.findall(self.tail))
+        self.tail = ""
+        if self.words and (not self.chunks or len(self.words) > self.overlap_words):
+            self.chunks.append(" ".join(self.words))
+        self.words = []
+        return self.chunks
+
+
+def chunk_text(text: str, chunk_tokens=RETRIEVAL_CHUNK_TOKENS, overlap_tokens=RETRIEVAL_OVERLAP_TOKENS) -> list:
+    chunker = StreamingChunker(chunk_tokens, overlap_tokens)
+    chunker.feed(text)
+    return chunker.finish()
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorIndex:
+    """
+    Chunks of one upload and their embeddings (a float32 matrix, one row per chunk).
+    Search re-weights dimensions by inverse document frequency across the upload's chunks,
+    so boilerplate repeated on every page doesn't drown out the distinctive terms.
+    """
+
+    def __init__(self, chunks, vectors):
+        self.chunks = chunks
+        self.vectors = vectors
+        self.total_tokens = sum(estimate_tokens(c) for c in chunks)
+        df = np.count_nonzero(vectors, axis=0) if len(chunks) else np.zeros(INDEX_DIM)
+        self.idf = (np.log((len(chunks) + 1) / (df + 1)) + 1.0).astype(np.float32)
+        self.weighted = _normalize_rows(vectors * self.idf)
+
+    @classmethod
+    def build(cls, chunks):
+        return cls(chunks, embed_many(chunks, INDEX_DIM, char_ngrams=False))
+
+    def search(self, query: str, k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET) -> list:
+        """
+        Top-k chunks for `query` that fit in `token_budget`, returned in document order.
+        Candidates are picked by maximal marginal relevance so near-duplicate chunks
+        (the same section repeated across pages) don't crowd out other matches.
+        """
+        if not self.chunks:
+            return []
+        scores = self.weighted @ _normalize_rows(embed(query, INDEX_DIM, char_ngrams=False) * self.idf)
+        candidates = [int(i) for i in np.argsort(-scores)[:k * 4]]
+        picked, used = [], 0
+        while candidates and len(picked) < k:
+            if picked:
+                redundancy = (self.weighted[candidates] @ self.weighted[picked].T).max(axis=1)
+            else:
+                redundancy = np.zeros(len(candidates))
+            mmr = MMR_LAMBDA * scores[candidates] - (1 - MMR_LAMBDA) * redundancy
+            best = candidates.pop(int(np.argmax(mmr)))
+            cost = estimate_tokens(self.chunks[best])
+            if used + cost > token_budget:
+                continue
+            picked.append(best)
+            used += cost
+        return [self.chunks[i] for i in sorted(picked)]
+
+
+class IndexStore:
+    """Persists one VectorIndex per upload as <id>.npy + <id>.json under VECTOR_INDEX_DIR."""
+
+    def __init__(self, directory=VECTOR_INDEX_DIR):
+        self.directory = directory
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _paths(self, upload_id):
+        base = os.path.join(self.directory, str(int(upload_id)))
+        return f"{base}.npy", f"{base}.json"
+
+    def save(self, upload_id, index: VectorIndex):
+        os.makedirs(self.directory, exist_ok=True)
+        vectors_path, chunks_path = self._paths(upload_id)
+        np.save(vectors_path, index.vectors.astype(np.float32))
+        with open(chunks_path, "w") as f:
+            json.dump(index.chunks, f)
+        with self._lock:
+            self._remember(upload_id, index)
+
+    def _remember(self, upload_id, index):
+        self._loaded[upload_id] = index
+        self._loaded.move_to_end(upload_id)
+        while len(self._loaded) > LOADED_INDEX_CACHE:
+            self._loaded.popitem(last=False)
+
+    def load(self, upload_id):
+        with self._lock:
+            index = self._loaded.get(upload_id)
+            if index is not None:
+                self._loaded.move_to_end(upload_id)
+                return index
+        vectors_path, chunks_path = self._paths(upload_id)
+        try:
+            vectors = np.load(vectors_path)
+            with open(chunks_path, "r") as f:
+                chunks = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if vectors.shape != (len(chunks), INDEX_DIM):
+            return None
+        index = VectorIndex(chunks, vectors)
+        with self._lock:
+            self._remember(upload_id, index)
+        return index
+
+
+index_store = IndexStore()
+
+
+def reference_for_query(upload_id, text_chars: int, load_text, query: str,
+                        k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET) -> str:
+    """
+    The reference text to send with `query`: the whole file when it already fits the budget
+    (or no index exists), otherwise only the most relevant chunks. `text_chars` is the length
+    of the extracted text; `load_text()` is only called when the whole text is needed.
+    """
+    if not RETRIEVAL_ENABLED or estimate_tokens_for_length(text_chars) <= token_budget:
+        return load_text()
+    index = index_store.load(upload_id)
+    if index is None:
+        return load_text()
+    excerpts = index.search(query, k=k, token_budget=token_budget)
+    if not excerpts:
+        return load_text()
+    return "\n...\n".join(excerpts)
@@ -0,0 +1,67 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from context_builder import ContextBuilder, HISTORY_MAX_MESSAGES
+
+
+class RecordingLLM:
+    """Stands in for the model in HISTORY_SUMMARY_MODE=llm: the summary is the list of turn numbers seen."""
+
+    def __init__(self):
+        self.calls = []
+
+    def invoke(self, request):
+        previous = request.split("Current summary:\n")[1].split("\n\nNew turns:")[0]
+        turns = re.findall(r"User: question (\d+)", request.split("New turns:")[1])
+        self.calls.append((previous, turns))
+        seen = [] if previous == "(none)" else previous.split(",")
+        return AIMessage(content=",".join(seen + turns))
+
+
+def test_summary_is_extended_while_history_is_trimmed():
+    llm = RecordingLLM()
+    builder = ContextBuilder(history_budget=60, mode="llm", llm=llm)
+    messages = []
+    turns = HISTORY_MAX_MESSAGES  # twice as many messages as are kept
+    for turn in range(turns):
+        messages += [HumanMessage(content=f"question {turn} " + "word " * 10),
+                     AIMessage(content=f"answer {turn} " + "word " * 10)]
+        # Same order as agent._remember(): trimmed messages are folded in before they go.
+        excess = len(messages) - HISTORY_MAX_MESSAGES
+        if excess > 0:
+            builder.fold(messages, excess, "s1")
+            del messages[:excess]
+        history, tokens = builder.build(messages, "s1")
+
+    # Each call only sees the turns that newly left the budget, on top of the previous summary.
+    assert all(len(new) <= 1 for _, new in llm.calls)
+    for (_, _), (previous, _) in zip(llm.calls, llm.calls[1:]):
+        assert previous != "(none)"
+    summary = history[0].content.splitlines()[-1]
+    summarized = [int(turn) for turn in summary.split(",")]
+    assert summarized == list(range(len(summarized)))
+    # Every turn no longer in the kept history is in the summary, trimmed ones included.
+    first_kept = int(history[1].content.split()[1])
+    assert summarized[-1] == first_kept - 1
+    assert len(summarized) > (turns * 2 - HISTORY_MAX_MESSAGES) // 2
+
+
+def test_sliding_window_extends_summary():
+    llm = RecordingLLM()
+    builder = ContextBuilder(history_budget=60, mode="llm", llm=llm)
+    window = 10  # MEMORY_BACKEND=postgres rebuilds the last MEMORY_WINDOW exchanges every turn
+    all_messages = []
+    for turn in range(30):
+        all_messages += [HumanMessage(content=f"question {turn} " + "word " * 10),
+                         AIMessage(content=f"answer {turn} " + "word " * 10)]
+        history, _ = builder.build(list(all_messages[-window:]), "s2")
+
+    assert all(len(new) <= 1 for _, new in llm.calls)
+    summarized = [int(turn) for turn in history[0].content.splitlines()[-1].split(",")]
+    assert summarized == sorted(set(summarized))
+    assert len(llm.calls) == len(summarized)